@@ -8,5 +8,5 @@ The library can be imported, or used via the interfaces scripts providing interf
 - wsgi
 '''
 
-from .base import rules_set
+from .base import rules_set, execution_context
 
@@ -13,13 +13,22 @@ Example
                             'geometry': 'SRID=28992;POINT((125000 360000))'
                          })
     print(r.report())
+
+The state of each execution is kept apart from the rules_set, so a loaded rules_set can be executed
+by multiple threads at the same time. Then use the execution_context returned by `execute` to report:
+
+    e = r.execute( subject = {'result': True})
+    print(e.report())
 '''
 
+import collections
 import copy
 import datetime
+import itertools
 import locale
 import os
 import sys
+import traceback
 from abc import ABCMeta, abstractmethod
 try:
     import exceptions
@@ -28,15 +37,55 @@ except:
 
 import logging
 import logging.handlers
+import threading
+from multiprocessing.pool import ThreadPool
 
 import loaders
 import processors
 import tests
 import reporters
 
+_log_handlers = {}                                                       # log handlers by file name, shared by all rule sets in this process
+
+THREADS = 32                                                             # the number of threads used by rules_set.execute_async
+RULE_THREADS = 32                                                        # the number of threads used to execute rules concurrently
+_thread_pools = {}                                                       # (process id, name): thread pool; a pool doesn't survive forking
+_thread_pools_lock = threading.Lock()
+
+def _thread_pool(name = 'executions'):
+    '''
+    Private function; returns a thread pool of this process.
+
+    `name`      'executions' for the pool used by rules_set.execute_async, 'rules' for the pool used to execute
+                rules concurrently. These are kept apart, so an execution waiting for its rules never takes
+                the threads its rules need.
+    '''
+
+    with _thread_pools_lock:
+        key = (os.getpid(), name)
+        if not key in _thread_pools:
+            _thread_pools[key] = ThreadPool(RULE_THREADS if name == 'rules' else THREADS)
+        return _thread_pools[key]
+
+def _chunks(subjects, chunk_size):
+    '''
+    Private generator; yields lists of at most `chunk_size` subjects.
+    '''
+
+    subjects = iter(subjects)
+    while True:
+        chunk = list(itertools.islice(subjects, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
 class rules_set(object):
     '''
     Container object for a set of rules.
+
+    Once loaded, a rules_set and the definitions of its rules are not altered by executing it.
+    The state of an execution is kept in an `execution_context` returned by the `execute` method.
+    So a single rules_set can be executed many times, also by multiple threads at the same time.
     '''
 
     class Rules(object):
@@ -76,6 +125,8 @@ class rules_set(object):
             self.definition['break_on_true'] = False
         if not 'break_on_false' in self.definition.keys():
             self.definition['break_on_false'] = False
+        if not 'concurrent_rules' in self.definition.keys():
+            self.definition['concurrent_rules'] = False
 
         self.logger = self._setup_logging()
 
@@ -99,6 +150,8 @@ class rules_set(object):
         if 'reporter_args' in self.definition.keys():
             self.reporter_args = self.definition['reporter_args']
 
+        self._local = threading.local()                                  # holds the last execution of each thread
+
         self._rules = self.Rules()
         self.rules = []
         for rule in self.definition['rules']:
@@ -120,6 +173,39 @@ class rules_set(object):
                 self.logger.error('The type %s is not defined yet.' % definition['type'])
                 raise exceptions.NotImplementedError('The type %s is not defined yet or has unmet dependencies.' % definition['type'])
 
+        self._start_after = None
+        if self.definition['concurrent_rules']:
+            self._start_after = self._dependency_graph()
+
+
+    def _dependency_graph(self):
+        '''
+        Private method; returns for each rule the number of rules which should be committed before it can be started.
+
+        A rule depends on an earlier rule when it reads the subject and the earlier rule may alter it, or when
+        it uses the earlier rule via `rules` (eg. `rules.my_test` in the expression of an evaluate test). A rule
+        which may alter the subject depends on all earlier rules. So the subject is never altered while another
+        rule reads it, even when that rule reads other keys, and never before it is known that the execution
+        doesn't end earlier.
+        '''
+
+        start_after = []
+        for index, rule in enumerate(self.rules):
+            reads = rule._reads()
+            writes = rule._writes()
+            references = rule._rule_references()
+            last = -1                                                    # the index of the last rule this rule depends on
+            if writes is None or writes:
+                last = index - 1
+            else:
+                for earlier_index, earlier in enumerate(self.rules[:index]):
+                    earlier_writes = earlier._writes()
+                    if earlier.name in references or ((earlier_writes is None or earlier_writes) and (reads is None or reads)):
+                        last = earlier_index                            # the subject would be altered while this rule reads it
+            self.logger.debug('Rule "%s" can be started after %d rules are finished.' % (str(rule.name), last + 1))
+            start_after.append(last + 1)
+        return start_after
+
 
     def _setup_logging(self):
         '''
@@ -144,56 +230,251 @@ class rules_set(object):
             log_format = self.definition['logging']['format']
         formatter = logging.Formatter( log_format )
         if 'file' in self.definition['logging'].keys():
-            hdlr = logging.handlers.RotatingFileHandler(self.definition['logging']['file'], maxBytes= 1 * 1000000, backupCount=5)
+            handler_key = os.path.abspath(self.definition['logging']['file'])
+        else:
+            handler_key = None                                           # None stands for the stream handler on stderr
+        if handler_key in _log_handlers:                                 # re-use the handler when loading a rule set again,
+            hdlr = _log_handlers[handler_key]                            # so log lines don't get written multiple times
         else:
-            hdlr = logging.StreamHandler()
+            if handler_key:
+                hdlr = logging.handlers.RotatingFileHandler(self.definition['logging']['file'], maxBytes= 1 * 1000000, backupCount=5)
+            else:
+                hdlr = logging.StreamHandler()
+            _log_handlers[handler_key] = hdlr
         hdlr.setFormatter(formatter)
-        logger.addHandler(hdlr)
+        if not hdlr in logger.handlers:
+            logger.addHandler(hdlr)
 
         logger.info("Logger is activated on level: %s" % logging.getLevelName(log_level) )
         return logger
 
 
-    def execute(self, subject):
+    @property
+    def result(self):
+        '''
+        The subjects of the last execution of this rules_set in the current thread.
+        '''
+
+        execution = getattr(self._local, 'execution', None)
+        if execution is None:
+            raise exceptions.AttributeError("The rules_set should be executed before asking for a result.")
+        return execution.result
+
+
+    def execute(self, subject, execution = None):
         '''
         Executes processors and tests in the rules_set.
 
         this method should be called BEFORE the report method.
 
+        Returns an `execution_context` holding the results of the rules and the subjects of this execution.
+
         `subject`       is expected to be a dict which is passed to each rule.
+
+        `execution`     (optional) an execution_context returned by an earlier call of this method. The results of the
+                        rules are added to the results in that execution. This is useful to report on
+                        multiple subjects at once.
         '''
 
-        self.result = []                                                 # the rule_set has it's own result we can report on; we fill it with the subjects
-        self.result.append(copy.deepcopy(subject))                       # add the first subject to the rule_set result
+        if execution is None:
+            execution = execution_context(self)
+        execution._start(subject)
 
         self.logger.info("Start execution of rules")
         self.logger.debug('First subject: ' + str(subject))
 
-        for rule in self.rules:
-            self.logger.debug('Executing rule "%s" with subject "%s"' % (str(rule.name), str(subject)))
-            result = rule.execute(subject)
-            setattr(self._rules, rule.name, rule)                        # we add a reference to each executed rule here
-            if result:
-                self.result.append(copy.deepcopy(subject))               # and add each subject to the rule_set result as well
-                subject = result
-                if self.definition['break_on_true'] and result.decision:
-                    self.logger.info('Rule "%s" evaluated to True and ended execution due to break_on_true being True.' % str(rule.name))
-                    break
-                if self.definition['break_on_false'] and not result.decision:
-                    self.logger.info('Rule "%s" evaluated to False and ended execution due to break_on_false being True.' % str(rule.name))
+        if self._start_after:
+            self._execute_concurrently(execution)
+        else:
+            for rule in execution.rules:
+                self.logger.debug('Executing rule "%s" with subject "%s"' % (str(rule.name), str(execution.subject)))
+                if not execution._commit(rule, rule.execute(execution.subject)):
                     break
-            if not result:
-                self.logger.info('Rule "%s" returned False to end execution.' % str(rule.name))
-                break
         self.logger.info("Finished execution of rules")
 
+        self._local.execution = execution
+        return execution
 
-    def report(self, **kwargs):
+
+    def _execute_concurrently(self, execution):
+        '''
+        Private method; executes the rules of an execution, starting each rule in a thread as soon as the
+        rules it depends on are finished.
+
+        The outcome of the rules is committed in the order of the rules. So `break_on_true`, `break_on_false`
+        and the report are the same as when executing the rules one after another. Rules which were started
+        but come after the rule which ended the execution are reported as not executed.
+        '''
+
+        pool = _thread_pool('rules')
+        rules = execution.rules
+        started = {}                                                     # index: AsyncResult
+        for index, rule in enumerate(rules):
+            for later in range(index, len(rules)):
+                if not later in started and self._start_after[later] <= index:
+                    self.logger.debug('Starting rule "%s" with subject "%s"' % (str(rules[later].name), str(execution.subject)))
+                    started[later] = pool.apply_async(rules[later].execute, (execution.subject,))
+            if not execution._commit(rule, started.pop(index).get()):
+                for later in started:
+                    rules[later] = self.rules[later]._bind(execution)    # discard the outcome of rules which shouldn't have been executed
+                break
+
+
+    def _execute_safely(self, subject):
+        '''
+        Private method; executes the rules_set on a subject with an execution_context keeping
+        only the first and final subject. Errors are logged and kept in the execution_context.
+        '''
+
+        execution = execution_context(self, keep_history = False)
+        try:
+            self.execute(subject, execution)
+        except Exception as error:
+            self.logger.error('Could not evaluate rule_set with subject "%s" due to error: %s' % (str(subject), str(error)))
+            self.logger.debug(traceback.format_exc())
+            execution.error = error
+        return execution
+
+
+    def execute_async(self, subject, callback = None):
+        '''
+        Executes processors and tests in the rules_set in a background thread.
+
+        Returns an `AsyncResult` right away. Its `get` method waits for the execution to finish and
+        returns the `execution_context`. When given, `callback` is called with the execution_context
+        when the execution is finished.
+
+        Most rules spend their time waiting on a web service or a database. Executing subjects
+        in threads lets a single process keep many subjects in flight. The number of threads
+        is set by `THREADS` in this module.
+
+        Errors are kept in the `error` property of the execution_context, like in `execute_many`.
+        '''
+
+        return _thread_pool().apply_async(self._execute_safely, (subject,), callback = callback)
+
+
+    def execute_chunk(self, subjects):
+        '''
+        Executes processors and tests in the rules_set for a list of subjects at once, rule by rule.
+
+        Returns a list with an `execution_context` for each subject, in the order of the subjects.
+        The execution of each subject is the same as with `execute`: break_on_true, break_on_false and
+        rules returning False end the execution of that subject only.
+
+        A rule having an `_execute_batch(rules, subjects)` method executes for all subjects which are still
+        being executed at once, eg. with a single database query. `rules` are the copies of the rule bound
+        to the execution of each subject, and a list with the value `execute` would have returned for each
+        subject is expected back. When it fails, the rule is executed for each subject on its own.
+
+        Errors are logged and kept in the `error` property of the execution_context of a subject, like in `execute_many`.
+        '''
+
+        executions = []
+        for subject in subjects:
+            execution = execution_context(self, keep_history = False)
+            execution._start(subject)
+            executions.append(execution)
+
+        self.logger.info("Start execution of rules for %d subjects" % len(executions))
+        active = list(executions)
+        for index, rule in enumerate(self.rules):
+            if not active:
+                break
+            results = None
+            if hasattr(rule, '_execute_batch') and len(active) > 1:
+                self.logger.debug('Executing rule "%s" for %d subjects at once' % (str(rule.name), len(active)))
+                try:
+                    results = rule._execute_batch([execution.rules[index] for execution in active],
+                                                  [execution.subject for execution in active])
+                except Exception as error:
+                    self.logger.error('Could not execute rule "%s" for %d subjects at once due to error: %s. Executing it for each subject.' % (str(rule.name), len(active), str(error)))
+                    self.logger.debug(traceback.format_exc())
+                    results = None
+                    for execution in active:
+                        execution.rules[index] = rule._bind(execution)  # start again with a clean copy
+            still_active = []
+            for position, execution in enumerate(active):
+                try:
+                    if results is None:
+                        result = execution.rules[index].execute(execution.subject)
+                    else:
+                        result = results[position]
+                    if execution._commit(execution.rules[index], result):
+                        still_active.append(execution)
+                except Exception as error:
+                    self.logger.error('Could not evaluate rule_set with subject "%s" due to error: %s' % (str(execution.result[0]), str(error)))
+                    self.logger.debug(traceback.format_exc())
+                    execution.error = error
+            active = still_active
+        self.logger.info("Finished execution of rules for %d subjects" % len(executions))
+        return executions
+
+
+    def execute_many(self, subjects, in_flight = 1, chunk_size = 1):
+        '''
+        Executes processors and tests in the rules_set for each subject in `subjects`.
+
+        `subjects`      is expected to be an iterable of dicts, eg. a list or a csv.DictReader.
+
+        `in_flight`     (optional) the number of subjects (or chunks of subjects) executed at the same time, each in
+                        its own thread. Defaults to 1. Useful when rules spend their time waiting on web services or databases.
+
+        `chunk_size`    (optional) the number of subjects executed at once with `execute_chunk`. Defaults to 1.
+                        Rules like tests.postgis_spatial_select then use a single query for a chunk of subjects.
+
+        This is a generator yielding an `execution_context` for each subject, in the order of the subjects.
+        Each execution_context has its own results, so reports on different subjects are never mixed.
+        These execution_contexts only keep the first and the final subject, and nothing is kept by the
+        rules_set. So memory use doesn't grow with the number of subjects, as long as the caller doesn't
+        keep the yielded execution_contexts.
+
+        When a subject can't be evaluated due to an error, the error is logged and kept in the `error`
+        property of the execution_context of that subject, and the next subject is executed.
+
+        Example:
+
+            for e in r.execute_many(csv.DictReader(f)):
+                print(e.decisions)
+        '''
+
+        if chunk_size > 1:
+            work = self.execute_chunk
+            tasks = _chunks(subjects, chunk_size)
+        else:
+            work = lambda subject: [self._execute_safely(subject)]
+            tasks = subjects
+
+        if in_flight <= 1:
+            for task in tasks:
+                for execution in work(task):
+                    yield execution
+            return
+
+        pool = ThreadPool(in_flight)
+        pending = collections.deque()
+        try:
+            for task in tasks:
+                pending.append(pool.apply_async(work, (task,)))
+                if len(pending) >= in_flight:
+                    for execution in pending.popleft().get():
+                        yield execution
+            while pending:
+                for execution in pending.popleft().get():
+                    yield execution
+        finally:
+            pool.terminate()
+
+
+    def report(self, execution = None, **kwargs):
         '''
         Report the result of the rules.
 
         this method should be called AFTER the execute method.
 
+        `execution`     (optional) the execution to report on. Defaults to the last execution of this
+                        rules_set in the current thread.
+
         The default reporter module is reporters.md.
 
         if `reporter` is part of the definition of the rule set,
@@ -214,8 +495,8 @@ class rules_set(object):
             reporter_args:
               output_format: html
 
-        If no arguments are defined in the rule set, 
-        arguments passed in this report method will be passed to the reporter.
+        Arguments passed in this report method will be passed to the reporter as well,
+        and overrule the arguments with the same name defined in the rule set.
 
         The 'rule_set_reporter' method in the default reporter reporters.md accepts 
         an optional `output_format` parameter which is expected to be one of:
@@ -225,10 +506,105 @@ class rules_set(object):
         - 'pdf'
         '''
 
-        if self.reporter_args:
-            if 'output_format' in kwargs:
-                return self.reporter_module.rule_set_reporter(self, output_format = kwargs['output_format'], **self.reporter_args)
-            else:
-                return self.reporter_module.rule_set_reporter(self, **self.reporter_args)
-        else:
-            return self.reporter_module.rule_set_reporter(self, **kwargs)
+        if execution is None:
+            execution = getattr(self._local, 'execution', None)
+        if execution is None:
+            raise exceptions.AttributeError("The rules_set should be executed before reporting.")
+        return execution.report(**kwargs)
+
+
+class execution_context(object):
+    '''
+    The state of a single execution of a rules_set.
+
+    An execution_context is returned by `rules_set.execute`. It can be passed to a reporter
+    in place of the rules_set, as it has the same `definition`, `rules` and `result` properties.
+
+    - `definition`      the definition of the rules_set.
+    - `rules`           the rules as executed on the subject, in order.
+    - `result`          a list of subjects; the first subject and the subject after each executed rule.
+                        When `keep_history` is `False` only the first subject is kept.
+    - `subject`         the subject as it is after execution.
+    - `decisions`       an ordered dict with the decision of each executed test by name.
+    - `reports`         an ordered dict with the reported strings of each rule by name.
+    - `error`           the error which ended the execution, or `None`.
+    - `cache`           a dict where rules keep what they derived from the subject (eg. a parsed html document),
+                        to share it with the other rules of this execution. It is emptied for each subject.
+    '''
+
+    def __init__(self, rule_set, keep_history = True):
+        self.rule_set = rule_set
+        self.keep_history = keep_history
+        self.error = None
+        self.definition = rule_set.definition
+        self.logger = rule_set.logger
+        self._rules = rule_set.Rules()                                   # references to executed rules of this execution only
+        self.rules = [rule._bind(self) for rule in rule_set.rules]
+        self.result = []
+        self.subject = None
+        self.cache = {}
+
+    def _start(self, subject):
+        '''
+        Private method; prepares the execution of the rules on the subject.
+        '''
+
+        self.result = []                                                 # the execution has it's own result we can report on; we fill it with the subjects
+        self.result.append(copy.deepcopy(subject))                       # add the first subject to the result
+        self.subject = subject
+        self.cache = {}
+
+    def _commit(self, rule, result):
+        '''
+        Private method; processes the outcome of an executed rule.
+
+        `rule`       the executed rule.
+
+        `result`     the value returned by the execute method of the rule.
+
+        Returns True when execution should continue with the next rule, False otherwise.
+        '''
+
+        setattr(self._rules, rule.name, rule)                            # we add a reference to each executed rule here
+        if not result:
+            self.logger.info('Rule "%s" returned False to end execution.' % str(rule.name))
+            return False
+
+        if self.keep_history:
+            self.result.append(copy.deepcopy(self.subject))              # and add each subject to the result as well
+        self.subject = result
+        decision = getattr(rule, 'decision', None)                       # processors don't decide
+        if self.definition['break_on_true'] and decision:
+            self.logger.info('Rule "%s" evaluated to True and ended execution due to break_on_true being True.' % str(rule.name))
+            return False
+        if self.definition['break_on_false'] and decision is not None and not decision:
+            self.logger.info('Rule "%s" evaluated to False and ended execution due to break_on_false being True.' % str(rule.name))
+            return False
+        return True
+
+    @property
+    def decisions(self):
+        '''
+        An ordered dict with the decision of each executed test by name.
+        '''
+
+        return collections.OrderedDict((rule.name, bool(rule.decision)) for rule in self.rules if rule.executed and hasattr(rule, 'decision'))
+
+    @property
+    def reports(self):
+        '''
+        An ordered dict with the reported strings of each rule by name. Rules with `report` set to `False` are left out.
+        '''
+
+        return collections.OrderedDict((rule.name, list(rule.result)) for rule in self.rules if rule.definition['report'])
+
+    def report(self, **kwargs):
+        '''
+        Report the result of this execution.
+
+        See `rules_set.report` for the arguments. Arguments passed here overrule the `reporter_args` of the rule set.
+        '''
+
+        reporter_args = dict(self.rule_set.reporter_args or {})
+        reporter_args.update(kwargs)
+        return self.rule_set.reporter_module.rule_set_reporter(self, **reporter_args)
@@ -8,14 +8,30 @@ Of course this example is functional, but might be improved on with eg. more err
 with the user.
 
 eg. ./batch.py examples/rule_sets/batch_geocode_tab.yaml examples/subjects/batch_geocode.csv ./batch_result.csv
+
+To execute subjects in parallel, give the number of worker processes to use:
+
+eg. ./batch.py --workers 4 examples/rule_sets/batch_geocode_tab.yaml examples/subjects/batch_geocode.csv ./batch_result.csv
 '''
 
 import argparse
 import csv
+import json
+import multiprocessing
 import os
 import sys
+import time
 import traceback
 
+try:
+    # python2
+    import Queue
+    from cStringIO import StringIO
+except ImportError:
+    # python3
+    import queue as Queue
+    from io import StringIO
+
 try:
     import exceptions
 except:
@@ -30,36 +46,301 @@ import geoDSS
 from geoDSS import reporters
 from geoDSS import loaders
 
+CHUNK_SECONDS = 0.5                                                 # the time a worker should take to execute a chunk of subjects
+MAX_CHUNK_SIZE = 1000
+FLUSH_EVERY = 100                                                   # the number of subjects to write before flushing the output file
+WORKER_CHECK_SECONDS = 1.0                                          # how often to check the worker processes while waiting for a chunk
+
+
+# the rule set loaded by a worker process when running with multiple workers
+_worker_rules_set = None
 
-def batch_execute(rule_set_file, subject_file, output_file):
+
+def _load_rules_set(rule_set_file):
     '''
-    
+    Private function; loads a rule set with the loader matching the file extension.
     '''
-    
+
     base_name,extension = os.path.splitext(rule_set_file)
 
     loader_module = loaders.yaml_loader
     if extension == '.json':
         loader_module = loaders.json_loader
 
+    return geoDSS.rules_set(rule_set_file, loader_module)
+
+
+def _init_worker(rule_set_file):
+    '''
+    Private function; loads the rule set once for each worker process.
+    '''
+
+    global _worker_rules_set
+    _worker_rules_set = _load_rules_set(rule_set_file)
+
+
+def _encode(text):
+    '''
+    Private function; returns text as utf-8 encoded bytes.
+    '''
+
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+
+def _csv_line(values):
+    '''
+    Private function; returns a line in csv format for a list of values.
+    '''
+
+    out = StringIO()
+    writer = csv.writer(out)
+    if sys.version_info[0] < 3:
+        writer.writerow([_encode(v) if isinstance(v, unicode) else ('' if v is None else str(v)) for v in values])
+    else:
+        writer.writerow(['' if v is None else v for v in values])
+    return out.getvalue()
+
+
+def _csv_header(r, fields):
+    '''
+    Private function; returns the header line for output in csv format.
+    '''
+
+    columns = list(fields)
+    for rule in r.rules:
+        if hasattr(rule, 'decision'):
+            columns.append(rule.name + '_decision')
+        columns.append(rule.name + '_report')
+    columns.append('error')
+    return _csv_line(columns)
+
+
+def _format(execution, output_format, fields = None, full_report = False):
+    '''
+    Private function; returns the output for a single execution in the given output format:
+
+    - `text`     the report of the rule set reporter. When `full_report` is `False`, the report on the rules only.
+    - `csv`      a csv line with the values of `fields` in the subject, and the decision and reports of each rule.
+    - `jsonl`    a line with a json object with the first subject, the final subject, decisions, reports and error.
+    '''
+
+    error = str(execution.error) if execution.error else None
+    if output_format == 'csv':
+        subject = execution.result[0] if execution.result else {}
+        values = [subject.get(field) for field in fields]
+        for rule in execution.rules:
+            if hasattr(rule, 'decision'):
+                values.append(bool(rule.decision) if rule.executed else None)
+            values.append('\n'.join(rule.result) if rule.definition['report'] else None)
+        values.append(error)
+        return _csv_line(values)
+    elif output_format == 'jsonl':
+        record = {  'subject':          execution.result[0] if execution.result else None,
+                    'final_subject':    execution.subject,
+                    'decisions':        execution.decisions,
+                    'reports':          execution.reports,
+                    'error':            error }
+        return json.dumps(record, default = str) + '\n'
+    else:
+        if error:
+            return None
+        return execution.report(rules_only = not full_report)
+
+
+def _results(r, subjects, options):
+    '''
+    Private generator; executes the subjects and yields for each subject a tuple of:
+    an error message (or None), the output and, for the first subject without an error,
+    the full report to start the text output with.
+
+    `options` is a dict with the `output_format`, the `fields` for csv output,
+    the number of subjects to keep `in_flight` and the `chunk_size`.
+    '''
+
+    output_format = options['output_format']
+    full_report_done = output_format != 'text'
+    for execution in r.execute_many(subjects, options['in_flight'], options['chunk_size']):  # each subject is reported on its own
+        error = str(execution.error) if execution.error else None
+        full_report = None
+        if not error and not full_report_done:
+            full_report = _format(execution, output_format, full_report = True)
+            full_report_done = True
+        yield error, _format(execution, output_format, options['fields']), full_report
+
+
+def _execute_chunk(index, subjects, options):
+    '''
+    Private function; executes a chunk of subjects in a worker process.
+
+    Returns the index of the chunk, the time spent and a list with the results of `_results`.
+    '''
+
+    start = time.time()
+    results = []
+    try:
+        for result in _results(_worker_rules_set, subjects, options):
+            results.append(result)
+    except Exception as e:                                          # never let an exception escape a worker process
+        results.extend([(str(e), None, None)] * (len(subjects) - len(results)))
+    return index, time.time() - start, results
+
+
+def _chunks(subjects, chunk_size):
+    '''
+    Private generator; yields lists of subjects. The size of the next chunk is asked
+    for by calling `chunk_size` so it can be adapted while running.
+    '''
+
+    chunk = []
+    for subject in subjects:
+        chunk.append(subject)
+        if len(chunk) >= chunk_size():
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _check_workers(pool, pids, pending):
+    '''
+    Private function; raises an error when a chunk failed or a worker process died.
+
+    A pool replaces a worker process which died (eg. killed for running out of memory, or a crash in GDAL),
+    but the chunk it was executing is lost and its result never arrives. So waiting for it would never end.
+
+    `pids`          the process ids of the workers the pool started with.
+
+    `pending`       a dict with the `AsyncResult` of each chunk in flight.
+    '''
+
+    for pending_result in list(pending.values()):
+        if pending_result.ready() and not pending_result.successful():
+            pending_result.get()                                    # raises the error of the chunk, eg. a result which can't be pickled
+    workers = getattr(pool, '_pool', None)                          # not public, but the only way to see the worker processes
+    if workers is not None and (set(worker.pid for worker in workers) != pids or [worker for worker in workers if worker.exitcode]):
+        raise RuntimeError('A worker process died while executing a chunk of subjects. The output is incomplete.')
+
+
+def _ordered_results(r, rule_set_file, subjects, options, workers = 1, chunk_seconds = CHUNK_SECONDS):
+    '''
+    Private generator; executes the subjects and yields the results of `_execute_chunk`
+    for each subject in the order of the subjects.
+
+    With more than one worker the chunks of subjects are executed by a pool of processes, each
+    having loaded the rule set once. Chunks are sized to take about `chunk_seconds` to execute,
+    based on the time spent on earlier chunks. A reorder buffer keeps the order of the subjects.
+    When a worker process dies the execution stops with an error, instead of waiting for its chunk forever.
+    '''
+
+    if workers <= 1:
+        for result in _results(r, subjects, options):
+            yield result
+        return
+
+    timing = {'subjects': 0, 'seconds': 0.0}
+
+    def chunk_size():
+        if not timing['subjects']:
+            return 4                                                # start small to learn the time needed per subject
+        per_subject = max(timing['seconds'] / timing['subjects'], 0.000001)
+        return max(1, min(MAX_CHUNK_SIZE, int(chunk_seconds / per_subject)))
+
+    pool = multiprocessing.Pool(workers, _init_worker, (rule_set_file,))
+    pids = set(worker.pid for worker in getattr(pool, '_pool', []))
+    done = Queue.Queue()
+    pending = {}                                                    # index: AsyncResult of the chunks in flight
+    reorder_buffer = {}
+    next_index = 0
+    in_flight = 0
+    try:
+        chunks = enumerate(_chunks(subjects, chunk_size))
+        exhausted = False
+        while True:
+            while not exhausted and in_flight < workers * 2:        # keep the workers busy without reading all subjects at once
+                try:
+                    index, chunk = next(chunks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[index] = pool.apply_async(_execute_chunk, (index, chunk, options), callback = done.put)
+                in_flight = in_flight + 1
+            if not in_flight:
+                break
+            try:
+                index, seconds, results = done.get(timeout = WORKER_CHECK_SECONDS)
+            except Queue.Empty:
+                _check_workers(pool, pids, pending)
+                continue
+            del pending[index]
+            in_flight = in_flight - 1
+            timing['subjects'] = timing['subjects'] + len(results)
+            timing['seconds'] = timing['seconds'] + seconds
+            reorder_buffer[index] = results
+            while next_index in reorder_buffer:
+                for result in reorder_buffer.pop(next_index):
+                    yield result
+                next_index = next_index + 1
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def batch_execute(rule_set_file, subject_file, output_file, workers = 1, output_format = 'text', flush_every = FLUSH_EVERY, in_flight = 1,
+                  chunk_size = 1):
+    '''
+    Executes the rule set for each subject in the csv file and writes the output to the output file.
+
+    The output is written for each subject as soon as it is executed, so the output file can be used
+    while the batch is still running.
+
+    `workers` (int):           the number of processes to execute subjects in parallel. Defaults to 1.
+                               The order of the output is the order of the subjects, regardless of the number of workers.
+
+    `output_format` (string):  one of:
+
+    - `text`                   the report of the rule set reporter for each subject (default).
+    - `csv`                    a line for each subject with the columns of the subject file,
+                               followed by a decision and a report column for each rule and an error column.
+    - `jsonl`                  a line for each subject with a json object with the keys `subject`, `final_subject`,
+                               `decisions`, `reports` and `error`.
+
+    `flush_every` (int):       the output file is flushed after writing the output of this number of subjects.
+
+    `in_flight` (int):         the number of subjects each process executes at the same time, each in its own thread.
+                               Useful for rules waiting on web services, like geocoders. Defaults to 1.
+
+    `chunk_size` (int):        the number of subjects executed at once, rule by rule. Rules like tests.postgis_spatial_select
+                               then use a single query for all subjects in a chunk. Defaults to 1.
+    '''
+
     try:
-        r = geoDSS.rules_set(rule_set_file, loader_module)
+        r = _load_rules_set(rule_set_file)
     except Exception as e:
         print("geoDSS: Could not load rule_set with error: %s " % str(e))
         print(traceback.format_exc())
         return
-       
-    with open(subject_file, 'rb') as f:
+
+    with open(subject_file, 'rb') as f, open(output_file, 'wb') as of:
         reader = csv.DictReader(f)
-        for subject in reader:
-            try:
-                r.execute(subject)
-            except Exception as e:
-                print("geoDSS: Could not evaluate rule_set with error: %s" % str(e))
-                print(traceback.format_exc())
-                
-    with open(output_file, 'wb') as of: 
-        of.write(r.report())                        # reports accumulate as long as we don't re-initialize the geoDSS.rules_set
+        options = {'output_format': output_format, 'fields': reader.fieldnames, 'in_flight': in_flight, 'chunk_size': chunk_size}
+        if output_format == 'csv':
+            of.write(_encode(_csv_header(r, reader.fieldnames)))
+        header_done = output_format != 'text'
+        unflushed = 0
+        for error, output, full_report in _ordered_results(r, rule_set_file, reader, options, workers):
+            if error:
+                print("geoDSS: Could not evaluate rule_set with error: %s" % error)
+            if not header_done and full_report:
+                output = full_report                                # the plain text reporters write the header only once
+                header_done = True
+            if output:
+                of.write(_encode(output))
+                unflushed = unflushed + 1
+            if unflushed >= flush_every:
+                of.flush()
+                unflushed = 0
                 
                 
 if __name__ == '__main__':
@@ -73,7 +354,17 @@ if __name__ == '__main__':
     parser.add_argument("rule_set_file",                            help = 'The file containing the rule set.')
     parser.add_argument("subject_file",                             help = 'A csv file containing subjects.')
     parser.add_argument("output_file",                              help = 'An output file to write the results to.')
+    parser.add_argument("--workers", type = int, default = 1,       help = 'The number of processes executing subjects in parallel. Defaults to 1.')
+    parser.add_argument("--output_format", default = 'text',
+                                       choices = ('text', 'csv', 'jsonl'),
+                                                                    help = 'text: the report for each subject (default), csv: a row for each subject, jsonl: a json object for each subject.')
+    parser.add_argument("--flush_every", type = int, default = FLUSH_EVERY,
+                                                                    help = 'Flush the output file after this number of subjects. Defaults to %d.' % FLUSH_EVERY)
+    parser.add_argument("--in_flight", type = int, default = 1,     help = 'The number of subjects each process executes at the same time in threads. Defaults to 1.')
+    parser.add_argument("--chunk_size", type = int, default = 1,    help = 'The number of subjects executed at once, eg. with a single database query. Defaults to 1.')
     
     args = parser.parse_args()
 
-    batch_execute(rule_set_file = args.rule_set_file, subject_file = args.subject_file, output_file = args.output_file)
+    batch_execute(rule_set_file = args.rule_set_file, subject_file = args.subject_file, output_file = args.output_file, workers = args.workers,
+                  output_format = args.output_format, flush_every = args.flush_every, in_flight = args.in_flight,
+                  chunk_size = args.chunk_size)
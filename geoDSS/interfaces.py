@@ -47,11 +47,23 @@ This setting only affects interfaces.py. geoDSS utilyzes a logger which is confi
 When using cgi, most of the time you'll find the things written to stderr in your webservers logs.
 You can set 
 >DEBUG_LEVEL = {False | "DEBUG"}
+
+
+Caching rule sets
+-----------------
+
+When running as wsgi application, loaded rule sets are kept in memory so they don't have to be loaded for each request.
+A rule set file is loaded again when it is changed.
+
+Adapt the global variables RULE_SET_CACHE_SIZE and RULE_SET_CACHE_MEMORY to control the maximum number of rule sets kept
+and the (estimated) maximum amount of memory used by these rule sets in bytes. Set RULE_SET_CACHE_SIZE to 0 to disable caching.
 '''
 
 ENABLE_CGTIB = False
 ENABLE_NON_LOCAL_RULE_SET_FILES = False
 DEBUG_LEVEL = "DEBUG"
+RULE_SET_CACHE_SIZE = 32
+RULE_SET_CACHE_MEMORY = 64 * 1024 * 1024
 
 import argparse
 import cgi
@@ -76,8 +88,11 @@ if __name__ == '__main__' and __package__ is None:
 
 import geoDSS 
 from geoDSS import loaders
+from geoDSS import registry
 from geoDSS import ui_generators
 
+registry.configure(max_entries = RULE_SET_CACHE_SIZE, max_memory = RULE_SET_CACHE_MEMORY)
+
 def sanitize_headers(headers):
     '''
     removes hop-by-hop headers as these are not supported by wsgi.
@@ -160,7 +175,7 @@ def load_execute_report(params):
                 pass
 
         try:
-            r = geoDSS.rules_set(rule_set_file, loader_module)
+            r = registry.get(rule_set_file, loader_module)
         except Exception as e:
             if DEBUG_LEVEL:
                 sys.stderr.write("geoDSS: Could not load rule_set with error: %s \n" % str(e))
@@ -168,7 +183,7 @@ def load_execute_report(params):
             return status, response_headers, "Could not load rule_set with error: " + str(e)
         
         try:
-            r.execute(subject)
+            e = r.execute(subject)
         except Exception as e:
             if DEBUG_LEVEL:
                 sys.stderr.write("geoDSS: Could not evaluate rule_set with error: %s \n" % str(e))
@@ -177,7 +192,7 @@ def load_execute_report(params):
 
         try:
             sys.stderr.write("trying to generate a report with output format: " + output_format)
-            data = r.report(output_format = output_format)
+            data = e.report(output_format = output_format)
         except Exception as e:
             if DEBUG_LEVEL:
                 sys.stderr.write("geoDSS: Could not report on rule_set with error: %s \n" % str(e))
@@ -35,6 +35,10 @@ Optionally the generic properties can contain:
                                     in the settings are available as if they were defined in the rule.
                                     If a property of `settings` is defined in a rule, then that 
                                     property is used, and not the property of this settings object.
+- `concurrent_rules` (bool)         Defaults to `False`. If set `True`, rules which don't depend on each other are
+                                    executed at the same time. A rule depends on an earlier rule when it reads a subject
+                                    key the earlier rule may write, or when it refers to it (eg. `rules.my_test`).
+                                    Processors wait for all earlier rules. The report is the same as without this setting.
 
                           
 The rule set contains a list of rules. The properties of these rules depend on the processors and tests
@@ -6,6 +6,8 @@ If rule_set_file starts with http(s):// rule_Set_file is regarded as an url and
 
 import json
 import requests
+
+from ..utils import http_sessions
     
 def load_rule_set(rules_set_file, **kwargs):
     '''
@@ -50,7 +52,7 @@ def load_rule_set(rules_set_file, **kwargs):
 
     # todo: we might need something like: input_file = codecs.open("some_file.txt", mode="r", encoding="utf-8")
     if rules_set_file.startswith('http://') or rules_set_file.startswith('https://'):
-        response = requests.get(rules_set_file)
+        response = http_sessions.get(rules_set_file)
         if response.status_code == requests.codes.ok:
             return json.loads(response.text)
     else:
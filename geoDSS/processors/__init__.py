@@ -24,6 +24,7 @@ In real life more parameters will be present in a subject.
 
 from ..processors import    alter_key, \
                             bag_geocoder, \
+                            local_geocoder, \
                             pdok_locatieserver, \
                             random_point_geometry, \
                             random_value
@@ -33,7 +33,12 @@ except:
     pass
 
 from ..processors.processor import processor
+from ..utils import expressions
 
+_namespace = expressions.namespace(codecs = codecs, datetime = datetime, json = json, locale = locale, math = math, re = re,
+                                   string = string, tokenize = tokenize, urlencode = urlencode, yaml = yaml)
+if 'ogr' in globals():
+    _namespace['ogr'] = ogr
 
 class alter_key(processor):
     '''
@@ -70,12 +75,16 @@ class alter_key(processor):
                                         - locale
                                         - math
                                         - ogr (if you have this installed)
-                                        - os
                                         - re
                                         - string
                                         - tokenize
                                         - urlencode
                                         - yaml
+
+                                        and the builtins listed in `geoDSS.utils.expressions.SAFE_BUILTINS`.
+                                        The expression is compiled when the rule set is loaded. A syntax error is raised
+                                        when the rule is executed, as the expression might be a key in the subject.
+                                        An expression taken from the subject is compiled the first time it is used.
                                         
      `locale` (string):                 (optional) A temporary locale to use for the expression. eg. `nl_NL.utf-8`
      
@@ -124,6 +133,21 @@ class alter_key(processor):
                 locale.setlocale(locale.LC_ALL, saved)
 
 
+    def __init__(self, name, definition, logger, rules, settings = None):
+        super(alter_key, self).__init__(name, definition, logger, rules, settings)
+        try:
+            self._code = expressions.compile_expression(self.definition['expression'], name)
+        except SyntaxError as error:
+            self._code = None                                           # the expression might be a key in the subject
+            self._syntax_error = error
+
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
+
+        return set([self.definition['result_key']])
+
     def execute(self, subject):
         '''
         Executes the processor.
@@ -136,17 +160,18 @@ class alter_key(processor):
         Keys changed or added to the subject on success.
         '''
 
-        expression = self.definition["expression"]
-        if expression in subject:
-            expression = subject[expression]
-
+        code = self._code
         rule = self.definition
         try:
+            if self.definition["expression"] in subject:
+                code = expressions.compile_expression(subject[self.definition["expression"]], self.name)
+            elif code is None:
+                raise self._syntax_error
             if 'locale' in self.definition:
                 with self._setlocale(self.definition['locale']):
-                    result = eval( expression )
+                    result = expressions.evaluate(code, _namespace, subject = subject, rule = rule)
             else:
-                    result = eval( expression )
+                    result = expressions.evaluate(code, _namespace, subject = subject, rule = rule)
             subject[self.definition['result_key']] = result
         except Exception as error:
             return self._handle_execution_exception(subject, "Could not execute expression with error: `%s`" % str(error))
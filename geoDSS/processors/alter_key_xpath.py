@@ -2,7 +2,9 @@
 
 
 from contextlib import contextmanager
+from io import BytesIO
 
+from lxml import etree
 from lxml import html
 
 try:
@@ -17,6 +19,13 @@ class alter_key_xpath(processor):
     '''
     This processor alters a subject key by executing an xpath expression against
     a subject key. As namespacing is not supported, this is most useful for html.
+
+    The expression is compiled once when the rule set is loaded. The html is parsed once in an execution:
+    all `alter_key_xpath` rules on the same subject key use the same parsed document, as long as the
+    value of the key isn't replaced.
+
+    Very large documents can be read with `iterparse_tag`. The document is then read element by element
+    without building the whole tree, and the expression is evaluated on each element with that tag.
     
     Dependencies
     ------------
@@ -48,6 +57,11 @@ class alter_key_xpath(processor):
                                         taken from that key in the subject.
                                         
      `delimiter` (string):              The items in the result set will be delimited by this string. Defaults to `;`.
+
+     `iterparse_tag` (string):          (optional) The tag of the elements to evaluate the expression on (eg. `tr`),
+                                        reading the document element by element. The expression is relative
+                                        to such an element (eg. `./td[2]/text()`). Use this for documents too large
+                                        to keep in memory as a whole.
      
      `report_template` (string):        (optional) String (with markdown support) to be reported on success.
 
@@ -66,19 +80,86 @@ class alter_key_xpath(processor):
             type: processors.alter_key_xpath
             title: Alter a key
             description: ""
-            result_key: url
-            expression: subject['url'].replace(' ','%20')
-            report_template: "Generated a new key: {result}"
+            subject_key: page
+            result_key: links
+            expression: //a/@href
+            report_template: "Found the links: {result}"
 
     
     Subject example
     ---------------
 
-    Any subject will do, so this one as well:
+    Any subject with html in the `subject_key` will do, so this one as well:
 
-        subject = '{"url": "a stupid url with spaces.com"}'
+        subject = '{"page": "<html><body><a href=\\"https://geodss.nl\\">geoDSS</a></body></html>"}'
     '''
-    
+
+    MAX_EXPRESSIONS = 64                                                # compiled expressions taken from subjects, kept per rule
+
+    def __init__(self, name, definition, logger, rules, settings = None):
+        super(alter_key_xpath, self).__init__(name, definition, logger, rules, settings)
+        self._xpaths = {}                                               # expression: XPath; shared by the copies of this rule
+        try:
+            self._xpath(self.definition['expression'])
+        except etree.XPathSyntaxError:
+            pass                                                        # the expression might be a key in the subject
+
+    def _xpath(self, expression):
+        '''
+        Private method; returns the expression compiled as an `etree.XPath`, compiled once for this rule.
+        '''
+
+        compiled = self._xpaths.get(expression)
+        if compiled is None:
+            compiled = etree.XPath(expression)
+            if len(self._xpaths) >= self.MAX_EXPRESSIONS:
+                self._xpaths.clear()
+            self._xpaths[expression] = compiled
+        return compiled
+
+    def _tree(self, subject):
+        '''
+        Private method; returns the html in the `subject_key` of the subject as a parsed document.
+
+        The document is kept in the cache of the execution, with the value it was parsed from. It is parsed
+        again only when the value in the subject is another object, eg. when a rule replaced it.
+        '''
+
+        key = self.definition['subject_key']
+        content = subject[key]
+        cache = getattr(getattr(self, 'execution', None), 'cache', None)
+        if cache is None:
+            return html.fromstring(content)                             # a rule executed outside of an execution
+        found = cache.get(('html', key))
+        if found is not None and found[0] is content:
+            return found[1]
+        tree = html.fromstring(content)
+        cache[('html', key)] = (content, tree)                          # keeps a reference to the content, so its identity can't be reused
+        return tree
+
+    def _iterparse(self, content, xpath, tag):
+        '''
+        Private method; returns the results of `xpath` on each element with `tag` in the html `content`,
+        reading the document element by element and discarding the elements done with.
+        '''
+
+        if isinstance(content, type(u'')):
+            content = content.encode('utf-8')
+        result = []
+        for event, element in etree.iterparse(BytesIO(content), events = ('end',), tag = tag, html = True, encoding = 'utf-8'):
+            result.extend(xpath(element))
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]                              # the siblings read before are no longer needed
+        return result
+
+
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
+
+        return set([self.definition['result_key']])
 
     def execute(self, subject):
         '''
@@ -104,8 +185,11 @@ class alter_key_xpath(processor):
             return self._handle_execution_exception(subject, "Could not get expression from the definition with error: `%s`" % str(error))
             
         try:
-            tree = html.fromstring(subject[self.definition['subject_key']])
-            result = tree.xpath( expression )
+            xpath = self._xpath(expression)
+            if self.definition.get('iterparse_tag'):
+                result = self._iterparse(subject[self.definition['subject_key']], xpath, self.definition['iterparse_tag'])
+            else:
+                result = xpath(self._tree(subject))
             if result:                  
                 result = delimiter.join(result)
             else:
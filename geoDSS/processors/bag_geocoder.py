@@ -12,6 +12,7 @@ except:
 
 
 from ..processors.processor import processor
+from ..utils import http_sessions
 
 
 class bag_geocoder(processor):
@@ -40,6 +41,9 @@ class bag_geocoder(processor):
 
                                         if the format string contains {y} it will be replaced by the x coordinate of the found location.
 
+     `http_pool` (dict):                (optional) options for the connections to the geocoding service, which are kept open and shared
+                                        by all rules in the process. See `geoDSS.utils.http_sessions`.
+
     Rule example
     ------------
 
@@ -61,6 +65,13 @@ class bag_geocoder(processor):
         subject = '{"postcode": "4171KG", "huisnummer": "74"}'
     '''
 
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
+
+        return set(['geometry'])
+
     def execute(self, subject):
         '''
         Executes the geocoder
@@ -75,7 +86,7 @@ class bag_geocoder(processor):
         try:
             url = self.definition['url'] + subject['huisnummer'] + '+' + subject['postcode']
             self.logger.debug("Geocoding with url: " + url)
-            response = requests.get(url)
+            response = http_sessions.get(url, http_pool=self.definition.get('http_pool'))
         except Exception as error:
             return self._handle_execution_exception(subject, "Could not geocode address with error: `%s`" % str(error) )
         else:
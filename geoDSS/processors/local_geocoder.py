@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+try:
+    import exceptions
+except:
+    pass
+
+from ..processors.processor import processor
+from ..utils import address_index
+
+
+class local_geocoder(processor):
+    '''
+    This processor provides a geocoder using a local index of the Dutch BAG addresses, so geocoding
+    needs no web service at all.
+
+    Geocoding is done on zip-code and house_number of the subject, like `processors.pdok_locatieserver` does.
+    This geocoder takes the first hit as a result.
+
+    The index is built once from a BAG export (eg. a CSV file made by NLExtract or a GeoPackage) with:
+
+        python -m geoDSS.utils.address_index bagadres.csv /data/bag.idx
+
+    The index is read via a memory map, so it takes hardly any memory of a process and is shared
+    by all processes on a host. See `geoDSS.utils.address_index`.
+
+    Result
+    ------
+    
+    Keys added to the subject on success:
+    
+    `geometry`                          The EWKT geometry obtained by geocoding the subject
+
+    Definition
+    ----------
+
+    `definition` is expected to be a dict having:
+
+     `index` (string):                  the index file built with `geoDSS.utils.address_index`.
+
+     `report_template` (string):        (optional) String (with markdown support) to be reported on success.
+                                        The following placeholders will be replaced
+
+     - `subject.geometry`               the geometry which resulted from the geocoding process.
+     - `{address}`                      the found address.
+     - `{x}`                            the x coordinate of the found location.
+     - `{y}`                            the y coordinate of the found location.
+     - `{wkt_geometry}`                 the WKT geometry presentation of the found location.
+     - `{ewkt_geometry}`                the EWKT geometry presentation of the found location.
+
+    Rule example
+    ------------
+
+    a suitable yaml snippet would be:
+
+        rules:
+            geocode_address:
+                type: processors.local_geocoder
+                title: Geocodeer adres
+                description: Geocodeer adres op basis van postcode huisnummer
+                index: /data/bag.idx
+                report_template: "Gevonden {address} op ['subject.geometry'](https://bagviewer.kadaster.nl/lvbag/bag-viewer/index.html#?geometry.x={x}&geometry.y={y}&zoomlevel=7)"
+
+    Subject example
+    ---------------
+
+    a suitable subject would be:
+
+        subject = '{"postcode": "4171KG", "huisnummer": "74"}'
+    '''
+
+
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
+
+        return set(['geometry'])
+
+    def execute(self, subject):
+        '''
+        Executes the geocoder.
+
+        `subject` is expected to be a dict having:
+
+        `postcode` (string):              zip-code or postal code
+
+        `huisnummer` (string)             house number
+
+        optionally having:
+
+        `toevoeging` (string)             house letter and/ or house number addition, eg. `A` or `A-2`
+        
+            
+        Result
+        ------
+    
+        Keys added to the subject on success:
+    
+        `geometry`                          The EWKT geometry obtained by geocoding the subject.
+        '''
+
+        try:
+            index = address_index.get_index(self.definition['index'])
+        except Exception as error:
+            return self._handle_execution_exception(subject, "Could not open address index `%s` with error: `%s`" % (self.definition['index'], str(error)))
+
+        try:
+            location = index.lookup(subject['postcode'], subject['huisnummer'], subject.get('toevoeging'))
+        except Exception as error:
+            return self._handle_execution_exception(subject, "Could not geocode address with error: `%s`" % str(error))
+        if location is None:
+            return self._handle_execution_exception(subject, "Could not geocode address. The geocoder returned no matches.")
+
+        x, y, address = location
+        wkt_geometry = 'POINT(%s %s)' % (x, y)
+        ewkt_geometry = 'SRID=%s;' % index.srid + wkt_geometry
+        subject['geometry'] = ewkt_geometry
+        self.executed = True
+
+        if self.definition.get("report_template"):
+            result = self.definition["report_template"].replace('subject.geometry', subject['geometry'])
+            result = result.replace('{x}', str(x)).replace('{y}', str(y))
+            result = result.replace('{wkt_geometry}', wkt_geometry)
+            result = result.replace('{ewkt_geometry}', ewkt_geometry)
+            if address:
+                result = result.replace('{address}', address)
+            else:
+                result = result.replace('{address}', 'address not known')
+            self.result.append(result)
+
+        return self._finish_execution(subject)
@@ -10,6 +10,8 @@ except:
 
 from ..processors.processor import processor
 from ..processors.processor import utils
+from ..utils import geometries
+from ..utils import wkb
 
 class ogr_processing(processor):
     '''
@@ -55,44 +57,69 @@ class ogr_processing(processor):
     '''
 
 
-    def execute(self, subject):
-        ''' 
-        Executes the processor.
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
 
-        `subject` is expected to be a dict having:
+        return set([self.definition['result_key']])
+
+    def _geometry_value(self, result, srid, like):
+        '''
+        Private method; returns a resulting ogr geometry in the same form as the geometry of the subject `like`: EWKT or EWKB.
+        The result is kept as a handle, so the next rule using it finds it parsed.
+        '''
 
-        `geometry` (ewkt string):          a proper EWKT string representing the geometry of the subject
+        if wkb.is_ewkb(like):
+            value = wkb.encode(wkb.from_wkb(result.ExportToWkb(), srid), like)
+            geometries.remember(geometries.handle(ogr_geometry = result, srid = srid), value)
+            return value
+        return geometries.from_ogr(result, srid).ewkt
+
+    def _process(self, subject):
         '''
+        Private method; runs the processor on the geometry of the subject.
 
-        gdal.UseExceptions()
+        Returns an (error, result) tuple, where error is the message to report when the processor failed.
+        '''
 
         if not 'geometry' in subject:
-            return self._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
+            return 'Could not find key "geometry" in subject.', None
 
-        parameters = self.definition['parameters']
+        parameters = list(self.definition['parameters'])                                   # a copy, as the definition is shared by all executions
         for index, parameter in enumerate(parameters):
             if parameter in subject:
                 parameters[index] = subject[parameter]
 
-        ewkt = subject['geometry']
         try:
-            g = ogr.CreateGeometryFromWkt(utils.wkt._get_WKT_geometry(ewkt))
+            geometry = geometries.get(subject['geometry'])
+            g = geometry.ogr()                                                              # a copy, as some ogr functions alter the geometry
         except Exception as error:
-            return self._handle_execution_exception(subject, "Could not create ogr geometry from subject: " + str(error))
+            return "Could not create ogr geometry from subject: " + str(error), None
         try:
             processor_to_call = getattr(g, self.definition['processor'])
         except Exception as error:
-            return self._handle_execution_exception(subject, "ogr doesn't know the processor: " + self.definition['processor'])
+            return "ogr doesn't know the processor: " + self.definition['processor'], None
 
         try:
             result = processor_to_call(*parameters)  # we might be more flexible using an eval(expression)
         except Exception as error:
-            return self._handle_execution_exception(subject, "ogr error during processing: " + str(error))
+            return "ogr error during processing: " + str(error), None
+
+        if result and isinstance(result,ogr.Geometry):
+            result = self._geometry_value(result, geometry.srid, subject['geometry'])
+        return None, result
+
+    def _finish(self, subject, error, result):
+        '''
+        Private method; stores the result of `_process` in the subject and reports it.
+        '''
+
+        if error is not None:
+            return self._handle_execution_exception(subject, error)
 
         if result:
             self.executed = True
-            if isinstance(result,ogr.Geometry):
-                result = utils.wkt._EWKT_from_WKT(utils.wkt._get_SRID_string(ewkt),result.ExportToWkt())
             subject[self.definition['result_key']] = result
             
         if self.executed and self.definition["report_template"]:
@@ -100,3 +127,17 @@ class ogr_processing(processor):
             self.result.append(result)
 
         return self._finish_execution(subject)
+
+    def execute(self, subject):
+        ''' 
+        Executes the processor.
+
+        `subject` is expected to be a dict having:
+
+        `geometry` (ewkt string):          a proper EWKT string (or EWKB, see `geoDSS.utils.wkb`) representing the geometry of the subject
+        '''
+
+        gdal.UseExceptions()
+
+        error, result = self._process(subject)
+        return self._finish(subject, error, result)
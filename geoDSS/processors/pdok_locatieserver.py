@@ -13,6 +13,8 @@ except:
 
 from ..processors.processor import processor
 from ..processors.processor import utils
+from ..utils import http_sessions
+from ..utils import kv_cache
 
 class pdok_locatieserver(processor):
     '''
@@ -45,6 +47,20 @@ class pdok_locatieserver(processor):
      - `{wkt_geometry}`                 the WKT geometry presentation of the found location.
      - `{ewkt_geometry}`                the EWKT geometry presentation of the found location.
 
+     `http_pool` (dict):                (optional) options for the connections to the locatieserver, which are kept open and shared
+                                        by all rules in the process. See `geoDSS.utils.http_sessions`.
+
+     `cache` (dict):                    (optional) when given, found locations and addresses without matches are kept in a cache, so
+                                        an address is looked up once. The cache is kept in memory and, when a `file` is given, in a
+                                        SQLite file shared by all processes on the host. The dict can have:
+
+     - `file` (string)                  the SQLite file. If not given the cache is kept in memory only.
+     - `ttl` (number)                   the number of seconds a found location is kept. Defaults to 30 days.
+     - `negative_ttl` (number)          the number of seconds an address without matches is kept. Defaults to 1 day.
+     - `max_entries` (int)              the maximum number of addresses kept in memory. Defaults to 10000.
+
+                                        `cache: {}` keeps the cache in memory with the defaults. See `geoDSS.utils.kv_cache`.
+
     Rule example
     ------------
 
@@ -56,6 +72,8 @@ class pdok_locatieserver(processor):
                 title: Geocodeer adres
                 description: Geocodeer adres op basis van postcode huisnummer
                 url: "https://geodata.nationaalgeoregister.nl/locatieserver/v3/free?q="
+                cache:
+                    file: /var/cache/geodss/pdok_locatieserver.sqlite
                 report_template: "Gevonden {address} op ['subject.geometry'](https://bagviewer.kadaster.nl/lvbag/bag-viewer/index.html#?geometry.x={x}&geometry.y={y}&zoomlevel=7)"
 
     Subject example
@@ -67,6 +85,61 @@ class pdok_locatieserver(processor):
     '''
 
 
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
+
+        return set(['geometry'])
+
+    def _url(self, subject):
+        '''
+        Private method; returns the url to geocode the subject with: the url of the definition with the normalized postcode
+        and huisnummer of the subject. The url is the key of the address in the cache as well, so addresses written
+        differently (eg. `4171 kg` and `4171KG`) are looked up once.
+        '''
+
+        postcode = re.sub(r'\s+', '', subject['postcode']).upper()
+        huisnummer = str(subject['huisnummer']).strip().upper()
+        return self.definition['url'] + postcode + '-' + huisnummer
+
+    def _geocode(self, url):
+        '''
+        Private method; asks the geocoder for a location.
+
+        Returns an (error, location) tuple, where error is a message or `None`, and location is a dict with the `x`, `y` and
+        `address` of the first hit, or `None` when the geocoder returned no matches.
+        '''
+
+        try:
+            self.logger.debug("Geocoding with url: " + url)
+            response = http_sessions.get(url, http_pool=self.definition.get('http_pool'))
+        except Exception as error:
+            return "Could not geocode address with error: `%s`" % str(error), None
+
+        if response.status_code != requests.codes.ok:
+            return "Could not geocode address. Geocoder returned status code: `%s`" % str(response.status_code), None
+        self.logger.debug("Debugger returned status code: " + str(response.status_code))
+        try:
+            try:
+                result = response.json()
+            except:
+                result = json.loads(response.content)                   # workaround for old requests libraries
+            if not result["response"]["numFound"] > 0:
+                return None, None
+            doc = result["response"]["docs"][0]
+            centroid = utils.wkt.parse(doc["centroide_rd"])
+            if not centroid.parts:
+                return "Could not geocode address. Response parsing failed with error: no coordinates in %s" % doc["centroide_rd"], None
+            location = {'x': centroid.parts[0], 'y': centroid.parts[1], 'address': None}
+        except Exception as error:
+            return "Could not geocode address. Response parsing failed with error: " + str(error), None
+        try:
+            location['address'] = doc["weergavenaam"]
+        except Exception as error:
+            self.logger.debug('Could find position but not an address due to error: ' + str(error))
+        return None, location
+
     def execute(self, subject):
         '''
         Executes the geocoder.
@@ -87,42 +160,38 @@ class pdok_locatieserver(processor):
         '''
 
         try:
-            url = self.definition['url'] + subject['postcode'] + '-' + str(subject['huisnummer'])
-            self.logger.debug("Geocoding with url: " + url)
-            response = requests.get(url)
+            url = self._url(subject)
         except Exception as error:
             return self._handle_execution_exception(subject, "Could not geocode address with error: `%s`" % str(error))
-        else:
-            if response.status_code == requests.codes.ok:
-                self.logger.debug("Debugger returned status code: " + str(response.status_code))
-                try:
-                    try:
-                        result = response.json()
-                    except:
-                        result = json.loads(response.content)                   # workaround for old requests libraries
-                    if result["response"]["numFound"] > 0:
-                        doc = result["response"]["docs"][0]
-                        _wkt = utils.wkt._WKTParser()
-                        _posLists = _wkt(doc["centroide_rd"])
-                        XY = _posLists[0].split()
-                        if XY:
-                            x = float(XY[0])
-                            y = float(XY[1])
-                            wkt_geometry = 'POINT(%s %s)' % (x, y)
-                            ewkt_geometry = 'SRID=28992;' + wkt_geometry
-                            subject['geometry'] = ewkt_geometry 
-                            self.executed = True
-                    else:
-                        return self._handle_execution_exception(subject, "Could not geocode address. The geocoder returned no matches.")
-                except Exception as error:
-                    return self._handle_execution_exception(subject, "Could not geocode address. Response parsing failed with error: " + str(error))
-                address = None
-                try:
-                    address = doc["weergavenaam"]
-                except Exception as error:
-                    self.logger.debug('Could find position but not an address due to error: ' + str(error))
-            else:
-                return self._handle_execution_exception(subject, "Could not geocode address. Geocoder returned status code: `%s`" % str(response.status_code))
+
+        cache = None
+        hit = False
+        if 'cache' in self.definition:
+            options = dict(self.definition['cache'] or {})
+            ttl = options.pop('ttl', 30 * 24 * 3600)
+            negative_ttl = options.pop('negative_ttl', 24 * 3600)
+            try:
+                cache = kv_cache.get_cache(**options)
+                hit, location = cache.get(url)
+            except Exception as error:
+                return self._handle_execution_exception(subject, "Could not geocode address with error: `%s`" % str(error))
+
+        if not hit:
+            error, location = self._geocode(url)
+            if error:
+                return self._handle_execution_exception(subject, error)
+            if cache is not None:
+                cache.set(url, location, ttl if location else negative_ttl)
+
+        if location is None:
+            return self._handle_execution_exception(subject, "Could not geocode address. The geocoder returned no matches.")
+        x = location['x']
+        y = location['y']
+        address = location['address']
+        wkt_geometry = 'POINT(%s %s)' % (x, y)
+        ewkt_geometry = 'SRID=28992;' + wkt_geometry
+        subject['geometry'] = ewkt_geometry 
+        self.executed = True
 
         if self.executed and self.definition["report_template"]:
             result = self.definition["report_template"].replace('subject.geometry', subject['geometry'])
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import collections
+
 import psycopg2
 
 try:
@@ -8,6 +10,8 @@ except:
     pass
 
 from ..processors.processor import processor
+from ..utils import pg_pool
+from ..utils import wkb
 
 
 class postgis_processing(processor):
@@ -31,6 +35,11 @@ class postgis_processing(processor):
     `parameters` (list):                  the parameters which are taken by the relationship;
                                             "subject.geometry" will be replaced by the subjects geometry
 
+    optionally having:
+
+    `db_pool` (dict):                     options for the pool of connections to this database, which is shared by all rules
+                                          in the process. See `geoDSS.utils.pg_pool`.
+
 
     Subject example
     ---------------
@@ -41,30 +50,101 @@ class postgis_processing(processor):
 
     '''
 
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
+
+        return set(['geometry'])
+
+    def _expression(self, geometry, function = 'ST_GeomFromEWKT'):
+        '''
+        Private method; returns the SQL expression of the processing. `geometry` is the SQL for the geometry of the subject,
+        which is read with `function` (`ST_GeomFromEWKT` or `ST_GeomFromEWKB`).
+        '''
+
+        parameters = [parameter.replace('%', '%%') for parameter in self.definition['parameters']]
+        parameters = ["%s(%s)" % (function, geometry) if parameter == "subject.geometry" else parameter for parameter in parameters]
+        return "%s(%s)" % (self.definition['processor'], ','.join(parameters))
+
+    def _execute_batch(self, processors, subjects):
+        '''
+        Executes the processor for a number of subjects with a single query. See `rules_set.execute_chunk`.
+
+        `processors`    the copies of this processor bound to the execution of each subject.
+
+        `subjects`      the subjects, in the same order as `processors`.
+        '''
+
+        results = [None] * len(subjects)
+        positions = []                                                                      # the positions of the subjects in the query
+        for position, subject in enumerate(subjects):
+            if "subject.geometry" in self.definition['parameters'] and not 'geometry' in subject:
+                results[position] = processors[position]._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
+            else:
+                positions.append(position)
+        if not positions:
+            return results
+
+        function, array_type, values = pg_pool.geometry_array([subjects[position].get('geometry') for position in positions])
+        output = 'ST_AsEWKB' if array_type == 'bytea' else 'ST_AsEWKT'                   # the geometries are returned as they came
+        sql_string = "SELECT _geodss_subject._geodss_index, %s(%s) as geometry " \
+                     "FROM unnest(%%s::%s[]) WITH ORDINALITY AS _geodss_subject(_geodss_geometry, _geodss_index);" \
+                     % (output, self._expression("_geodss_subject._geodss_geometry", function), array_type)
+
+        pool = pg_pool.get_pool(self.definition['db'], **self.definition.get('db_pool', {}))
+        conn = pool.getconn()
+        try:
+            cur = conn.cursor()
+            self.logger.debug("Executing query for %d subjects: %s" % (len(positions), sql_string))
+            cur.execute(sql_string, (values,))
+            geometries = collections.defaultdict(list)                                      # index in the array (starting at 1): geometries
+            for index, geometry in cur.fetchall():
+                geometries[index].append(geometry)
+            cur.close()
+        finally:
+            pool.putconn(conn)
+
+        for index, position in enumerate(positions):
+            subject = subjects[position]
+            found = geometries[index + 1]
+            if len(found) != 1:                                                             # the same errors as `execute` gives
+                error = "Query returned zero rows." if not found else "Query returned multiple rows. Use an aggregation to force a result with one row."
+                results[position] = processors[position]._handle_execution_exception(subject, "SQL query %s returned error %s" % (sql_string, error))
+                continue
+            if output == 'ST_AsEWKB':
+                subject['geometry'] = wkb.encode(bytes(found[0]), subject['geometry'])
+            else:
+                subject['geometry'] = found[0]
+            processors[position].executed = True
+            results[position] = processors[position]._finish_execution(subject)
+        return results
+
     def execute(self, subject):
         ''' 
         Executes the processor.
 
         `subject` is expected to be a dict having:
 
-        `geometry` (ewkt string):          a proper EWKT string representing the geometry of the subject
+        `geometry` (ewkt string):          a proper EWKT string (or EWKB, see `geoDSS.utils.wkb`) representing the geometry of the subject
         '''
 
-        if "subject.geometry" in self.definition['parameters']:
-            loc = self.definition['parameters'].index("subject.geometry")
-            if 'geometry' in subject:
-                self.definition['parameters'][loc] = "ST_GeomFromEWKT('%s')" % subject['geometry']
-            else:
-                return self._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
+        if "subject.geometry" in self.definition['parameters'] and not 'geometry' in subject:
+            return self._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
 
         try:
-            conn = psycopg2.connect(**self.definition['db'])
-            cur = conn.cursor()
+            pool = pg_pool.get_pool(self.definition['db'], **self.definition.get('db_pool', {}))
+            conn = pool.getconn()
         except (Exception, psycopg2.DatabaseError) as error:
             return self._handle_execution_exception(subject, "Could not get database connection with error: " + str(error))
 
+        cur = None
         try:
-            cur.execute("SELECT ST_AsEWKT(%s(%s)) as geometry;", (self.definition['processor'], ','.join(self.definition['parameters'])) )
+            cur = conn.cursor()
+            function, argument = pg_pool.geometry_argument(subject.get('geometry'))
+            output = 'ST_AsEWKB' if function == 'ST_GeomFromEWKB' else 'ST_AsEWKT'             # the geometry is returned as it came
+            arguments = [argument] * self.definition['parameters'].count("subject.geometry")   # a placeholder for each use of the geometry
+            cur.execute("SELECT %s(%s) as geometry;" % (output, self._expression("%s", function)), arguments)
             self.logger.debug("Executed query: " + cur.query)
             if cur.rowcount == 0:
                 raise exceptions.TypeError("Query returned zero rows.")
@@ -72,14 +152,14 @@ class postgis_processing(processor):
                 raise exceptions.TypeError("Query returned multiple rows. Use an aggregation to force a result with one row.")
             else:
                 row = cur.fetchone()
-                subject['geometry'] = row[0]
+                subject['geometry'] = wkb.encode(bytes(row[0]), subject['geometry']) if output == 'ST_AsEWKB' else row[0]
         except (Exception, psycopg2.DatabaseError, exceptions.TypeError) as error:
-            return self._handle_execution_exception(subject, "SQL query %s returned error %s" % (str(cur.query), str(error)))
+            return self._handle_execution_exception(subject, "SQL query %s returned error %s" % (str(cur and cur.query), str(error)))
+        finally:
+            if cur:
+                cur.close()
+            pool.putconn(conn)                                                              # back to the pool for the next subject
 
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
         self.executed = True
 
         return self._finish_execution(subject)
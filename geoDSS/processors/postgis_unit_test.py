@@ -9,6 +9,8 @@ except:
     pass
 
 from ..processors.processor import processor
+from ..utils import pg_pool
+from ..utils import wkb
 
 # todo
 # refactor met rebel ipv psycopg2:
@@ -31,6 +33,11 @@ class postgis_unit_test(processor):
 
     `db` (dict):                          a dictionary specifying a postgis database connection
 
+    optionally having:
+
+    `db_pool` (dict):                     options for the pool of connections to this database, which is shared by all rules
+                                          in the process. See `geoDSS.utils.pg_pool`.
+
     Rule example
     ------------
 
@@ -55,38 +62,51 @@ class postgis_unit_test(processor):
 
     def _get_postgis_connection(self,db):
         '''
-        Private method; returns a postgis connection.
+        Private method; returns a postgis connection from the pool of the database, or the error when there is none.
+
+        Return the connection with `self._pool.putconn`.
         '''
 
         try:
-            conn = psycopg2.connect(**db)
+            self._pool = pg_pool.get_pool(db, **self.definition.get('db_pool', {}))
+            conn = self._pool.getconn()
         except (Exception, psycopg2.DatabaseError) as error:
             return error
 
         return conn
 
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
+
+        return set(['geometry'])
+
     def execute(self, subject):
         '''
         Executes the postgis unit-like test processor
 
         `subject` is expected to be a dict having:
 
-        `geometry` (ewkt string):          a proper EWKT string representing the geometry of the subject
+        `geometry` (ewkt string):          a proper EWKT string (or EWKB, see `geoDSS.utils.wkb`) representing the geometry of the subject
         '''
 
         self.result = []
 
         conn = self._get_postgis_connection(self.definition['db'])
-        if type(conn) == str:
+        if isinstance(conn, Exception):
             return self._handle_execution_exception(subject, "Could not get database connection with error: " + str(conn))
 
-        cur = conn.cursor()
-
         if not 'geometry' in subject:
+            self._pool.putconn(conn)
             return self._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
 
+        cur = None
         try:
-            cur.execute("SELECT ST_AsEWKT(ST_Buffer(ST_GeomFromEWKT(%s),1)) as geometry;", [subject['geometry']])
+            cur = conn.cursor()
+            function, argument = pg_pool.geometry_argument(subject['geometry'])
+            output = 'ST_AsEWKB' if function == 'ST_GeomFromEWKB' else 'ST_AsEWKT'             # the geometry is returned as it came
+            cur.execute("SELECT %s(ST_Buffer(%s(%%s),1)) as geometry;" % (output, function), [argument])
             self.logger.debug("Executed query: " + cur.query)
             if cur.rowcount == 0:
                 raise exceptions.TypeError("Query returned zero rows.")
@@ -94,16 +114,16 @@ class postgis_unit_test(processor):
                 raise exceptions.TypeError("Query returned multiple rows. Use an aggregation to force a result with one row.")
             else:
                 row = cur.fetchone()
-                subject['geometry'] = row[0]
+                subject['geometry'] = wkb.encode(bytes(row[0]), subject['geometry']) if output == 'ST_AsEWKB' else row[0]
         except (Exception, psycopg2.DatabaseError, exceptions.TypeError) as error:
-            return self._handle_execution_exception(subject, "SQL query %s returned error %s" % (str(cur.query), str(error)))
+            return self._handle_execution_exception(subject, "SQL query %s returned error %s" % (str(cur and cur.query), str(error)))
+        finally:
+            if cur:
+                cur.close()
+            self._pool.putconn(conn)                                    # back to the pool for the next subject
 
         self.result.append("Modified subject to: " + str(subject))
 
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
         self.executed = True
 
         return self._finish_execution(subject)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import copy
 from abc import ABCMeta, abstractmethod
 try:
     import exceptions
@@ -59,6 +60,47 @@ class processor(object):
                 if not key in self.definition:
                     self.definition[key] = value
 
+    def _bind(self, execution):
+        '''
+        Returns a copy of this rule, not executed yet, to keep the state of a single execution.
+
+        The copy shares the definition with this rule. So the definition should not be altered during execution.
+
+        `execution`      the execution_context the copy is part of.
+        '''
+
+        new = copy.copy(self)
+        new.result = []
+        new.executed = False
+        new.execution = execution
+        new.rules = execution._rules
+        return new
+
+    def _reads(self):
+        '''
+        Returns a set with the subject keys this rule reads, or `None` when it may read any key.
+
+        `_reads`, `_writes` and `_rule_references` are used to find the rules which can be executed
+        at the same time when `concurrent_rules` is set in the rule set. A derived class which
+        doesn't override these is never executed at the same time as another rule.
+        '''
+
+        return None
+
+    def _writes(self):
+        '''
+        Returns a set with the subject keys this rule adds or alters, or `None` when it may alter any key.
+        '''
+
+        return None
+
+    def _rule_references(self):
+        '''
+        Returns a set with the names of the rules this rule uses via `self.rules`.
+        '''
+
+        return set()
+
     def _finish_execution(self, subject, message = None, log = False, report = False):
         '''
         Convenience function for processors.
@@ -127,6 +169,11 @@ class processor(object):
         -------
 
         `subject` (dict):   a dict with test subject properties
+
+        does not alter
+        --------------
+
+        `self.definition`   as the definition is shared by all executions of the rule set
             
         sets
         ----
@@ -70,6 +70,13 @@ class random_point_geometry(processor):
     '''
 
 
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
+
+        return set(['geometry'])
+
     def execute(self, subject):
         '''
         Executes the random point gemetry generator.
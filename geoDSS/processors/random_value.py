@@ -65,6 +65,13 @@ class random_value(processor):
     '''
 
 
+    def _writes(self):
+        '''
+        See `processor._writes`.
+        '''
+
+        return set([self.definition['random_value_key']])
+
     def execute(self, subject):
         '''
         Executes the random value generator.
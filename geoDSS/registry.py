@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+'''
+The registry module keeps loaded rule sets in memory, so a long running process (eg. a wsgi application)
+doesn't have to load, parse and set up a rule set again for each request.
+
+As executing a rules_set doesn't alter it, each call to `get` returns the same loaded rules_set
+which can be executed by many requests (and threads) at the same time.
+
+Rule sets are keyed by their (absolute) path, the loader used and the modification time and size of the file.
+So a changed rule set file is loaded again automatically. Optionally a hash of the content of the file is
+part of the key as well, for file systems with a coarse modification time.
+
+The registry is bounded by the number of rule sets and by an estimate of the memory used by these rule sets.
+When one of these limits is reached, the least recently used rule set is evicted.
+
+Rule sets which are not on the local file system (eg. fetched via http) are not cached.
+
+Example
+-------
+
+    from geoDSS import registry
+
+    r = registry.get('geoDSS/examples/rule_sets/unit_test.yaml')
+    e = r.execute( subject = {  'result': True,
+                                'geometry': 'SRID=28992;POINT(125000 360000)'
+                             })
+    print(e.report())
+'''
+
+import collections
+import hashlib
+import logging
+import os
+import sys
+import threading
+import types
+
+from .base import rules_set
+from . import loaders
+
+
+_shared_types = (types.ModuleType, type, getattr(types, 'ClassType', type), types.FunctionType, types.BuiltinFunctionType,
+                 types.MethodType, logging.Logger, type(threading.local()))    # shared by the process, or per thread; not counted
+
+
+def _deep_sizeof(obj, seen = None):
+    '''
+    Private function; returns a rough estimate of the memory used by an object and all objects it refers to,
+    including the attributes of objects (eg. the rules of a rules_set and what they set up when loaded).
+    '''
+
+    if seen is None:
+        seen = set()
+    if id(obj) in seen or isinstance(obj, _shared_types):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size = size + _deep_sizeof(key, seen) + _deep_sizeof(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size = size + _deep_sizeof(item, seen)
+    else:
+        attributes = getattr(obj, '__dict__', None)
+        if isinstance(attributes, dict):
+            size = size + _deep_sizeof(attributes, seen)
+    return size
+
+
+class rules_set_registry(object):
+    '''
+    A process wide, thread safe, least recently used cache of loaded rule sets.
+
+    `max_entries` (int):        The maximum number of rule sets to keep. Defaults to 32.
+
+    `max_memory` (int):         The (estimated) maximum number of bytes the kept rule sets may use. Defaults to 64 MB.
+                                The whole rules_set is measured when it is loaded: the definition, the rules and what
+                                they set up (eg. compiled expressions). What rules keep in the caches of the process
+                                (eg. `geoDSS.utils.geometries`) is bounded by those caches.
+
+    `verify_content` (bool):    When `True` a hash of the content of the rule set file is part of the key. Defaults to `False`.
+    '''
+
+    def __init__(self, max_entries = 32, max_memory = 64 * 1024 * 1024, verify_content = False):
+        self.max_entries = max_entries
+        self.max_memory = max_memory
+        self.verify_content = verify_content
+        self._entries = collections.OrderedDict()                       # key: (rules_set, estimated size); the last one is the most recently used
+        self._keys = {}                                                 # (path, loader name): the key under which that rule set is kept
+        self._memory = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, rules_set_file, loader_module):
+        '''
+        Private method; returns the key for a rule set file or None if the file can't be cached.
+        '''
+
+        if not os.path.isfile(rules_set_file):
+            return None
+        path = os.path.abspath(rules_set_file)
+        stat = os.stat(path)
+        key = (path, loader_module.__name__, stat.st_mtime, stat.st_size)
+        if self.verify_content:
+            with open(path, 'rb') as f:
+                key = key + (hashlib.sha1(f.read()).hexdigest(),)
+        return key
+
+    def _evict(self, key):
+        '''
+        Private method; removes a rule set from the registry. The lock should be held by the caller.
+        '''
+
+        r, size = self._entries.pop(key)
+        self._memory = self._memory - size
+        if self._keys.get(key[:2]) == key:
+            del self._keys[key[:2]]
+
+    def get(self, rules_set_file, loader_module = loaders.yaml_loader):
+        '''
+        Returns the loaded rules_set for the given rule set file.
+
+        The rule set is loaded with the `load_rule_set` method of the `loader_module` only when it
+        isn't in the registry yet, or when the file has changed since it was loaded.
+        '''
+
+        key = self._key(rules_set_file, loader_module)
+        if key is None:
+            return rules_set(rules_set_file, loader_module)
+
+        with self._lock:
+            if key in self._entries:
+                r, size = self._entries.pop(key)
+                self._entries[key] = (r, size)                          # re-insert to mark as most recently used
+                self.hits = self.hits + 1
+                return r
+            self.misses = self.misses + 1
+
+        r = rules_set(rules_set_file, loader_module)                    # load outside the lock; a slow load shouldn't block other rule sets
+        size = _deep_sizeof(r)
+
+        with self._lock:
+            if key[:2] in self._keys and self._keys[key[:2]] in self._entries:
+                self._evict(self._keys[key[:2]])                        # an outdated version of the same file
+            if key in self._entries:
+                self._evict(key)                                        # loaded concurrently by another thread
+            if size <= self.max_memory:
+                self._entries[key] = (r, size)
+                self._keys[key[:2]] = key
+                self._memory = self._memory + size
+                while len(self._entries) > self.max_entries or self._memory > self.max_memory:
+                    self._evict(next(iter(self._entries)))
+        return r
+
+    def clear(self):
+        '''
+        Removes all rule sets from the registry.
+        '''
+
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+            self._memory = 0
+
+    def stats(self):
+        '''
+        Returns a dict with statistics on the registry.
+        '''
+
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'memory': self._memory,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+_registry = rules_set_registry()
+
+
+def configure(max_entries = None, max_memory = None, verify_content = None):
+    '''
+    Configures the process wide registry used by `get`.
+    '''
+
+    if max_entries is not None:
+        _registry.max_entries = max_entries
+    if max_memory is not None:
+        _registry.max_memory = max_memory
+    if verify_content is not None:
+        _registry.verify_content = verify_content
+
+
+def get(rules_set_file, loader_module = loaders.yaml_loader):
+    '''
+    Returns the loaded rules_set for the given rule set file from the process wide registry.
+
+    See `rules_set_registry.get`.
+    '''
+
+    return _registry.get(rules_set_file, loader_module)
+
+
+def stats():
+    '''
+    Returns a dict with statistics on the process wide registry.
+    '''
+
+    return _registry.stats()
@@ -27,7 +27,7 @@ def rule_set_reporter(rule_set, output_format = 'plain_text', **kwargs):
     obj = rule_set
     
     txt = u''
-    if len(obj.definition['description']):
+    if len(obj.definition['description']) and not kwargs.get('rules_only', False):
         txt = txt + obj.definition['description'].replace('{timestamp}', datetime.datetime.now().isoformat()) + '\n'
 
     for rule in rule_set.rules:
@@ -150,19 +150,21 @@ class _VersionedOutputFile:
 
 
 
-def execute_and_report(rule_set, subject, output_file, num_backups = 3):
+def execute_and_report(rule_set, subject, output_file, execution = None, num_backups = 3):
     '''
     Run a subject against a rule_set scheduled.
     The rule_set is reported only once, and the report fo the rules will be appended to the output file.
+
+    Pass the same `execution` (a geoDSS.execution_context) to each run to accumulate the reports.
     '''
     
     try:
-        rule_set.execute(subject)
+        execution = rule_set.execute(subject, execution)
     except Exception as e:
         print("geoDSS: could not execute rule with subject due to an error: " + str(e))
     else:
         outf = _VersionedOutputFile(output_file, num_backups)
-        outf.write(rule_set.report())                       # reports accumulate as long as we don't re-initialize the geoDSS.rules_set
+        outf.write(execution.report())                      # reports accumulate as long as we execute with the same execution_context
         outf.close()
     
 def schedule_geoDSS(rule_set_file, subject, output_file, interval = 1, units = "hours", at = "00.00", for_minutes = 0, for_hours = 0, num_backups = 3):
@@ -192,19 +194,21 @@ def schedule_geoDSS(rule_set_file, subject, output_file, interval = 1, units = "
     
     if os.path.exists(output_file):
         os.remove(output_file)
+
+    execution = geoDSS.execution_context(r)
         
     if units == "months":
-        schedule.every(interval).months.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, num_backups = num_backups)
+        schedule.every(interval).months.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, execution = execution, num_backups = num_backups)
     elif units == "weeks":
-        schedule.every(interval).weeks.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, num_backups = num_backups)
+        schedule.every(interval).weeks.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, execution = execution, num_backups = num_backups)
     elif units == "days":
-        schedule.every(interval).days.at(at).do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, num_backups = num_backups)
+        schedule.every(interval).days.at(at).do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, execution = execution, num_backups = num_backups)
     elif units == "hours":
-        schedule.every(interval).hours.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, num_backups = num_backups)
+        schedule.every(interval).hours.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, execution = execution, num_backups = num_backups)
     elif units == "minutes":
-        schedule.every(interval).minutes.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, num_backups = num_backups)
+        schedule.every(interval).minutes.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, execution = execution, num_backups = num_backups)
     elif units == "seconds":
-        schedule.every(interval).seconds.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, num_backups = num_backups)
+        schedule.every(interval).seconds.do(execute_and_report, rule_set = r, subject = subject, output_file = output_file, execution = execution, num_backups = num_backups)
 
     period_to_run = None
     if for_minutes:
@@ -44,6 +44,11 @@ try:
     from ..tests import wfs2_SpatialOperator
 except ImportError:
     pass
+
+try:
+    from ..tests import local_spatial_select
+except ImportError:
+    pass
     
 try:
     from ..tests import pdf
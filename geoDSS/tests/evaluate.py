@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import re
+
 try:
     import exceptions
 except:
     pass
 
 from ..tests.test import test
+from ..utils import expressions
+
+_namespace = expressions.namespace()
 
 class evaluate(test):
     '''
@@ -22,6 +27,9 @@ class evaluate(test):
     `expression` (string):                The expression to evaluate.
                                           eg. `"rules.first_test and rules.second_test"`.
                                           Between the named tests python boolan logic and operators can be used like `and`, `or`, `not`.
+                                          The expression is compiled when the rule set is loaded, so a syntax error is raised then.
+                                          Besides `rules`, the expression can use `subject` and the builtins listed in
+                                          `geoDSS.utils.expressions.SAFE_BUILTINS`.
 
     `report_template` (string):           String to be reported when the test evaluates to True. May be omited, to only report the reports
                                           from the list given in `add_to_report`.
@@ -52,6 +60,35 @@ class evaluate(test):
         subject = {'result': True}
     '''
 
+    def __init__(self, name, definition, logger, rules, settings = None):
+        super(evaluate, self).__init__(name, definition, logger, rules, settings)
+        self._code = expressions.compile_expression(self.definition['expression'], name)
+
+    def _reads(self):
+        '''
+        See `test._reads`.
+        '''
+
+        if re.search(r'\bsubject\b', self.definition['expression']):
+            return None                                                 # the expression may read any key of the subject
+        return set()
+
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        return set()
+
+    def _rule_references(self):
+        '''
+        See `test._rule_references`.
+        '''
+
+        names = set(re.findall(r'\brules\.(\w+)', self.definition['expression']))
+        names.update(self.definition.get('add_to_report', []))
+        return names
+
     def execute(self, subject):
         ''' 
         Executes the test.
@@ -63,8 +100,7 @@ class evaluate(test):
         self.logger.debug('Evaluating: %s' % self.definition["expression"]) 
 
         try:
-            rules = self.rules
-            self.decision = eval( self.definition["expression"] )
+            self.decision = expressions.evaluate(self._code, _namespace, rules = self.rules, subject = subject)
         except Exception as error:
             return self._handle_execution_exception(subject, "Could not succesfully evaluate expression: '%s' with error: %s " % ( self.definition["expression"], str(error)))
 
@@ -73,7 +109,7 @@ class evaluate(test):
                 self.result.append(self.definition["report_template"])
             if 'add_to_report' in self.definition:
                 for test_name in self.definition['add_to_report']:
-                    self.result.extend(getattr(getattr(rules,test_name), 'result'))
+                    self.result.extend(getattr(getattr(self.rules,test_name), 'result'))
         
         self.executed = True
 
@@ -17,6 +17,7 @@ except:
     
 from ..tests.test import test
 from ..tests.test import utils
+from ..utils import geometries
 
 class get_map(test):
     '''
@@ -94,20 +95,28 @@ class get_map(test):
 
         return bbox
 
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        return set()
+
     def execute(self, subject):
         ''' 
         Executes the test.
 
         `subject`       is expected a dict containing at least:
         
-        - `geometry`    the geometry of the subject in EWKT. eg. `"SRID=28992;POINT(138034.181 452694.342)"`.
-                        the MULTI variant of geometry types is not supported.
+        - `geometry`    the geometry of the subject in EWKT. eg. `"SRID=28992;POINT(138034.181 452694.342)"`,
+                        or EWKB (see `geoDSS.utils.wkb`).
                      
         '''
 
-        params = self.definition['params']
+        params = dict(self.definition['params'])                                            # a copy, as the definition is shared by all executions
         try:
-            bbox = self._buffer(bbox = utils.wkt._get_bbox(subject['geometry']), 
+            geometry = geometries.get(subject['geometry'])
+            bbox = self._buffer(bbox = list(geometry.bbox()), 
                                 distance = self.definition["buffer"], 
                                 width = params["width"], 
                                 height = params["height"] )
@@ -124,11 +133,10 @@ class get_map(test):
 
         try:
             url = self.definition['url']
-            params = self.definition["params"]
             params['service'] = 'WMS'
             params['request'] = 'GetMap'
-            key, value = self._get_srs(ewkt = subject['geometry'], version = params["version"])
-            params[key] = value
+            key = 'CRS' if params["version"] == '1.3.0' else 'SRS'
+            params[key] = 'EPSG:%s' % geometry.srid
             qs = urlencode(params)
         except Exception as error:
             self.logger.debug(traceback.format_exc())
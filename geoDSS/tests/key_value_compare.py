@@ -51,6 +51,23 @@ class key_value_compare(test):
         subject = {"brzo": "true"}
     '''
 
+    def _reads(self):
+        '''
+        See `test._reads`.
+        '''
+
+        keys = set([self.definition['key']])
+        if isinstance(self.definition['value'], basestring):
+            keys.add(self.definition['value'])                           # the value may be taken from the subject
+        return keys
+
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        return set()
+
     def execute(self, subject):
         ''' 
         Executes the test.
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+from osgeo import ogr, osr
+
+try:
+    import exceptions
+except:
+    pass
+
+from ..tests.test import test
+from ..utils import geometries
+from ..utils import rtree
+
+_supported_relationships = {'intersects':   lambda geometry, feature, distance: geometry.Intersects(feature),
+                            'within':       lambda geometry, feature, distance: geometry.Within(feature),
+                            'contains':     lambda geometry, feature, distance: geometry.Contains(feature),
+                            'dwithin':      lambda geometry, feature, distance: geometry.Distance(feature) <= distance,
+                            'touches':      lambda geometry, feature, distance: geometry.Touches(feature),
+                            'crosses':      lambda geometry, feature, distance: geometry.Crosses(feature),
+                            'overlaps':     lambda geometry, feature, distance: geometry.Overlaps(feature)}
+
+_layers = {}                                                                                # (file, mtime, layer, where): _layer
+_layers_lock = threading.Lock()
+
+
+class _layer(object):
+    '''
+    Private class; the features of a vector layer kept in memory, with an R-tree on their bounding boxes.
+    '''
+
+    def __init__(self, file_name, layer_name = None, where = None):
+        data_source = ogr.Open(file_name)
+        if data_source is None:
+            raise exceptions.IOError('Could not open %s.' % file_name)
+        if layer_name is None:
+            layer = data_source.GetLayer()
+        else:
+            layer = data_source.GetLayer(layer_name)
+        if layer is None:
+            raise exceptions.IOError('Could not find layer %s in %s.' % (layer_name, file_name))
+        if where:
+            layer.SetAttributeFilter(where)
+
+        self.srs = layer.GetSpatialRef()
+        if self.srs is not None:
+            self.srs = self.srs.Clone()
+        layer_definition = layer.GetLayerDefn()
+        self.fields = [layer_definition.GetFieldDefn(i).GetName() for i in range(layer_definition.GetFieldCount())]
+        self.geometries = []
+        self.attributes = []
+        items = []
+        for feature in layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            minx, maxx, miny, maxy = geometry.GetEnvelope()
+            items.append(((minx, miny, maxx, maxy), len(self.geometries)))
+            self.geometries.append(geometry.Clone())                                        # the feature and its geometry are gone after the next one
+            self.attributes.append([feature.GetField(i) for i in range(len(self.fields))])
+        self.index = rtree.str_tree(items)
+
+
+def _get_layer(file_name, layer_name = None, where = None):
+    '''
+    Private function; returns the layer of a file, loaded once in a process. The layer is loaded again when the file is changed.
+    '''
+
+    key = (os.path.abspath(file_name), os.path.getmtime(file_name), layer_name, where)
+    with _layers_lock:
+        if not key in _layers:
+            for old_key in [old_key for old_key in _layers if old_key[0] == key[0] and old_key[2:] == key[2:]]:
+                del _layers[old_key]                                                        # an outdated version of the same file
+            _layers[key] = _layer(file_name, layer_name, where)
+        return _layers[key]
+
+
+class local_spatial_select(test):
+    '''
+    This test selects the features of a local vector layer (eg. a GeoPackage, Shapefile or GeoJSON file) having a
+    spatial relationship with the subject.
+
+    The layer is read once in a process and kept in memory with a spatial index (an STR packed R-tree). So a
+    reference layer like municipality boundaries can be used without a database or web service.
+
+    Dependencies
+    ------------
+
+    - osgeo
+
+    Definition
+    ----------
+
+    `definition` is expected to be a dict having:
+
+    `file` (string):                      the file containing the layer. Any vector format OGR can read will do.
+
+    `relationship` (string):              the relationship between the subjects geometry and the geometry of a feature.
+                                          One of: Intersects, Within, Contains, DWithin, Touches, Crosses, Overlaps.
+                                          `Within` selects the features the subjects geometry is within. A `ST_` prefix is allowed.
+
+    `report_template` (string):           String to be reported when the test is True.
+                                          If multiple features are selected, multiple reports will be written, but a report will not be duplicated.
+                                          In the string fields of the layer can be named.
+                                          eg. `{my_param}` will be replaced by the value in the field my_param.
+
+    optionally having:
+
+    `distance` (number):                  the distance for the DWithin relationship, in the units of the layer.
+
+    `layer` (string or int):              the name or index of the layer in the file. Defaults to the first layer.
+
+    `where` (string):                     an attribute filter (an SQL WHERE clause) selecting the features of the layer to use.
+
+    When the spatial reference system of the layer is known and differs from the SRID of the subjects geometry,
+    the subjects geometry is transformed to the spatial reference system of the layer.
+
+    Rule example
+    ------------
+
+    a useful yaml snippet for this test would be:
+
+        - gemeente:
+            type: tests.local_spatial_select
+            title: Gemeente
+            description: ""
+            file: /data/gemeenten.gpkg
+            relationship: Within
+            report_template: Adres is gelegen in de gemeente *{gemeentenaam}*
+
+    Subject example
+    ---------------
+
+    a usefull subject for this would be:
+
+        subject = { "geometry": "SRID=28992;POINT(138034.181 452694.342)"}
+    '''
+
+    def _reads(self):
+        '''
+        See `test._reads`.
+        '''
+
+        return set(['geometry'])
+
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        return set()
+
+    def _subject_geometry(self, ewkt, srs):
+        '''
+        Private method; returns the subjects geometry as an ogr geometry in the spatial reference system `srs` of the layer.
+        '''
+
+        handle = geometries.get(ewkt)
+        srid = handle.srid
+        if not (srid and srs is not None and srs.GetAuthorityCode(None) and int(srs.GetAuthorityCode(None)) != srid):
+            return handle.ogr(copy = False)                                                 # only read by the relationships
+
+        geometry = handle.ogr()                                                             # a copy, as it is transformed
+        source = osr.SpatialReference()
+        source.ImportFromEPSG(srid)
+        target = srs.Clone()
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):                                      # GDAL 3 uses the axis order of the authority
+            source.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            target.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        geometry.Transform(osr.CoordinateTransformation(source, target))
+        return geometry
+
+    def execute(self, subject):
+        '''
+        Executes the test.
+
+        `subject` is expected to be a dict having:
+
+        `geometry` (ewkt string):          a proper EWKT string (or EWKB, see `geoDSS.utils.wkb`) representing the geometry of the subject
+        '''
+
+        if not 'geometry' in subject:
+            return self._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
+
+        relationship = self.definition['relationship'].lower()
+        if relationship.startswith('st_'):
+            relationship = relationship[3:]
+        if not relationship in _supported_relationships:
+            return self._handle_execution_exception(subject, "Relationship %s not supported. Choose one of %s." % (self.definition['relationship'], ', '.join(sorted(_supported_relationships))))
+        distance = float(self.definition.get('distance', 0))
+
+        try:
+            layer = _get_layer(self.definition['file'], self.definition.get('layer'), self.definition.get('where'))
+        except Exception as error:
+            return self._handle_execution_exception(subject, "Could not read layer from %s with error: %s" % (self.definition['file'], str(error)))
+
+        try:
+            geometry = self._subject_geometry(subject['geometry'], layer.srs)
+        except Exception as error:
+            return self._handle_execution_exception(subject, "Could not use the geometry of the subject with error: " + str(error))
+
+        minx, maxx, miny, maxy = geometry.GetEnvelope()
+        candidates = layer.index.query((minx - distance, miny - distance, maxx + distance, maxy + distance))
+        matches = _supported_relationships[relationship]
+        template = self.definition['report_template']
+        placeholders = [(index, "{%s}" % field) for index, field in enumerate(layer.fields) if "{%s}" % field in template]
+        reported = set()
+        self.decision = False
+        for candidate in sorted(candidates):                                                # in the order of the layer
+            if not matches(geometry, layer.geometries[candidate], distance):
+                continue
+            self.decision = True
+            to_report = template
+            for index, placeholder in placeholders:
+                to_report = to_report.replace(placeholder, str(layer.attributes[candidate][index]))
+            if not to_report in reported:
+                reported.add(to_report)
+                self.result.append(to_report)
+
+        self.executed = True
+
+        return self._finish_execution(subject)
@@ -45,6 +45,7 @@ except:
     pass
 
 from ..tests.test import test
+from ..utils import http_sessions
 
 
 class pdf(test):
@@ -114,6 +115,9 @@ class pdf(test):
     
     `fuzzy_score`           When given fuzzy matching of the `search_string` is done. 
 
+    `http_pool`             options for the connections to the host of the url, which are kept open and shared by all rules
+                            in the process. See `geoDSS.utils.http_sessions`.
+
     Rule example
     ------------
 
@@ -146,6 +150,15 @@ class pdf(test):
         subject = {"search_string":"data science"}
     '''
 
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        if 'return_subject_key' in self.definition:
+            return set([self.definition['return_subject_key']])
+        return set()
+
     def execute(self, subject):
         '''
         Executes the test.
@@ -221,17 +234,17 @@ class pdf(test):
 
         if self.definition["verb"] == 'GET':
             try:
-                response = requests.get(url, params=data, headers=headers, verify=verify, auth=auth)
+                response = http_sessions.get(url, params=data, headers=headers, verify=verify, auth=auth, http_pool=self.definition.get('http_pool'))
             except Exception as error:
                 return self._handle_execution_exception(subject, "Could not 'GET' url '%s' with error: %s" % (url, str(error)))
         elif self.definition["verb"] == 'POST':
             try:
-                response = requests.post(url, data=data, headers=headers, verify=verify, auth=auth)
+                response = http_sessions.post(url, data=data, headers=headers, verify=verify, auth=auth, http_pool=self.definition.get('http_pool'))
             except Exception as error:
                 return self._handle_execution_exception(subject, "Could not 'POST' on url '%s' with error: %s" % (url, str(error)))
         elif self.definition["verb"] == 'HEAD':
             try:
-                response = requests.head(url, params=data, headers=headers, verify=verify, auth=auth)
+                response = http_sessions.head(url, params=data, headers=headers, verify=verify, auth=auth, http_pool=self.definition.get('http_pool'))
             except Exception as error:
                 return self._handle_execution_exception(subject, "Could not 'HEAD' url '%s' with error: %s" % (url, str(error)))
         else:
@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import itertools
+import re
+import threading
+
 try:
     import psycopg2
 except:
@@ -11,6 +16,11 @@ except:
     pass
 
 from ..tests.test import test
+from ..utils import pg_pool
+
+_table_columns = {}                                                                         # (pool, schema, table): the set of column names
+_table_columns_lock = threading.Lock()
+_cursor_numbers = itertools.count()                                                         # to give each server side cursor its own name
 
 
 class postgis_spatial_select(test):
@@ -42,11 +52,27 @@ class postgis_spatial_select(test):
                                           If multiple rows are returned by the query, multiple reports will be written, but a report will not be duplicated.
                                           In the string columns in the result set of the query can be named.
                                           eg. `{my_param}` will be replaced by the value in the column my_param.
+                                          Only the columns named in the string are fetched from the database, as text and without
+                                          duplicate rows. When no column is named, the query stops at the first matching row.
     
     optionally having:
 
     `where` (string):                     an aditionaly clause to attach to the WHERE clause. Should start with a boolean operator like AND, OR, XOR.
 
+    `max_reports` (int):                  the maximum number of reports. Further matching rows are not fetched from the database.
+
+    `itersize` (int):                     when given, matching rows are streamed from the database with a server side cursor,
+                                          fetching this number of rows at a time. This bounds the memory used for queries with
+                                          many matching rows, and stops fetching once `max_reports` is reached.
+                                          A query using a server side cursor is not prepared.
+
+    `prepared_statements` (bool):         when `True` (default) the query is prepared once on each database connection and executed
+                                          with the geometry of the subject as parameter. Set to `False` when connecting via a
+                                          connection pooler which doesn't support prepared statements.
+
+    `db_pool` (dict):                     options for the pool of connections to this database, which is shared by all rules
+                                          in the process. See `geoDSS.utils.pg_pool`.
+
     Rule example
     ------------
 
@@ -76,67 +102,256 @@ class postgis_spatial_select(test):
 
     '''
 
+    def _reads(self):
+        '''
+        See `test._reads`.
+        '''
+
+        return set(['geometry', 'params'])
+
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        return set()
+
+    def _relationship(self, geometry):
+        '''
+        Private method; returns the SQL for the relationship. `geometry` is the SQL for the geometry of the subject.
+        '''
+
+        parameters = [parameter.replace('%', '%%') for parameter in self.definition['parameters']]
+        parameters = [geometry if parameter == "subject.geometry" else parameter for parameter in parameters]
+        return ' %s(%s) ' % (self.definition['relationship'], ','.join(parameters))
+
+    def _projection(self, pool, conn):
+        '''
+        Private method; returns the columns of the table used in the `report_template`. These are the only columns to select.
+
+        An empty list means the template doesn't use any column, so only the decision matters. `None` means the
+        columns of the table are unknown, so all columns are selected.
+
+        The columns of a table are looked up once in a process.
+        '''
+
+        key = (pool, self.definition['schema'], self.definition['table'])
+        with _table_columns_lock:
+            columns = _table_columns.get(key)
+        if columns is None:
+            cur = conn.cursor()
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s;",
+                        [self.definition['schema'], self.definition['table']])
+            columns = set(row[0] for row in cur.fetchall())
+            cur.close()
+            with _table_columns_lock:
+                _table_columns[key] = columns
+        if not columns:
+            return None
+
+        projection = []
+        for col in re.findall(r'\{([^{}]+)\}', self.definition['report_template']):
+            if col in columns and not col in projection:
+                projection.append(col)
+        return projection
+
+    def _table(self):
+        '''
+        Private method; returns the SQL for the table. The table isn't aliased, so `parameters` and `where` can qualify
+        columns with the table name (eg. `percelen.status`).
+        '''
+
+        return '%s.%s' % (self.definition['schema'], self.definition['table'])
+
+    def _select(self, projection, index = None):
+        '''
+        Private method; returns the SELECT clause for the columns returned by `_projection`.
+
+        Rows are made distinct, as duplicate rows would give duplicate reports. The columns are selected as text,
+        which can be compared for every column type (eg. json) and is how they are reported anyway.
+
+        `index`     the SQL for the index of the subject in the set-based query, selected in front of the columns.
+        '''
+
+        if projection is None:
+            return 'SELECT ' + ', '.join(([index] if index else []) + [self._table() + '.*'])
+        columns = ['%s."%s"::text AS "%s"' % (self._table(), col.replace('"', '""'), col.replace('"', '""')) for col in projection]
+        if index:
+            columns.insert(0, '%s AS _geodss_index' % index)
+        if not columns:
+            return 'SELECT 1'
+        return 'SELECT DISTINCT ' + ', '.join(columns)
+
+    def _cursor(self, conn):
+        '''
+        Private method; returns the cursor to execute the query with. With `itersize` in the definition this is a
+        server side cursor, fetching `itersize` rows at a time while iterating over it.
+        '''
+
+        if self.definition.get('itersize'):
+            cur = conn.cursor(name = 'geodss_cursor_%d' % next(_cursor_numbers))
+            cur.itersize = int(self.definition['itersize'])
+            return cur
+        return conn.cursor()
+
+    def _prepare(self):
+        '''
+        Private method; returns whether the query should be prepared. A server side cursor can't use a prepared statement.
+        '''
+
+        return self.definition.get('prepared_statements', True) and not self.definition.get('itersize')
+
+    def _max_reports(self):
+        '''
+        Private method; returns the maximum number of reports, or `None` when there is no maximum.
+        '''
+
+        if self.definition.get('max_reports'):
+            return int(self.definition['max_reports'])
+        return None
+
+    def _report_rows(self, cols, rows):
+        '''
+        Private method; adds a report for each row to the result, using the `report_template`. A report is not duplicated.
+        '''
+
+        template = self.definition['report_template']
+        placeholders = [(index, "{%s}" % col) for index, col in enumerate(cols) if "{%s}" % col in template]
+        max_reports = self._max_reports()
+        reported = set(self.result)
+        for row in rows:
+            if max_reports is not None and len(self.result) >= max_reports:
+                break
+            to_report = template
+            for index, placeholder in placeholders:
+                to_report = to_report.replace(placeholder, str(row[index]))
+            if not to_report in reported:
+                reported.add(to_report)
+                self.result.append(to_report)
+
+    def _execute_batch(self, rules, subjects):
+        '''
+        Executes the test for a number of subjects with a single query. See `rules_set.execute_chunk`.
+
+        The geometries of the subjects are sent as an array, which is joined with the table using the relationship.
+        So the database can use its spatial index once for all subjects. The rows are then split out per subject.
+
+        `rules`     the copies of this rule bound to the execution of each subject.
+
+        `subjects`  the subjects, in the same order as `rules`.
+        '''
+
+        if 'where' in self.definition.keys() and [subject for subject in subjects if subject.get('params')]:
+            return [rule.execute(subject) for rule, subject in zip(rules, subjects)]                # the WHERE clause differs per subject
+
+        results = [None] * len(subjects)
+        positions = []                                                                      # the positions of the subjects in the query
+        for position, subject in enumerate(subjects):
+            if "subject.geometry" in self.definition['parameters'] and not 'geometry' in subject:
+                results[position] = rules[position]._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
+            else:
+                positions.append(position)
+        if not positions:
+            return results
+
+        function, array_type, geometries = pg_pool.geometry_array([subjects[position].get('geometry') for position in positions])
+        on = self._relationship("%s(_geodss_subject._geodss_geometry)" % function)
+        if 'where' in self.definition.keys():
+            on = on + self.definition['where'].replace('%', '%%')
+        pool = pg_pool.get_pool(self.definition['db'], **self.definition.get('db_pool', {}))
+        conn = pool.getconn()
+        try:
+            projection = self._projection(pool, conn)
+            sql_string = '%s ' \
+                         'FROM unnest(%%s::%s[]) WITH ORDINALITY AS _geodss_subject(_geodss_geometry, _geodss_index) ' \
+                         'JOIN %s ON %s' % (self._select(projection, '_geodss_subject._geodss_index'), array_type, self._table(), on)
+            if projection and self._max_reports():
+                columns = ', '.join('"%s"' % col.replace('"', '""') for col in projection)
+                sql_string = 'SELECT _geodss_index, %s FROM (' \
+                             'SELECT _geodss_distinct.*, row_number() OVER (PARTITION BY _geodss_index) AS _geodss_row ' \
+                             'FROM (%s) AS _geodss_distinct) AS _geodss_numbered ' \
+                             'WHERE _geodss_row <= %d' % (columns, sql_string, self._max_reports())   # max_reports rows for each subject
+            sql_string = sql_string + ' ;'
+            self.logger.debug("Executing query for %d subjects: %s" % (len(positions), sql_string))
+            cur = self._cursor(conn)
+            pool.execute(cur, sql_string, [geometries], self._prepare())
+            rows = collections.defaultdict(list)                                            # index in the array (starting at 1): rows
+            for row in cur:
+                rows[row[0]].append(row[1:])
+            cols = [desc[0] for desc in cur.description or []][1:]
+            cur.close()
+        finally:
+            pool.putconn(conn)
+
+        for index, position in enumerate(positions):
+            rule = rules[position]
+            rule.decision = bool(rows[index + 1])
+            rule._report_rows(cols, rows[index + 1])
+            rule.executed = True
+            results[position] = rule._finish_execution(subjects[position])
+        return results
+
     def execute(self, subject):
         ''' 
         Executes the test.
 
         `subject` is expected to be a dict having:
 
-        `geometry` (ewkt string):          a proper EWKT string representing the geometry of the subject
+        `geometry` (ewkt string):          a proper EWKT string (or EWKB, see `geoDSS.utils.wkb`) representing the geometry of the subject
         
         optionally having:
             
         `params` (dict):                   a dict containing key value pairs to be inserted in the optional WHERE clause given in the definition of the rule
         '''
 
-        if "subject.geometry" in self.definition['parameters']:
-            loc = self.definition['parameters'].index("subject.geometry")
-            if 'geometry' in subject:
-                self.definition['parameters'][loc] = "ST_GeomFromEWKT('%s')" % subject['geometry']
-            else:
-                return self._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
+        if "subject.geometry" in self.definition['parameters'] and not 'geometry' in subject:
+            return self._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
 
+        prepare = self.definition.get('prepared_statements', True)
         try:
-            where = ' %s(%s) ' % (self.definition['relationship'], ','.join(self.definition['parameters']))
+            function, argument = pg_pool.geometry_argument(subject.get('geometry'))          # EWKB is bound as binary
+            where = self._relationship("%s(%%s)" % function)
             if 'where' in self.definition.keys():
                 if 'params' in subject and subject['params']:
-                    where = where + self.definition['where'].format(subject['parameters'])
+                    where = where + self.definition['where'].format(**subject['params']).replace('%', '%%')
+                    prepare = False                                                         # the statement differs for each subject
                 else:
-                    where = where + self.definition['where']
+                    where = where + self.definition['where'].replace('%', '%%')
         except Exception as error:
             return self._handle_execution_exception(subject, "Could not construct the SQL WHERE clause with error: " + str(error))
 
         try:
-            conn = psycopg2.connect(**self.definition['db'])
-            cur = conn.cursor()
+            pool = pg_pool.get_pool(self.definition['db'], **self.definition.get('db_pool', {}))
+            conn = pool.getconn()
         except (Exception, psycopg2.DatabaseError) as error:
             return self._handle_execution_exception(subject, "Could not get database connection with error: " + str(error))
 
+        cur = None
         try:
-            sql_string = 'SELECT * FROM %s.%s WHERE %s ;' % (self.definition['schema'], self.definition['table'], where)
-            self.logger.debug("Executing query: " + sql_string)
-            cur.execute(sql_string)
-            cols = [desc[0] for desc in cur.description]
-            
-            if cur.rowcount == 0:
-                self.decision = False
-            else:
-                self.decision = True
-                rows = cur.fetchall()
-                for row in rows:
-                    to_report = self.definition['report_template']
-                    for col in cols:
-                        if "{%s}" % col in to_report:
-                            to_report = to_report.replace("{%s}" % col, str(row[cols.index(col)]))
-                    if not to_report in self.result:
-                        self.result.append(to_report)
+            projection = self._projection(pool, conn)
+            limit = ''
+            if projection == []:
+                limit = ' LIMIT 1'                                                          # only the decision matters
+            elif projection and self._max_reports():
+                limit = ' LIMIT %d' % self._max_reports()                                   # distinct rows give distinct reports
+            sql_string = '%s FROM %s WHERE %s%s ;' % (self._select(projection), self._table(), where, limit)
+            arguments = [argument] * self.definition['parameters'].count("subject.geometry")
+            self.logger.debug("Executing query: %s with geometry: %s" % (sql_string, subject.get('geometry')))
+            cur = self._cursor(conn)
+            pool.execute(cur, sql_string, arguments, prepare and self._prepare())           # the geometry is a bound parameter, not part of the SQL
+
+            rows = iter(cur)                                                                # rows are formatted while they are fetched
+            first = next(rows, None)
+            self.decision = first is not None
+            if self.decision:
+                self._report_rows([desc[0] for desc in cur.description], itertools.chain([first], rows))
         except (Exception, psycopg2.DatabaseError) as error:
-            return self._handle_execution_exception(subject, "SQL query %s returned error %s" % (str(cur.query), str(error)))
+            return self._handle_execution_exception(subject, "SQL query %s returned error %s" % (str(cur and cur.query), str(error)))
+        finally:
+            if cur:
+                cur.close()
+            pool.putconn(conn)                                                              # back to the pool for the next subject
 
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
         self.executed = True
 
         return self._finish_execution(subject)
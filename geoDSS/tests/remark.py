@@ -51,6 +51,13 @@ class remark(test):
         subject = {}
     '''
 
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        return set()
+
     def execute(self, subject):
         ''' 
         Executes the test.
@@ -21,6 +21,7 @@ except:
     pass
 
 from ..tests.test import test
+from ..utils import http_sessions
 
 
 class request(test):
@@ -75,6 +76,9 @@ class request(test):
 
     `return_subject_key`    When given, this subject key will receive the response.
 
+    `http_pool`      options for the connections to the host of the url, which are kept open and shared by all rules
+                     in the process. See `geoDSS.utils.http_sessions`.
+
     Rule example
     ------------
 
@@ -99,6 +103,25 @@ class request(test):
         subject = {"q": "geoDSS+github"}
     '''
 
+    def _reads(self):
+        '''
+        See `test._reads`.
+        '''
+
+        keys = set([self.definition['url'], 'request_data'])
+        if isinstance(self.definition.get('return_value'), basestring):
+            keys.add(self.definition['return_value'])
+        return keys
+
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        if 'return_subject_key' in self.definition:
+            return set([self.definition['return_subject_key']])
+        return set()
+
     def execute(self, subject):
         '''
         Executes the test.
@@ -163,17 +186,17 @@ class request(test):
 
         if self.definition["verb"] == 'GET':
             try:
-                response = requests.get(url, params=data, headers=headers, verify=verify, auth=auth)
+                response = http_sessions.get(url, params=data, headers=headers, verify=verify, auth=auth, http_pool=self.definition.get('http_pool'))
             except Exception as error:
                 return self._handle_execution_exception(subject, "Could not 'GET' url '%s' with error: %s" % (url, str(error)))
         elif self.definition["verb"] == 'POST':
             try:
-                response = requests.post(url, data=data, headers=headers, verify=verify, auth=auth)
+                response = http_sessions.post(url, data=data, headers=headers, verify=verify, auth=auth, http_pool=self.definition.get('http_pool'))
             except Exception as error:
                 return self._handle_execution_exception(subject, "Could not 'POST' on url '%s' with error: %s" % (url, str(error)))
         elif self.definition["verb"] == 'HEAD':
             try:
-                response = requests.head(url, params=data, headers=headers, verify=verify, auth=auth)
+                response = http_sessions.head(url, params=data, headers=headers, verify=verify, auth=auth, http_pool=self.definition.get('http_pool'))
             except Exception as error:
                 return self._handle_execution_exception(subject, "Could not 'HEAD' url '%s' with error: %s" % (url, str(error)))
         else:
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import copy
 from abc import ABCMeta, abstractmethod
 
 try:
@@ -81,6 +82,48 @@ class test(object):
             raise exceptions.AttributeError("Test should be executed before evaluation.")
 
 
+    def _bind(self, execution):
+        '''
+        Returns a copy of this rule, not executed yet, to keep the state of a single execution.
+
+        The copy shares the definition with this rule. So the definition should not be altered during execution.
+
+        `execution`      the execution_context the copy is part of.
+        '''
+
+        new = copy.copy(self)
+        new.decision = False
+        new.result = []
+        new.executed = False
+        new.execution = execution
+        new.rules = execution._rules
+        return new
+
+    def _reads(self):
+        '''
+        Returns a set with the subject keys this rule reads, or `None` when it may read any key.
+
+        `_reads`, `_writes` and `_rule_references` are used to find the rules which can be executed
+        at the same time when `concurrent_rules` is set in the rule set. A derived class which
+        doesn't override these is never executed at the same time as another rule.
+        '''
+
+        return None
+
+    def _writes(self):
+        '''
+        Returns a set with the subject keys this rule adds or alters, or `None` when it may alter any key.
+        '''
+
+        return None
+
+    def _rule_references(self):
+        '''
+        Returns a set with the names of the rules this rule uses via `self.rules`.
+        '''
+
+        return set()
+
     def _finish_execution(self, subject, message = None, log = False, report = False):
         '''
         Convenience function for tests.
@@ -109,7 +152,7 @@ class test(object):
             self.result.append(message)
             
         if self.definition['report'] == 'decision':
-            self.definition['report'] = bool(self.decision)
+            self.definition = dict(self.definition, report = bool(self.decision))    # the definition is shared by all executions, so don't alter it
 
         if self.definition['break_on_error'] and not self.executed:
             return False
@@ -153,6 +196,11 @@ class test(object):
 
         `subject` (dict):   a dict with test subject properties
 
+        does not alter
+        --------------
+
+        `self.definition`   as the definition is shared by all executions of the rule set
+
         sets
         ----
 
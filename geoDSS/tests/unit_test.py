@@ -34,6 +34,20 @@ class unit_test(test):
         subject = {'result': True}
     '''
 
+    def _reads(self):
+        '''
+        See `test._reads`.
+        '''
+
+        return set(['result'])
+
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        return set()
+
     def execute(self, subject):
         ''' 
         Executes the test.
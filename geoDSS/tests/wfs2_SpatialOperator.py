@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import collections
+import math
 import os
 import re
 import requests
-import shutil
-import tempfile
+import threading
+import time
 import traceback
+import uuid
 
-from osgeo import ogr, gdal
+from multiprocessing.pool import ThreadPool
+
+from osgeo import ogr, gdal, osr
 
 from owslib.fes import *
 from owslib.etree import etree
@@ -27,6 +32,83 @@ except:
     
 from ..tests.test import test
 from ..tests.test import utils
+from ..utils import geometries
+from ..utils import http_sessions
+
+_supported_spatial_operators = ["Disjoint", "DWithin", "Intersects",
+                                "Touches", "Crosses", "Within",
+                                "Contains", "Overlaps"]
+
+_client_side_operators = {'DWithin':     lambda feature, geometry, distance: feature.Distance(geometry) <= distance,
+                          'Intersects':  lambda feature, geometry, distance: feature.Intersects(geometry),
+                          'Touches':     lambda feature, geometry, distance: feature.Touches(geometry),
+                          'Crosses':     lambda feature, geometry, distance: feature.Crosses(geometry),
+                          'Within':      lambda feature, geometry, distance: feature.Within(geometry),
+                          'Contains':    lambda feature, geometry, distance: feature.Contains(geometry),
+                          'Overlaps':    lambda feature, geometry, distance: feature.Overlaps(geometry)}
+                                                                                        # Disjoint features can be outside of any envelope, so aren't cached
+
+REQUEST_THREADS = 16                                                                    # the number of threads sending requests for typenames, shared by all rules
+
+_request_pools = {}                                                                     # process id: thread pool; a pool doesn't survive forking
+_request_pools_lock = threading.Lock()
+
+_cache = collections.OrderedDict()                                                      # (url, typename, geometryname, srsName, envelope): (time fetched, fields, features)
+_cache_lock = threading.Lock()
+_cache_counters = {'hits': 0, 'misses': 0, 'bypassed': 0}
+
+
+def cache_stats():
+    '''
+    Returns a dict with statistics on the response cache of `wfs2_SpatialOperator` in this process.
+    '''
+
+    with _cache_lock:
+        stats = dict(_cache_counters)
+        stats['entries'] = len(_cache)
+        stats['features'] = sum(len(entry[2]) for entry in _cache.values())
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+    return stats
+
+
+def clear_cache():
+    '''
+    Removes all responses from the response cache of `wfs2_SpatialOperator`.
+    '''
+
+    with _cache_lock:
+        _cache.clear()
+
+
+def _request_pool():
+    '''
+    Private function; returns the thread pool of this process used to send requests for several typenames at the same time.
+    '''
+
+    with _request_pools_lock:
+        pid = os.getpid()
+        if not pid in _request_pools:
+            _request_pools[pid] = ThreadPool(REQUEST_THREADS)
+        return _request_pools[pid]
+
+
+def _snap(envelope, grid):
+    '''
+    Private function; returns the envelope made of the cells of a grid with cell size `grid` which cover `envelope`.
+    '''
+
+    minx, miny, maxx, maxy = envelope
+    return (math.floor(minx / grid) * grid, math.floor(miny / grid) * grid,
+            (math.floor(maxx / grid) + 1) * grid, (math.floor(maxy / grid) + 1) * grid)
+
+
+def _contains(outer, inner):
+    '''
+    Private function; returns whether the envelope `outer` contains the envelope `inner`.
+    '''
+
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
 
 
 class wfs2_SpatialOperator(test):
@@ -90,6 +172,30 @@ class wfs2_SpatialOperator(test):
      
      `single_request` (boolean)           Set to `true` (default) or `false`. When set to `true` al typenames will be send in a single request. 
                                           When set to `false` a separate request will be done for each typename
+     
+     `http_pool` (dict)                   options for the connections to the service, which are kept open and shared by all rules in the process.
+                                          See `geoDSS.utils.http_sessions`.
+
+     `parallel_requests` (int)            The maximum number of requests for separate typenames sent at the same time. Defaults to 4.
+                                          Set to 1 to send them one by one. The reports are in the order of the typenames either way.
+
+     `output_format` (string)             The outputFormat to ask the service for. eg. `application/json`, which is much cheaper to read than GML.
+                                          Only use a format the service supports (see its GetCapabilities). If not given the service default (GML) is used.
+
+     `cache` (dict)                       When given, the features are fetched for an envelope around the subjects geometry, snapped
+                                          to a grid, and kept in memory. The spatial operator is evaluated locally (with OGR) for later subjects
+                                          whose geometry falls in an envelope fetched before, so batches of nearby subjects need few requests.
+                                          The features are fetched in the spatial reference system of the subjects geometry, so this works
+                                          best with a projected spatial reference system. The dict can have:
+
+        - `grid` (number)                 the cell size of the grid, in the units of the spatial reference system of the subject. Defaults to 1000.
+                                          Keep it small enough for an envelope to have fewer features than the service returns at most.
+        - `ttl` (number)                  the number of seconds features are kept. Defaults to 3600.
+        - `max_entries` (int)             the maximum number of envelopes kept in a process. Defaults to 256.
+
+                                          `cache: {}` uses the defaults. The cache isn't used for the Disjoint spatial operator, for subjects
+                                          without a SRID or when `srsName` differs from the spatial reference system of the subject.
+                                          `cache_stats()` of this module returns the hits, misses and hit rate of the cache.
 
 
     Rule example
@@ -127,20 +233,21 @@ class wfs2_SpatialOperator(test):
         A private method which buffers the geometry with a distance
         '''
         
-        g = ogr.CreateGeometryFromWkt(utils.wkt._get_WKT_geometry(ewkt))
-        ng = g.Buffer(distance)
-
-        return utils.wkt._EWKT_from_WKT(utils.wkt._get_SRID_string(ewkt),ng.ExportToWkt())
+        return geometries.get(ewkt).buffer(distance).ewkt
 
-    def _getFeature(self):
+    def _getFeature(self, outputFormat = None):
         '''
         returns a xml wrapper for a getFeature request
         '''
         
+        _outputFormat = ''
+        if outputFormat:
+            _outputFormat = ' outputFormat="%s"' % outputFormat
+
         return '''<?xml version="1.0" encoding="UTF-8"?>
-                        <GetFeature xsi:schemaLocation="http://www.opengis.net/wfs http://schemas.opengis.net/wfs/2.0/wfs.xsd" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://www.opengis.net/wfs/2.0" service="WFS" version="2.0.0">
-                            %s
-                        </GetFeature>'''
+                        <GetFeature xsi:schemaLocation="http://www.opengis.net/wfs http://schemas.opengis.net/wfs/2.0/wfs.xsd" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns="http://www.opengis.net/wfs/2.0" service="WFS" version="2.0.0"%s>
+                            %%s
+                        </GetFeature>''' % _outputFormat
                         
     def _Query(self, namespace, typename, srsName = None):
         ''' 
@@ -171,8 +278,8 @@ class wfs2_SpatialOperator(test):
     def _SpatialOperator(self, spatial_operator, ewkt, geometryname, distance = None):
         ''' 
         Returns a SpatialOperator filter clause in xml.
-        
-        Does NOT support geometries of the MULTI type.
+
+        `ewkt` is the geometry as EWKT, EWKB or a `geometries.handle`.
         
         spatial_operator should be one of:
         
@@ -186,37 +293,205 @@ class wfs2_SpatialOperator(test):
         - Overlaps
         '''
         
-        _supported_spatial_operators = ["Disjoint", "DWithin", "Intersects",
-                                        "Touches", "Crosses", "Within",
-                                        "Contains", "Overlaps"]
-        if not spatial_operator in _supported_spatial_operators:
-            self._handle_execution_exception(subject, "Spatial Operator %s not supported. Choose one of %s." % (spatial_operator, str(_supported_spatial_operators) ))
-
         _distance = ""
         if distance:
             _distance = '''<fes:Distance uom="m">%s</fes:Distance>''' % distance
 
+        if not isinstance(ewkt, geometries.handle):
+            ewkt = geometries.get(ewkt)
+
         return '''<fes:%s>
                     <fes:ValueReference>%s</fes:ValueReference>
                     %s
                     %s
-                </fes:%s>''' % (spatial_operator, geometryname, self._getGMLGeom(ewkt), _distance, spatial_operator)
+                </fes:%s>''' % (spatial_operator, geometryname, ewkt.gml(), _distance, spatial_operator)
                 
+    def _BBOX(self, envelope, geometryname, srsName):
+        ''' 
+        Returns a BBOX filter clause in xml for an envelope (a (minx, miny, maxx, maxy) tuple).
+        '''
+
+        minx, miny, maxx, maxy = envelope
+        srs = osr.SpatialReference()
+        if srs.SetFromUserInput(srsName) == 0 and srs.EPSGTreatsAsLatLong():
+            minx, miny, maxx, maxy = miny, minx, maxy, maxx                             # urn:ogc:def:crs:EPSG:: names use the axis order of EPSG
+
+        return '''<fes:BBOX>
+                    <fes:ValueReference>%s</fes:ValueReference>
+                    <gml:Envelope srsName="%s">
+                        <gml:lowerCorner>%r %r</gml:lowerCorner>
+                        <gml:upperCorner>%r %r</gml:upperCorner>
+                    </gml:Envelope>
+                </fes:BBOX>''' % (geometryname, srsName, minx, miny, maxx, maxy)
+
+    def _post(self, payload, headers):
+        '''
+        Private method; posts a GetFeature request and returns the fields and features in the response (see `_read_features`).
+
+        Raises an IOError when the service doesn't return features.
+        '''
+
+        self.logger.debug("Sending WFS-query to: " + self.definition['url'])
+        self.logger.debug(payload)
+        r = http_sessions.post(self.definition['url'], data=payload, headers=headers, http_pool=self.definition.get('http_pool'))
+        if r.status_code != requests.codes.ok:
+            raise exceptions.IOError('WFS returned statuscode: ' + str(r.status_code))
+        if "<Exception" in r.content or ":Exception" in r.content:
+            self.logger.debug("Found Exception in WFS response:" + r.content)
+            raise exceptions.IOError('Failed WFS request with error: ' + r.content)
+        return self._read_features(r.content)
+
+    def _read_features(self, content):
+        '''
+        Private method; reads a GetFeature response (GML or GeoJSON) and returns a list with the names of the fields and
+        a list with a (geometry, list of values of the fields) tuple for each feature.
+
+        The response is read from memory (a GDAL /vsimem/ file with a name of its own), so nothing is written to disk
+        and concurrent executions don't share a file.
+        '''
+
+        extension = '.gml'
+        if content.lstrip()[:1] in ('{', b'{'):
+            extension = '.json'
+        mem_file = '/vsimem/geodss_wfs_%s%s' % (uuid.uuid4().hex, extension)
+        gdal.FileFromMemBuffer(mem_file, content)
+        try:
+            dataSource = ogr.Open(mem_file)
+            if dataSource is None:
+                raise exceptions.IOError('Failed reading WFS request for an unknown reason')
+
+            cols = []
+            features = []
+            layer = dataSource.GetLayer()
+            if layer:
+                layerDefinition = layer.GetLayerDefn()
+                for i in range(layerDefinition.GetFieldCount()):
+                    cols.append(layerDefinition.GetFieldDefn(i).GetName())
+
+                for feature in layer:
+                    geometry = feature.GetGeometryRef()
+                    if geometry is not None:
+                        geometry = geometry.Clone()                                     # the feature and its geometry are gone after the next one
+                    features.append((geometry, [feature.GetField(i) for i in range(len(cols))]))
+            dataSource = None
+            return cols, features
+        finally:
+            gdal.Unlink(mem_file)
+            for sidecar in ('.gfs', '.xsd'):                                            # the GML driver may write these next to the response
+                if gdal.VSIStatL(mem_file[:-len(extension)] + sidecar) is not None:
+                    gdal.Unlink(mem_file[:-len(extension)] + sidecar)
+
+    def _cached_features(self, namespace, type_name, srsName, envelope, headers):
+        '''
+        Private method; returns the fields and the features of `type_name` in an envelope containing `envelope`,
+        from the cache or else fetched for the grid cells covering `envelope`.
+        '''
+
+        options = self.definition['cache'] if isinstance(self.definition['cache'], dict) else {}
+        grid = float(options.get('grid', 1000))
+        ttl = options.get('ttl', 3600)
+        max_entries = options.get('max_entries', 256)
+
+        service = (self.definition['url'], type_name, self.definition['geometryname'], srsName)
+        now = time.time()
+        with _cache_lock:
+            for key in list(_cache):
+                fetched, cols, features = _cache[key]
+                if now - fetched > ttl:
+                    del _cache[key]
+                elif key[:4] == service and _contains(key[4], envelope):
+                    _cache[key] = _cache.pop(key)                                       # re-insert to mark as most recently used
+                    _cache_counters['hits'] = _cache_counters['hits'] + 1
+                    return cols, features
+            _cache_counters['misses'] = _cache_counters['misses'] + 1
+
+        cell_envelope = _snap(envelope, grid)
+        _filter = self._Filter() % self._BBOX(cell_envelope, self.definition['geometryname'], srsName)
+        payload = self._getFeature(self.definition.get('output_format')) % (self._Query(namespace, type_name, srsName) % _filter)
+        cols, features = self._post(payload, headers)                                  # fetch outside the lock; a slow service shouldn't block other rules
+
+        with _cache_lock:
+            _cache[service + (cell_envelope,)] = (now, cols, features)
+            while len(_cache) > max_entries:
+                _cache.popitem(last = False)
+        return cols, features
+
+    def _fetch(self, fetch, type_name):
+        '''
+        Private method; returns an (error, (fields, features)) tuple for a typename, where error is `None` if `fetch` succeeded.
+        '''
+
+        try:
+            return None, fetch(type_name)
+        except Exception as error:
+            self.logger.debug(traceback.format_exc())
+            return error, None
+
+    def _fetch_all(self, fetch, type_names):
+        '''
+        Private generator; yields the outcome of `_fetch` for each typename, in the order of `type_names`.
+
+        When there is more than one typename, at most `parallel_requests` of them are fetched at the same time.
+        Otherwise the typenames are fetched one by one, and no more requests are sent after an error.
+        '''
+
+        parallel_requests = int(self.definition.get('parallel_requests', 4))
+        if parallel_requests < 2 or len(type_names) < 2:
+            for type_name in type_names:
+                yield self._fetch(fetch, type_name)
+            return
+
+        outcomes = [None] * len(type_names)
+        indexes = iter(range(len(type_names)))
+        lock = threading.Lock()
+        def worker():
+            while True:
+                with lock:
+                    index = next(indexes, None)
+                if index is None:
+                    return
+                outcomes[index] = self._fetch(fetch, type_names[index])
+
+        workers = [_request_pool().apply_async(worker) for i in range(min(parallel_requests, len(type_names)))]
+        for result in workers:
+            result.get()
+        for outcome in outcomes:
+            yield outcome
+
+    def _reads(self):
+        '''
+        See `test._reads`.
+        '''
+
+        return set(['geometry'])
+
+    def _writes(self):
+        '''
+        See `test._writes`.
+        '''
+
+        return set()
 
-                
     def execute(self, subject):
         ''' 
         Executes the test.
 
         `subject`       is expected a dict containing at least:
         
-        - `geometry`    the geometry of the subject in EWKT. eg. `"SRID=28992;POINT(138034.181 452694.342)"`.
-                        the MULTI variant of geometry types is not supported.
+        - `geometry`    the geometry of the subject in EWKT. eg. `"SRID=28992;POINT(138034.181 452694.342)"`,
+                        or EWKB (see `geoDSS.utils.wkb`).
                      
         '''
 
         gdal.UseExceptions()
 
+        if not 'geometry' in subject:
+            return self._handle_execution_exception(subject, 'Could not find key "geometry" in subject.')
+
+        _spatial_operator = self.definition['spatial_operator']
+        if not _spatial_operator in _supported_spatial_operators:
+            return self._handle_execution_exception(subject, "Spatial Operator %s not supported. Choose one of %s." % (_spatial_operator, str(_supported_spatial_operators) ))
+
         _distance = None
         if 'distance' in self.definition:
             _distance = self.definition['distance']
@@ -229,10 +504,13 @@ class wfs2_SpatialOperator(test):
         if 'headers' in self.definition:
             _headers = self.definition['headers']
         
-        _geometry = subject['geometry']
-        if 'buffer' in self.definition:
-            _geometry = self._buffer(subject['geometry'], self.definition['buffer'])
-        #self.logger.debug('using geometry: ' + _geometry)
+        try:
+            _geometry = geometries.get(subject['geometry'])
+            if 'buffer' in self.definition:
+                _geometry = _geometry.buffer(self.definition['buffer'])                 # made once for each subject geometry
+            _srid = _geometry.srid
+        except Exception as error:
+            return self._handle_execution_exception( subject, 'Could not read geometry with error: ' + str(error) )
         
         _single_request = True
         if 'single_request' in self.definition:
@@ -241,56 +519,52 @@ class wfs2_SpatialOperator(test):
         _type_names = self.definition['typenames']
         if _single_request:
             _type_names = [",".join(self.definition['typenames'])]
-        
-        tmp_folder = tempfile.mkdtemp()
-        for _type_name in _type_names:
-            _operator = self._SpatialOperator(self.definition['spatial_operator'], _geometry, self.definition['geometryname'], _distance)
-            _filter = self._Filter() % _operator
-            _query = self._Query(self.definition['namespace'], _type_name, _srsName) % _filter
-            payload = self._getFeature() % _query
 
-            self.logger.debug("Sending WFS-query to: " + self.definition['url'])
-            self.logger.debug(payload)
+        _cache_srsName = None
+        if 'cache' in self.definition and _spatial_operator in _client_side_operators and _srid is not None:
+            _cache_srsName = "urn:ogc:def:crs:EPSG::%s" % _srid
+            if _srsName and _srsName != _cache_srsName:
+                _cache_srsName = None                                                   # the features would not be comparable with the subject
+        if _cache_srsName:
             try:
-                r = requests.post(url = self.definition['url'], data=payload, headers=_headers)
+                _query_geometry = _geometry.ogr(copy = False)                           # only read by the spatial operators
+                minx, miny, maxx, maxy = _geometry.bbox()
             except Exception as error:
-                self.logger.debug(traceback.format_exc())
+                return self._handle_execution_exception( subject, 'Could not read geometry %s with error: %s' % (subject['geometry'], str(error)) )
+            _margin = float(_distance or 0)
+            _envelope = (minx - _margin, miny - _margin, maxx + _margin, maxy + _margin)
+            _matches = _client_side_operators[_spatial_operator]
+        elif 'cache' in self.definition:
+            with _cache_lock:
+                _cache_counters['bypassed'] = _cache_counters['bypassed'] + 1
+
+        def fetch(_type_name):
+            if _cache_srsName:
+                cols, features = self._cached_features(self.definition['namespace'], _type_name, _cache_srsName, _envelope, _headers)
+                return cols, [feature for feature in features 
+                              if feature[0] is not None and _matches(feature[0], _query_geometry, float(_distance or 0))]
+            _operator = self._SpatialOperator(_spatial_operator, _geometry, self.definition['geometryname'], _distance)
+            _filter = self._Filter() % _operator
+            _query = self._Query(self.definition['namespace'], _type_name, _srsName) % _filter
+            payload = self._getFeature(self.definition.get('output_format')) % _query
+            return self._post(payload, _headers)
+
+        self.decision = False
+        for error, outcome in self._fetch_all(fetch, _type_names):
+            if isinstance(error, IOError):
+                return self._handle_execution_exception( subject, str(error) )
+            if error is not None:
                 return self._handle_execution_exception( subject, 'Failed WFS request with error: ' + str(error) )
-                
-            if r.status_code == requests.codes.ok:
-                if "<Exception" in r.content or ":Exception" in r.content:
-                    self.logger.debug("Found Exception in WFS response:" + r.content)
-                    return self._handle_execution_exception( subject, 'Failed WFS request with error: ' + r.content )
-                gml_file = os.path.join(tmp_folder,"response.gml")
-                with open(gml_file, 'wb') as f:
-                    f.write(r.content)
-
-                dataSource = ogr.Open(gml_file)
-                if dataSource is None:
-                    return self._handle_execution_exception( subject, 'Failed reading WFS request for an unknown reason')
-                else:
-                    self.decision = False
-                    layer = dataSource.GetLayer()
-                    if layer:
-                        layerDefinition = layer.GetLayerDefn()
-                                        
-                        cols = []
-                        for i in range(layerDefinition.GetFieldCount()):
-                            cols.append(layerDefinition.GetFieldDefn(i).GetName())
-
-                        for feature in layer:
-                            to_report = self.definition['report_template']
-                            self.decision = True
-                            for col in cols:
-                                if "{%s}" % col in to_report:
-                                    to_report = to_report.replace("{%s}" % col, str(feature.GetField(col)))
-                            if not to_report in self.result:
-                                self.result.append(to_report)
-                        
-            else:
-                return self._handle_execution_exception( subject, 'WFS returned statuscode: ' + str(r.status_code) )
-                
-        shutil.rmtree(tmp_folder)
+            cols, features = outcome
+
+            for geometry, values in features:
+                to_report = self.definition['report_template']
+                self.decision = True
+                for i, col in enumerate(cols):
+                    if "{%s}" % col in to_report:
+                        to_report = to_report.replace("{%s}" % col, str(values[i]))
+                if not to_report in self.result:
+                    self.result.append(to_report)
 
         self.executed = True                                                            # don't forget to set self.executed to True, 
                                                                                         # otherwise "Error: test is not executed:" will be added to the report as well
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+'''
+Helpers shared by the tests, processors and other modules of geoDSS, eg. resources which are kept
+for the life time of a process like database connections.
+'''
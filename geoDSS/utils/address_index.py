@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+'''
+The address_index module builds and reads a compact index of addresses, to geocode a postcode and
+house number without a web service (see `processors.local_geocoder`).
+
+The index is a single file with fixed size records sorted on postcode, house number and addition,
+followed by the address descriptions. It is read via a memory map: a lookup is a binary search
+in the file, nothing is loaded in memory up front, and the pages read are shared by all processes
+on a host (eg. prefork wsgi workers).
+
+The index is built once from an export of the BAG (Basisregistratie Adressen en Gebouwen), eg. a CSV
+file as made by NLExtract, or any file OGR can read (eg. a GeoPackage) having these fields:
+
+- `openbareruimte`          the street
+- `huisnummer`              the house number
+- `huisletter`              the house letter (optional)
+- `huisnummertoevoeging`    the house number addition (optional)
+- `postcode`                the postcode
+- `woonplaats`              the place
+- `x`, `y`                  the coordinates (for OGR files the geometry is used if these fields are absent)
+
+Other field names can be mapped with `fields`.
+
+Example
+-------
+
+    python -m geoDSS.utils.address_index bagadres.csv /data/bag.idx
+
+or:
+
+    from geoDSS.utils import address_index
+
+    address_index.build_index('bagadres.csv', '/data/bag.idx')
+    index = address_index.get_index('/data/bag.idx')
+    index.lookup('4171KG', 74)                                          # (x, y, 'Dorpsstraat 74, 4171KG Herwijnen')
+'''
+
+import argparse
+import bisect
+import csv
+import io
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+
+try:
+    from osgeo import ogr
+except:
+    pass
+
+MAGIC = b'GEODSSAI'
+VERSION = 1
+
+_header = struct.Struct('>8sIII')                                       # magic, version, srid, number of records
+_record = struct.Struct('>6sI6sddIH')                                   # postcode, huisnummer, toevoeging, x, y, offset and length of the address
+_KEY_SIZE = 16                                                          # postcode, huisnummer and toevoeging; compared as bytes
+_PREFIX_SIZE = 10                                                       # postcode and huisnummer
+_SPARSE_STEP = 64                                                       # the key of every so many records is kept in memory
+
+_default_fields = {'openbareruimte': 'openbareruimte',
+                   'huisnummer': 'huisnummer',
+                   'huisletter': 'huisletter',
+                   'huisnummertoevoeging': 'huisnummertoevoeging',
+                   'postcode': 'postcode',
+                   'woonplaats': 'woonplaats',
+                   'x': 'x',
+                   'y': 'y'}
+
+
+def _text(value):
+    '''
+    Private function; returns a value as a unicode string.
+    '''
+
+    if value is None:
+        return u''
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if not isinstance(value, type(u'')):
+        return type(u'')(value)
+    return value
+
+
+def _postcode(postcode):
+    '''
+    Private function; returns a postcode as 6 bytes, eg. `b'4171KG'` for `'4171 kg'`, or `None` if it isn't a postcode.
+    '''
+
+    postcode = re.sub(r'\s+', '', _text(postcode)).upper()
+    if len(postcode) != 6:
+        return None
+    return postcode.encode('ascii', 'replace')
+
+
+def _toevoeging(*parts):
+    '''
+    Private function; returns the house letter and addition as 6 bytes, eg. `b'A2\\0\\0\\0\\0'` for `('a', '-2')`.
+    '''
+
+    toevoeging = re.sub(r'[^0-9A-Z]', '', u''.join(_text(part) for part in parts).upper())
+    return toevoeging.encode('ascii', 'replace')[:6].ljust(6, b'\0')
+
+
+def _key(postcode, huisnummer, toevoeging = None):
+    '''
+    Private function; returns the key of an address in the index, or `None` if it isn't a proper address.
+    '''
+
+    postcode = _postcode(postcode)
+    try:
+        huisnummer = int(_text(huisnummer).strip())
+    except ValueError:
+        return None
+    if postcode is None or huisnummer < 0:
+        return None
+    return postcode + struct.pack('>I', huisnummer) + _toevoeging(toevoeging)
+
+
+def _address(row, fields):
+    '''
+    Private function; returns a description of an address, eg. `Dorpsstraat 74A-2, 4171KG Herwijnen`.
+    '''
+
+    number = _text(row.get(fields['huisnummer'])).strip() + _text(row.get(fields['huisletter'])).strip()
+    toevoeging = _text(row.get(fields['huisnummertoevoeging'])).strip()
+    if toevoeging:
+        number = number + u'-' + toevoeging
+    street = (_text(row.get(fields['openbareruimte'])).strip() + u' ' + number).strip()
+    place = (re.sub(r'\s+', '', _text(row.get(fields['postcode']))).upper() + u' ' + _text(row.get(fields['woonplaats'])).strip()).strip()
+    return u', '.join(part for part in [street, place] if part)
+
+
+def _csv_rows(source, delimiter):
+    '''
+    Private generator; yields the rows of a CSV file as dicts.
+    '''
+
+    if sys.version_info[0] < 3:
+        with open(source, 'rb') as stream:
+            for row in csv.DictReader(stream, delimiter = delimiter):
+                yield dict((key, value.decode('utf-8') if value is not None else None) for key, value in row.items())
+    else:
+        with io.open(source, 'r', encoding = 'utf-8-sig', newline = '') as stream:
+            for row in csv.DictReader(stream, delimiter = delimiter):
+                yield row
+
+
+def _ogr_rows(source, fields):
+    '''
+    Private generator; yields the features of the first layer of a file OGR can read as dicts,
+    with the coordinates of the (centroid of the) geometry when the file has no coordinate fields.
+    '''
+
+    data_source = ogr.Open(source)
+    if data_source is None:
+        raise IOError('Could not open %s.' % source)
+    layer = data_source.GetLayer()
+    for feature in layer:
+        row = feature.items()
+        geometry = feature.GetGeometryRef()
+        if row.get(fields['x']) is None and geometry is not None:
+            point = geometry if geometry.GetGeometryName() == 'POINT' else geometry.Centroid()
+            row[fields['x']] = point.GetX()
+            row[fields['y']] = point.GetY()
+        yield row
+
+
+def build_index(source, target, srid = 28992, fields = None, delimiter = ';'):
+    '''
+    Builds an index file `target` from the addresses in `source`, and returns the number of addresses in the index.
+
+    `source` (string):      a CSV file (`.csv`) or a file OGR can read.
+
+    `srid` (int):           the SRID of the coordinates. Defaults to 28992.
+
+    `fields` (dict):        the names of the fields in `source`, by the names in the module documentation.
+
+    `delimiter` (string):   the delimiter of a CSV file. Defaults to `;`.
+
+    Addresses without a proper postcode, house number or coordinates are skipped.
+    '''
+
+    names = dict(_default_fields)
+    names.update(fields or {})
+    if source.lower().endswith('.csv'):
+        rows = _csv_rows(source, delimiter)
+    else:
+        rows = _ogr_rows(source, names)
+
+    records = []
+    for row in rows:
+        key = _key(row.get(names['postcode']), row.get(names['huisnummer']),
+                   _text(row.get(names['huisletter'])) + _text(row.get(names['huisnummertoevoeging'])))
+        try:
+            x = float(row.get(names['x']))
+            y = float(row.get(names['y']))
+        except (TypeError, ValueError):
+            continue
+        if key is None:
+            continue
+        records.append((key, x, y, _address(row, names).encode('utf-8')))
+    records.sort(key = lambda record: record[0])                        # stable, so of two records with the same key the first one in source is found
+
+    temporary = target + '.tmp'
+    with open(temporary, 'wb') as stream:
+        stream.write(_header.pack(MAGIC, VERSION, srid, len(records)))
+        offset = 0
+        for key, x, y, address in records:
+            address = address[:65535]
+            stream.write(_record.pack(key[:6], struct.unpack('>I', key[6:10])[0], key[10:], x, y, offset, len(address)))
+            offset = offset + len(address)
+        for key, x, y, address in records:
+            stream.write(address[:65535])
+    if os.name == 'nt' and os.path.exists(target):
+        os.remove(target)                                               # rename doesn't replace a file on Windows
+    os.rename(temporary, target)                                        # processes opening the index never see a partly written file
+    return len(records)
+
+
+class _keys(object):
+    '''
+    Private class; the keys of the records in an index as a sequence, to search with `bisect`.
+    '''
+
+    def __init__(self, index, size):
+        self._map = index._map
+        self._size = size
+        self._count = index.count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        start = _header.size + i * _record.size
+        return self._map[start:start + self._size]
+
+
+class address_index(object):
+    '''
+    An index file built with `build_index`, read via a memory map.
+
+    `file` (string):        the index file.
+    '''
+
+    def __init__(self, file):
+        self.file = file
+        with open(file, 'rb') as stream:
+            self._map = mmap.mmap(stream.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, self.srid, self.count = _header.unpack(self._map[:_header.size])
+        if magic != MAGIC or version != VERSION:
+            raise IOError('%s is not an address index of version %s.' % (file, VERSION))
+        self._strings = _header.size + self.count * _record.size
+        self._keys = _keys(self, _KEY_SIZE)
+        self._prefixes = _keys(self, _PREFIX_SIZE)
+        self._sparse = [self._keys[i] for i in range(0, self.count, _SPARSE_STEP)]  # narrows the search in the file to a block of records
+
+    def __len__(self):
+        return self.count
+
+    def _read(self, i):
+        '''
+        Private method; returns the (x, y, address) of the record at position `i`.
+        '''
+
+        start = _header.size + i * _record.size
+        postcode, huisnummer, toevoeging, x, y, offset, length = _record.unpack(self._map[start:start + _record.size])
+        start = self._strings + offset
+        return x, y, self._map[start:start + length].decode('utf-8')
+
+    def lookup(self, postcode, huisnummer, toevoeging = None):
+        '''
+        Returns the (x, y, address) of an address, or `None` if the address is not in the index.
+
+        Without `toevoeging` the first address with the postcode and house number is returned, which is
+        the one without a house letter or addition if it exists.
+        '''
+
+        key = _key(postcode, huisnummer, toevoeging)
+        if key is None:
+            return None
+        if toevoeging:
+            keys, key = self._keys, key
+        else:
+            keys, key = self._prefixes, key[:_PREFIX_SIZE]
+        block = bisect.bisect_left(self._sparse, key)                   # the first record of the block is at or after the key
+        lo = max(block - 1, 0) * _SPARSE_STEP
+        hi = min(block * _SPARSE_STEP + 1, self.count)
+        i = bisect.bisect_left(keys, key, lo, hi)
+        if i < self.count and keys[i] == key:
+            return self._read(i)
+        return None
+
+    def close(self):
+        '''
+        Closes the memory map of the index.
+        '''
+
+        self._map.close()
+
+
+_indexes = {}                                                           # (file, modification time): address_index
+_indexes_lock = threading.Lock()
+
+
+def get_index(file):
+    '''
+    Returns the index of the file `file`, opened once in a process. The index is opened again when the file is replaced.
+    '''
+
+    path = os.path.abspath(file)
+    key = (path, os.path.getmtime(path))
+    with _indexes_lock:
+        if not key in _indexes:
+            for old_key in [old_key for old_key in _indexes if old_key[0] == path]:
+                del _indexes[old_key]                                   # an outdated version of the same file; closed when no longer used
+            _indexes[key] = address_index(path)
+        return _indexes[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Builds an address index for processors.local_geocoder from a BAG export.')
+    parser.add_argument('source', help = 'a CSV file or a file OGR can read, eg. a GeoPackage')
+    parser.add_argument('target', help = 'the index file to write')
+    parser.add_argument('--srid', type = int, default = 28992, help = 'the SRID of the coordinates (default 28992)')
+    parser.add_argument('--delimiter', default = ';', help = 'the delimiter of a CSV file (default ;)')
+    args = parser.parse_args()
+    print('%s addresses written to %s' % (build_index(args.source, args.target, args.srid, delimiter = args.delimiter), args.target))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+'''
+The expressions module compiles the python expressions of rules (eg. `tests.evaluate` and `processors.alter_key`)
+once, instead of parsing them again for each subject.
+
+An expression is evaluated in a namespace with the names given by the rule (eg. `subject` and `rules`) and a
+restricted set of builtins: the functions to compute and convert values (`len`, `int`, `sorted`, ...) but not
+those to import modules, open files or compile code. This keeps mistakes in rule sets from doing harm; it is
+not a sandbox, so rule sets should still come from a trusted source.
+
+Example
+-------
+
+    from geoDSS.utils import expressions
+
+    code = expressions.compile_expression("len(subject['name']) > 3", 'my_rule')   # raises a SyntaxError when invalid
+    namespace = expressions.namespace(math = math)
+    expressions.evaluate(code, namespace, subject = {'name': 'geoDSS'})            # True
+'''
+
+import collections
+import threading
+
+try:
+    # python2
+    import __builtin__ as builtins
+except ImportError:
+    # python3
+    import builtins
+
+SAFE_BUILTINS = ['abs', 'all', 'any', 'basestring', 'bool', 'bytes', 'chr', 'dict', 'divmod', 'enumerate', 'filter',
+                 'float', 'format', 'frozenset', 'getattr', 'hasattr', 'hash', 'int', 'isinstance', 'iter', 'len', 'list',
+                 'long', 'map', 'max', 'min', 'next', 'ord', 'pow', 'range', 'repr', 'reversed', 'round', 'set', 'slice',
+                 'sorted', 'str', 'sum', 'tuple', 'unichr', 'unicode', 'xrange', 'zip', 'True', 'False', 'None',
+                 'Exception', 'KeyError', 'TypeError', 'ValueError']
+
+_builtins = dict((name, getattr(builtins, name)) for name in SAFE_BUILTINS if hasattr(builtins, name))
+
+MAX_ENTRIES = 256
+
+_codes = collections.OrderedDict()                                      # expression: code; the last one is the most recently used
+_codes_lock = threading.Lock()
+
+
+def compile_expression(expression, name = 'expression'):
+    '''
+    Returns the code of a python expression, compiled once in a process.
+
+    `name` (string):    the name of the rule, shown in the SyntaxError raised when the expression is invalid.
+    '''
+
+    with _codes_lock:
+        code = _codes.pop(expression, None)
+        if code is not None:
+            _codes[expression] = code                                   # re-insert to mark as most recently used
+            return code
+    code = compile(expression.strip(), '<%s>' % name, 'eval')
+    with _codes_lock:
+        _codes[expression] = code
+        while len(_codes) > MAX_ENTRIES:
+            _codes.popitem(last = False)
+    return code
+
+
+def namespace(**names):
+    '''
+    Returns a namespace to evaluate expressions in, with the restricted builtins and `names`.
+    '''
+
+    result = dict(names)
+    result['__builtins__'] = _builtins
+    return result
+
+
+def evaluate(code, namespace, **names):
+    '''
+    Evaluates compiled code in a copy of `namespace` extended with `names`, and returns its value.
+
+    The names are put in the globals of the expression, so they can be used in comprehensions and lambdas as well.
+    '''
+
+    scope = dict(namespace)
+    scope.update(names)
+    return eval(code, scope)
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+'''
+The geometries module keeps the geometry of a subject parsed, so the rules of a rule set don't parse
+the same EWKT string again and again.
+
+A `handle` holds a geometry with everything derived from it: the geometry read by `wkt.parse`, an ogr
+geometry, the bounding box and the buffers made of it. Each of these is made on first use. A handle made
+from an ogr geometry (eg. the result of `processors.ogr_processing`) is serialized to EWKT only when
+its text is asked for.
+
+The subject keeps its geometry as an EWKT string, as that is what reports, templates and databases use,
+or as EWKB (see `wkb`), which is read without parsing text. `get` returns the handle for the geometry of
+a subject from a least recently used cache of this process, so each rule executed on the subject, and
+each execution on the same geometry, uses the same handle.
+
+Example
+-------
+
+    from geoDSS.utils import geometries
+
+    handle = geometries.get('SRID=28992;POINT(138034.181 452694.342)')
+    handle.bbox()                                                       # (138034.181, 452694.342, 138034.181, 452694.342)
+    handle.buffer(100).ewkt                                             # 'SRID=28992;POLYGON ((138134.181 452694.342,...'
+    handle.ogr().Area()                                                 # a copy to alter at will
+    print(geometries.stats())
+'''
+
+import collections
+import threading
+
+from . import wkb
+from . import wkt
+
+try:
+    from osgeo import ogr
+except:
+    pass
+
+MAX_ENTRIES = 1024
+
+
+class handle(object):
+    '''
+    A geometry parsed once. Pass either an EWKT (or WKT) string, EWKB bytes, or an ogr geometry with its SRID.
+
+    `ewkt` (string):            the geometry as EWKT.
+
+    `ewkb` (bytes):             the geometry as EWKB.
+
+    `ogr_geometry`:             the geometry as an ogr geometry. The handle owns it; don't alter it afterwards.
+
+    `srid` (int):               the SRID of an ogr geometry.
+    '''
+
+    def __init__(self, ewkt = None, ogr_geometry = None, srid = None, ewkb = None):
+        if ewkt is None and ogr_geometry is None and ewkb is None:
+            raise ValueError('A geometry handle needs an EWKT string, EWKB or an ogr geometry.')
+        self._ewkt = ewkt
+        self._ewkb = ewkb
+        self._ogr = ogr_geometry
+        self._srid = srid
+        self._parsed = None
+        self._bbox = None
+        self._buffers = {}                                              # distance: handle
+        self._lock = threading.Lock()                                   # a handle is shared by the threads of a process
+
+    def __repr__(self):
+        return '<geometry handle %s>' % (self.srid,)
+
+    @property
+    def ewkt(self):
+        '''
+        The geometry as an EWKT string (WKT when there is no SRID).
+        '''
+
+        if self._ewkt is None and self._ewkb is not None:
+            self._ewkt = wkt.dumps(self.parsed)
+        elif self._ewkt is None:
+            text = self._ogr.ExportToWkt()
+            self._ewkt = wkt._EWKT_from_WKT('SRID=%s' % self._srid, text) if self._srid is not None else text
+        return self._ewkt
+
+    @property
+    def srid(self):
+        '''
+        The SRID of the geometry, or `None` if it has none.
+        '''
+
+        if self._srid is None and self._ewkb is not None:
+            self._srid = wkb.srid(self._ewkb)
+        elif self._srid is None and self._ewkt is not None and self._ewkt.lstrip().upper().startswith('SRID='):
+            self._srid = int(self._ewkt.split(';', 1)[0].split('=', 1)[1])
+        return self._srid
+
+    @property
+    def ewkb(self):
+        '''
+        The geometry as EWKB bytes, or `None` for a handle not made from EWKB.
+        '''
+
+        return self._ewkb
+
+    @property
+    def parsed(self):
+        '''
+        The geometry as read by `wkt.parse` (or `wkb.parse`).
+        '''
+
+        if self._parsed is None and self._ewkb is not None:
+            self._parsed = wkb.parse(self._ewkb)
+        elif self._parsed is None and self._ewkt is not None:
+            self._parsed = wkt.parse(self._ewkt)
+        elif self._parsed is None:
+            self._parsed = wkb.parse(self._ogr.ExportToWkb(), self._srid)    # no text involved
+        return self._parsed
+
+    def _ogr_geometry(self):
+        '''
+        Private method; returns the ogr geometry of this handle, made on first use.
+        '''
+
+        with self._lock:
+            if self._ogr is None and self._ewkb is not None:
+                geometry = ogr.CreateGeometryFromWkb(wkb.to_wkb(self._ewkb))
+                if geometry is None:
+                    raise ValueError('Could not read EWKB geometry.')
+                self._ogr = geometry
+            elif self._ogr is None:
+                text = self._ewkt.split(';', 1)[1] if self._ewkt.lstrip().upper().startswith('SRID=') else self._ewkt
+                geometry = ogr.CreateGeometryFromWkt(text.strip())
+                if geometry is None:
+                    raise ValueError('Could not read geometry %s.' % self._ewkt[:50])
+                self._ogr = geometry
+            return self._ogr
+
+    def ogr(self, copy = True):
+        '''
+        Returns the geometry as an ogr geometry.
+
+        A copy is returned, which can be altered (eg. transformed). With `copy` set to `False` the geometry of the
+        handle itself is returned; only use it for methods which don't alter it, like `Intersects` or `Distance`.
+        '''
+
+        geometry = self._ogr_geometry()
+        return geometry.Clone() if copy else geometry
+
+    def bbox(self):
+        '''
+        Returns the bounding box (minx, miny, maxx, maxy) of the geometry.
+
+        Raises a ValueError for an empty geometry.
+        '''
+
+        if self._bbox is None:
+            if self._ewkt is not None or self._ewkb is not None:
+                bbox = self.parsed.bbox()
+            else:
+                minx, maxx, miny, maxy = self._ogr.GetEnvelope()
+                bbox = (minx, miny, maxx, maxy)
+            if bbox is None:
+                raise ValueError('Can not get the bounding box of an empty geometry: %s' % self.ewkt[:50])
+            self._bbox = bbox
+        return self._bbox
+
+    def gml(self, gml_id = 'P1'):
+        '''
+        Returns the geometry as a gml 3.2 element, eg. for WFS filters.
+        '''
+
+        srsName = "urn:ogc:def:crs:EPSG::%s" % self.srid if self.srid is not None else None
+        return wkt._gml(self.parsed, gml_id, srsName)
+
+    def buffer(self, distance):
+        '''
+        Returns a handle for the buffer of the geometry with `distance`, made once for each distance.
+        '''
+
+        distance = float(distance)
+        buffered = self._buffers.get(distance)
+        if buffered is None:
+            buffered = handle(ogr_geometry = self._ogr_geometry().Buffer(distance), srid = self.srid)
+            with self._lock:
+                buffered = self._buffers.setdefault(distance, buffered)
+        return buffered
+
+
+_handles = collections.OrderedDict()                                    # ewkt: handle; the last one is the most recently used
+_handles_lock = threading.Lock()
+_counters = {'hits': 0, 'misses': 0}
+
+
+def get(ewkt):
+    '''
+    Returns the handle for the EWKT string `ewkt`, from the cache when the string was used before.
+
+    `ewkt` can be EWKB as well: bytes, or a hex or base64 string (see `wkb.is_ewkb`).
+    '''
+
+    if isinstance(ewkt, (bytearray, memoryview)):
+        ewkt = bytes(ewkt)                                              # a key of the cache should be hashable
+
+    with _handles_lock:
+        found = _handles.pop(ewkt, None)
+        if found is not None:
+            _handles[ewkt] = found                                      # re-insert to mark as most recently used
+            _counters['hits'] = _counters['hits'] + 1
+            return found
+        _counters['misses'] = _counters['misses'] + 1
+    if wkb.is_ewkb(ewkt):
+        found = handle(ewkb = wkb.decode(ewkt))
+        remember(found, ewkt)
+    else:
+        found = remember(handle(ewkt))
+    return found
+
+
+def from_ogr(ogr_geometry, srid):
+    '''
+    Returns a handle for an ogr geometry with the SRID `srid`, and keeps it in the cache under its EWKT string.
+    The handle owns the geometry; don't alter it afterwards.
+    '''
+
+    return remember(handle(ogr_geometry = ogr_geometry, srid = srid))
+
+
+def remember(found, key = None):
+    '''
+    Keeps the handle `found` in the cache under `key`, or else its EWKT string, and returns it.
+    '''
+
+    if key is None:
+        key = found.ewkt
+    with _handles_lock:
+        _handles.pop(key, None)
+        _handles[key] = found
+        while len(_handles) > MAX_ENTRIES:
+            _handles.popitem(last = False)
+    return found
+
+
+def clear():
+    '''
+    Removes all handles from the cache.
+    '''
+
+    with _handles_lock:
+        _handles.clear()
+
+
+def stats():
+    '''
+    Returns a dict with statistics on the cache of handles of this process.
+    '''
+
+    with _handles_lock:
+        stats = dict(_counters)
+        stats['entries'] = len(_handles)
+        stats['max_entries'] = MAX_ENTRIES
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+'''
+The http_sessions module keeps a `requests.Session` for each host, so rules re-use connections (and
+TLS sessions) instead of setting up a new connection for each request.
+
+A session is kept for each scheme and host (eg. `https://api.pdok.nl`), and is shared by all rules and
+rule sets in the process. Sessions are not shared with forked processes.
+
+Rules can tune the session of a host with a `http_pool` dict in their definition (or in the `settings`
+of the rule set). The first rule using a host creates its session with these options:
+
+- `pool_size` (int)                 The maximum number of connections kept open to the host. Defaults to 10.
+- `timeout` (number)                The default number of seconds to wait for the host to connect or respond.
+                                    Defaults to `None`: wait forever, like `requests` does.
+- `max_retries` (int)               The number of times a failed connection is retried. Defaults to 0.
+
+Options for a host can be set before it is used with `configure`, eg. in a wsgi application or batch script.
+
+Example
+-------
+
+    from geoDSS.utils import http_sessions
+
+    http_sessions.configure('https://api.pdok.nl', pool_size = 20, timeout = 10)
+    response = http_sessions.get('https://api.pdok.nl/bzk/locatieserver/search/v3_1/free?q=utrecht')
+    print(http_sessions.stats())
+'''
+
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
+
+try:
+    # python2
+    from urlparse import urlsplit
+except ImportError:
+    # python3
+    from urllib.parse import urlsplit
+
+
+class _request_cookies(RequestsCookieJar):
+    '''
+    Private class; a cookie jar keeping the cookies of each thread apart, so the cookies set during a request
+    (eg. by a login redirect) are sent in the rest of that request only, not in a request of another thread.
+    '''
+
+    def __init__(self, policy = None):
+        self._local = threading.local()
+        RequestsCookieJar.__init__(self, policy)
+
+    @property
+    def _cookies(self):
+        if not hasattr(self._local, 'cookies'):
+            self._local.cookies = {}
+        return self._local.cookies
+
+    @_cookies.setter
+    def _cookies(self, cookies):
+        self._local.cookies = cookies
+
+
+class host_session(object):
+    '''
+    A thread safe session for the requests to a single host.
+
+    `host` (string):    the scheme and host (and port) of the urls, eg. `https://api.pdok.nl`.
+
+    See the module documentation for the other arguments.
+    '''
+
+    def __init__(self, host, pool_size = 10, timeout = None, max_retries = 0):
+        self.host = host
+        self.pool_size = max(int(pool_size), 1)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = self.pool_size, max_retries = max_retries)
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self.session.cookies = _request_cookies()
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+
+    def request(self, method, url, **kwargs):
+        '''
+        Sends a request like `requests.request` does, with the default timeout of this session if no `timeout` is given.
+
+        Cookies set by the host are kept during the request, eg. while following redirects, and forgotten after it,
+        as the cookies of one subject shouldn't be sent for the next.
+        '''
+
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        start = time.time()
+        try:
+            return self.session.request(method, url, **kwargs)
+        except Exception:
+            with self._lock:
+                self._counters['errors'] = self._counters['errors'] + 1
+            raise
+        finally:
+            self.session.cookies.clear()                                # the cookies of this thread only
+            seconds = time.time() - start
+            with self._lock:
+                self._counters['requests'] = self._counters['requests'] + 1
+                self._counters['seconds'] = self._counters['seconds'] + seconds
+                self._counters['max_seconds'] = max(self._counters['max_seconds'], seconds)
+
+    def _connections(self):
+        '''
+        Private method; returns the number of connections made and the number of requests sent over them, as counted by urllib3.
+        '''
+
+        made = 0
+        sent = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                made = made + getattr(pool, 'num_connections', 0)
+                sent = sent + getattr(pool, 'num_requests', 0)
+        return made, sent
+
+    def stats(self):
+        '''
+        Returns a dict with statistics on this session.
+        '''
+
+        with self._lock:
+            stats = dict(self._counters)
+        try:
+            stats['connections'], sent = self._connections()
+            stats['reused'] = max(sent - stats['connections'], 0)
+        except Exception:
+            pass                                                        # the internals of urllib3 differ between versions
+        stats['mean_seconds'] = stats['seconds'] / stats['requests'] if stats['requests'] else 0.0
+        stats['pool_size'] = self.pool_size
+        return stats
+
+    def close(self):
+        '''
+        Closes the connections of this session.
+        '''
+
+        self.session.close()
+
+
+_sessions = {}                                                          # (process id, host): host_session; a session doesn't survive forking
+_options = {}                                                           # host: options set with `configure`
+_sessions_lock = threading.Lock()
+
+
+def _host(url):
+    '''
+    Private function; returns the scheme and host (and port) of an url, eg. `https://api.pdok.nl`.
+    '''
+
+    parts = urlsplit(url)
+    return '%s://%s' % (parts.scheme.lower(), parts.netloc.lower())
+
+
+def configure(url, **options):
+    '''
+    Sets the options (see the module documentation) for the session of the host of `url`.
+
+    A session which exists already is replaced by a new one with these options.
+    '''
+
+    host = _host(url)
+    with _sessions_lock:
+        _options[host] = options
+        old = _sessions.pop((os.getpid(), host), None)
+    if old is not None:
+        old.close()
+
+
+def get_session(url, **options):
+    '''
+    Returns the session of this process for the host of `url`.
+
+    The session is made with the options set with `configure` for the host, or else with `options`,
+    when it doesn't exist yet.
+    '''
+
+    host = _host(url)
+    key = (os.getpid(), host)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = host_session(host, **(_options.get(host, options) or {}))
+            _sessions[key] = session
+        return session
+
+
+def request(method, url, http_pool = None, **kwargs):
+    '''
+    Sends a request like `requests.request` does, with the session for the host of `url`.
+
+    `http_pool` (dict):     the options for the session when it doesn't exist yet.
+    '''
+
+    return get_session(url, **(http_pool or {})).request(method, url, **kwargs)
+
+
+def get(url, params = None, **kwargs):
+    '''
+    Sends a GET request like `requests.get` does, with the session for the host of `url`.
+    '''
+
+    return request('GET', url, params = params, **kwargs)
+
+
+def post(url, data = None, **kwargs):
+    '''
+    Sends a POST request like `requests.post` does, with the session for the host of `url`.
+    '''
+
+    return request('POST', url, data = data, **kwargs)
+
+
+def head(url, **kwargs):
+    '''
+    Sends a HEAD request like `requests.head` does, with the session for the host of `url`.
+    '''
+
+    kwargs.setdefault('allow_redirects', False)
+    return request('HEAD', url, **kwargs)
+
+
+def stats():
+    '''
+    Returns a dict with the statistics of each session of this process, by host.
+    '''
+
+    pid = os.getpid()
+    with _sessions_lock:
+        sessions = [session for key, session in _sessions.items() if key[0] == pid]
+    return dict((session.host, session.stats()) for session in sessions)
+
+
+def close_all():
+    '''
+    Closes the connections of all sessions of this process.
+    '''
+
+    pid = os.getpid()
+    with _sessions_lock:
+        sessions = [session for key, session in _sessions.items() if key[0] == pid]
+    for session in sessions:
+        session.close()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+'''
+The kv_cache module keeps values (eg. the results of a geocoder) in a two tier cache: a least recently
+used cache in the memory of the process, backed by an optional SQLite file on disk.
+
+The SQLite file is shared by all processes on a host using it, like prefork wsgi workers and batch
+processes. It is opened in WAL mode, so readers don't block each other or a writer. Each thread of each
+process uses a connection of its own.
+
+Each value is kept with a time to live. Values are JSON serialized, so only store what `json` can handle.
+`None` is a value as well, eg. to remember that a geocoder didn't find an address (negative caching).
+
+Example
+-------
+
+    from geoDSS.utils import kv_cache
+
+    cache = kv_cache.get_cache('/var/cache/geodss/geocoder.sqlite')
+    hit, value = cache.get('4171KG-74')
+    if not hit:
+        value = {'x': 140461.5, 'y': 430227.4}
+        cache.set('4171KG-74', value, ttl = 30 * 24 * 3600)
+'''
+
+import collections
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class two_tier_cache(object):
+    '''
+    A thread safe cache in memory, backed by an optional SQLite file.
+
+    `file` (string):        the SQLite file. Defaults to `None`: the values are only kept in memory.
+
+    `max_entries` (int):    the maximum number of values kept in memory. Defaults to 10000.
+
+    `timeout` (number):     seconds to wait for the SQLite file when another process is writing. Defaults to 30.
+    '''
+
+    def __init__(self, file = None, max_entries = 10000, timeout = 30):
+        self.file = file
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = collections.OrderedDict()                      # key: (expires, value); the last one is the most recently used
+        self._lock = threading.Lock()
+        self._local = threading.local()                                 # the SQLite connection of a thread
+        self._counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0, 'disk_errors': 0}
+
+    def _count(self, counter):
+        '''
+        Private method; adds one to a counter.
+        '''
+
+        with self._lock:
+            self._counters[counter] = self._counters[counter] + 1
+
+    def _connection(self):
+        '''
+        Private method; returns the SQLite connection of this thread, or `None` if there is no file.
+        '''
+
+        if not self.file:
+            return None
+        if getattr(self._local, 'pid', None) != os.getpid():           # a connection doesn't survive forking
+            directory = os.path.dirname(os.path.abspath(self.file))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(self.file, timeout = self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL;')
+            conn.execute('PRAGMA synchronous=NORMAL;')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL);')
+            conn.commit()
+            self._local.connection = conn
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def _remember(self, key, expires, value):
+        '''
+        Private method; keeps a value in memory.
+        '''
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (expires, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def get(self, key):
+        '''
+        Returns a (hit, value) tuple for `key`, where hit is `False` if the key is not in the cache or expired.
+        '''
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                self._entries[key] = entry                              # re-insert to mark as most recently used
+                self._counters['hits'] = self._counters['hits'] + 1
+                return True, entry[1]
+
+        try:
+            conn = self._connection()
+            row = None
+            if conn is not None:
+                row = conn.execute('SELECT value, expires FROM cache WHERE key = ?;', (key,)).fetchone()
+        except Exception:
+            self._count('disk_errors')                                  # a cache on disk which can't be read is no reason to fail
+            row = None
+        if row is not None and row[1] > now:
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            self._count('disk_hits')
+            return True, value
+
+        self._count('misses')
+        return False, None
+
+    def set(self, key, value, ttl):
+        '''
+        Keeps `value` for `key` during `ttl` seconds.
+        '''
+
+        expires = time.time() + ttl
+        self._remember(key, expires, value)
+        self._count('writes')
+        try:
+            conn = self._connection()
+            if conn is not None:
+                with conn:
+                    conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?);', (key, json.dumps(value), expires))
+                    if self._counters['writes'] % 1000 == 0:
+                        conn.execute('DELETE FROM cache WHERE expires < ?;', (time.time(),))
+        except Exception:
+            self._count('disk_errors')
+
+    def clear(self):
+        '''
+        Removes all values from the cache, in memory and on disk.
+        '''
+
+        with self._lock:
+            self._entries.clear()
+        conn = self._connection()
+        if conn is not None:
+            with conn:
+                conn.execute('DELETE FROM cache;')
+
+    def stats(self):
+        '''
+        Returns a dict with statistics on this cache.
+        '''
+
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+_caches = {}                                                            # (process id, file): two_tier_cache
+_caches_lock = threading.Lock()
+
+
+def get_cache(file = None, **options):
+    '''
+    Returns the cache of this process for the SQLite file `file` (or the cache in memory only if `file` is `None`).
+
+    The cache is made with `options` (see `two_tier_cache`) when it doesn't exist yet.
+    '''
+
+    key = (os.getpid(), os.path.abspath(file) if file else None)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = two_tier_cache(file, **options)
+            _caches[key] = cache
+        return cache
+
+
+def stats():
+    '''
+    Returns a dict with the statistics of each cache of this process, by file.
+    '''
+
+    pid = os.getpid()
+    with _caches_lock:
+        caches = [(key[1], cache) for key, cache in _caches.items() if key[0] == pid]
+    return dict((file, cache.stats()) for file, cache in caches)
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+'''
+The pg_pool module keeps pools of PostgreSQL connections, so rules don't have to connect to the database
+for each subject.
+
+A pool is kept for each database connection definition (the `db` dict of a rule), and is shared by all
+rules and rule sets in the process. Pools are not shared with forked processes.
+
+Rules can tune the pool of their database with a `db_pool` dict in their definition (or in the `settings`
+of the rule set). The first rule using a database creates its pool with these options:
+
+- `min_size` (int)                  The number of idle connections kept open. Defaults to 0.
+- `max_size` (int)                  The maximum number of connections. Defaults to 8.
+- `idle_timeout` (int)              Seconds after which an idle connection is closed. Defaults to 300.
+- `health_check_interval` (int)     An idle connection is checked with `SELECT 1` before re-using it when
+                                    it has been idle longer than this number of seconds. Defaults to 30.
+- `timeout` (int)                   Seconds to wait for a connection when all connections are in use. Defaults to 30.
+
+Example
+-------
+
+    from geoDSS.utils import pg_pool
+
+    pool = pg_pool.get_pool({'dbname': 'gisdefault'})
+    conn = pool.getconn()
+    try:
+        cur = conn.cursor()
+        pool.execute(cur, 'SELECT ST_AsEWKT(ST_GeomFromEWKT(%s));', ['SRID=28992;POINT(125000 360000)'])
+    finally:
+        pool.putconn(conn)
+
+`execute` prepares a statement on the server once for each connection, and executes it by name afterwards.
+So the server parses and plans a statement only once, and arguments (eg. large geometries) are not parsed as SQL.
+'''
+
+import hashlib
+import os
+import re
+import threading
+import time
+
+try:
+    import psycopg2
+except:
+    pass
+
+from . import geometries
+from . import wkb
+
+
+class PoolError(Exception):
+    '''
+    Raised when no connection becomes available within the timeout of the pool.
+    '''
+
+    pass
+
+
+class connection_pool(object):
+    '''
+    A thread safe pool of connections to a single PostgreSQL database.
+
+    `db` (dict):        the keyword arguments for `psycopg2.connect`.
+
+    See the module documentation for the other arguments.
+    '''
+
+    def __init__(self, db, min_size = 0, max_size = 8, idle_timeout = 300, health_check_interval = 30, timeout = 30):
+        self.db = dict(db)
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self._idle = []                                                 # (connection, time returned to the pool); the last one is the most recently used
+        self._size = 0                                                  # connections in use, idle or being made
+        self._condition = threading.Condition(threading.Lock())
+        self._prepared = {}                                             # connection: names of the statements prepared on it
+        self._counters = {'created': 0, 'reused': 0, 'closed': 0, 'health_check_failures': 0, 'waits': 0, 'timeouts': 0,
+                          'prepared': 0, 'executed_prepared': 0}
+
+    def _connect(self):
+        '''
+        Private method; returns a new connection. The caller has reserved a place in the pool for it.
+        '''
+
+        conn = psycopg2.connect(**self.db)
+        with self._condition:
+            self._counters['created'] = self._counters['created'] + 1
+        return conn
+
+    def _close(self, conn):
+        '''
+        Private method; closes a connection which is no longer part of the pool.
+        '''
+
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._condition:
+            self._prepared.pop(conn, None)
+            self._counters['closed'] = self._counters['closed'] + 1
+
+    def _is_healthy(self, conn, idle_since):
+        '''
+        Private method; returns whether an idle connection can be re-used.
+        '''
+
+        if conn.closed:
+            return False
+        if time.time() - idle_since < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1;')
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _expire(self):
+        '''
+        Private method; takes the connections which are idle too long out of the pool and returns them.
+        The lock should be held by the caller.
+        '''
+
+        expired = []
+        now = time.time()
+        while len(self._idle) > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.pop(0)[0])
+        return expired
+
+    def fill(self):
+        '''
+        Opens connections until the pool has `min_size` connections.
+        '''
+
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    return
+                self._size = self._size + 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._release()
+                raise
+            self.putconn(conn)
+
+    def _release(self):
+        '''
+        Private method; frees the place in the pool of a connection which is closed or couldn't be made.
+        '''
+
+        with self._condition:
+            self._size = self._size - 1
+            self._condition.notify()
+
+    def getconn(self):
+        '''
+        Returns a connection from the pool. A new connection is made when there is no idle connection
+        and the pool isn't full. Otherwise this waits for a connection to be returned, and raises a
+        PoolError when none is returned within `timeout` seconds.
+
+        Return the connection with `putconn` when done.
+        '''
+
+        deadline = time.time() + self.timeout
+        while True:
+            conn = None
+            create = False
+            with self._condition:
+                expired = self._expire()
+                self._size = self._size - len(expired)
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size = self._size + 1                         # reserve a place for the new connection
+                    create = True
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._counters['timeouts'] = self._counters['timeouts'] + 1
+                        raise PoolError('No connection to %s available within %s seconds.' % (_describe(self.db), self.timeout))
+                    self._counters['waits'] = self._counters['waits'] + 1
+                    self._condition.wait(remaining)
+            for expired_conn in expired:
+                self._close(expired_conn)
+
+            if create:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._release()
+                    raise
+            if conn is not None:
+                if self._is_healthy(conn, idle_since):
+                    with self._condition:
+                        self._counters['reused'] = self._counters['reused'] + 1
+                    return conn
+                with self._condition:
+                    self._counters['health_check_failures'] = self._counters['health_check_failures'] + 1
+                self._close(conn)
+                self._release()
+
+    def putconn(self, conn, close = False):
+        '''
+        Returns a connection obtained by `getconn` to the pool. A transaction still open is rolled back.
+
+        `close` (bool):     when `True` the connection is closed instead of kept, eg. because it is broken.
+        '''
+
+        if not close and not conn.closed:
+            try:
+                conn.rollback()
+            except Exception:
+                close = True
+        if close or conn.closed:
+            self._close(conn)
+            self._release()
+        else:
+            with self._condition:
+                self._idle.append((conn, time.time()))
+                self._condition.notify()
+
+    def execute(self, cur, statement, arguments = (), prepare = True, retry = True):
+        '''
+        Executes a statement with a cursor of a connection of this pool.
+
+        `statement` (string):   the SQL, with a `%s` placeholder for each argument like in `cursor.execute`.
+
+        `arguments` (list):     the arguments.
+
+        `prepare` (bool):       when `True` (default) the statement is prepared on the server the first time it is
+                                executed on a connection, and executed by name afterwards. Set this to `False` when
+                                the statement is different each time, or when connecting via a pooler not supporting
+                                prepared statements.
+
+        `retry` (bool):         prepare the statement again when the server doesn't know it anymore. Defaults to `True`.
+        '''
+
+        if not prepare:
+            return cur.execute(statement, arguments)
+
+        if not isinstance(statement, bytes):
+            name = 'geodss_' + hashlib.sha1(statement.encode('utf-8')).hexdigest()[:24]
+        else:
+            name = 'geodss_' + hashlib.sha1(statement).hexdigest()[:24]
+        prepared = self._prepared.setdefault(cur.connection, set())     # a connection is used by one thread at a time
+        if not name in prepared:
+            count = [0]
+            def placeholder(match):
+                count[0] = count[0] + 1
+                return '$%d' % count[0]
+            parts = [re.sub('%s', placeholder, part) for part in statement.split('%%')]
+            cur.execute('PREPARE %s AS %s' % (name, '%'.join(parts)))
+            prepared.add(name)
+            with self._condition:
+                self._counters['prepared'] = self._counters['prepared'] + 1
+        try:
+            if arguments:
+                cur.execute('EXECUTE %s (%s);' % (name, ', '.join(['%s'] * len(arguments))), arguments)
+            else:
+                cur.execute('EXECUTE %s;' % name)
+        except Exception as error:
+            if getattr(error, 'pgcode', None) != '26000' or not retry:
+                raise
+            cur.connection.rollback()                                   # the statement is gone, eg. the server session was reset
+            prepared.clear()
+            return self.execute(cur, statement, arguments, prepare, retry = False)
+        with self._condition:
+            self._counters['executed_prepared'] = self._counters['executed_prepared'] + 1
+
+    def closeall(self):
+        '''
+        Closes all idle connections. Connections in use are closed when they are returned.
+        '''
+
+        with self._condition:
+            idle = [conn for conn, idle_since in self._idle]
+            self._idle = []
+            self._size = self._size - len(idle)
+            self.min_size = 0
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        '''
+        Returns a dict with statistics on this pool.
+        '''
+
+        with self._condition:
+            stats = dict(self._counters)
+            stats.update({'size': self._size,
+                          'idle': len(self._idle),
+                          'in_use': self._size - len(self._idle),
+                          'max_size': self.max_size})
+            return stats
+
+
+_pools = {}                                                             # (process id, normalized db): pool; a pool doesn't survive forking
+_pools_lock = threading.Lock()
+
+
+def _normalize(db):
+    '''
+    Private function; returns a hashable version of a database connection definition.
+    '''
+
+    return tuple(sorted((str(key), str(value)) for key, value in db.items()))
+
+
+def _describe(db):
+    '''
+    Private function; returns a description of a database connection definition, leaving out the password.
+    '''
+
+    return ' '.join('%s=%s' % (key, value) for key, value in _normalize(db) if key != 'password')
+
+
+def get_pool(db, **options):
+    '''
+    Returns the pool of this process for the database connection definition `db`.
+
+    The pool is made with `options` (see the module documentation) when it doesn't exist yet.
+    '''
+
+    key = (os.getpid(), _normalize(db))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = connection_pool(db, **(options or {}))
+            _pools[key] = pool
+            new = True
+        else:
+            new = False
+    if new and pool.min_size:
+        try:
+            pool.fill()
+        except Exception:
+            pass                                                        # the error is raised again when a connection is asked for
+    return pool
+
+
+def stats():
+    '''
+    Returns a dict with the statistics of each pool of this process, by a description of its database.
+    '''
+
+    pid = os.getpid()
+    with _pools_lock:
+        pools = [(key[1], pool) for key, pool in _pools.items() if key[0] == pid]
+    return dict((_describe(dict(db)), pool.stats()) for db, pool in pools)
+
+
+def close_all():
+    '''
+    Closes the idle connections of all pools of this process.
+    '''
+
+    pid = os.getpid()
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if key[0] == pid]
+    for pool in pools:
+        pool.closeall()
+
+
+def geometry_argument(geometry):
+    '''
+    Returns the SQL function reading the geometry of a subject, and the argument to bind for it.
+
+    A geometry as EWKB (bytes, a hex or base64 string; see `wkb.is_ewkb`) is bound as binary and read with
+    `ST_GeomFromEWKB`, so the server doesn't parse coordinates as text. EWKT is read with `ST_GeomFromEWKT`.
+    '''
+
+    if geometry is not None and wkb.is_ewkb(geometry):
+        return 'ST_GeomFromEWKB', psycopg2.Binary(wkb.decode(geometry))
+    return 'ST_GeomFromEWKT', geometry
+
+
+def geometry_array(values):
+    '''
+    Returns the SQL function reading the geometries of a number of subjects, the SQL type of the array and the
+    list to bind for the array. See `geometry_argument`.
+
+    The array is binary when all geometries are EWKB. Otherwise the geometries as EWKB are sent as EWKT.
+    '''
+
+    if values and all(value is not None and wkb.is_ewkb(value) for value in values):
+        return 'ST_GeomFromEWKB', 'bytea', [psycopg2.Binary(wkb.decode(value)) for value in values]
+    return 'ST_GeomFromEWKT', 'text', [geometries.get(value).ewkt if value is not None and wkb.is_ewkb(value) else value for value in values]
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+'''
+A static R-tree in pure Python, to find the items whose bounding box intersects a given bounding box.
+
+The tree is bulk loaded with the Sort-Tile-Recursive (STR) algorithm: the items are sorted in slices
+on x and within a slice on y, and packed in full nodes. This gives a tree with little overlap between
+nodes, which is built once and queried many times.
+
+Example
+-------
+
+    from geoDSS.utils import rtree
+
+    tree = rtree.str_tree([((0, 0, 10, 10), 'a'), ((20, 20, 30, 30), 'b')])
+    tree.query((5, 5, 6, 6))                                            # ['a']
+'''
+
+import math
+
+
+def _union(entries):
+    '''
+    Private function; returns the bounding box of a list of (bounding box, ...) tuples.
+    '''
+
+    return (min(entry[0][0] for entry in entries),
+            min(entry[0][1] for entry in entries),
+            max(entry[0][2] for entry in entries),
+            max(entry[0][3] for entry in entries))
+
+
+class str_tree(object):
+    '''
+    A static R-tree packed with the Sort-Tile-Recursive algorithm.
+
+    `items` (iterable):         (bounding box, value) tuples, where a bounding box is a (minx, miny, maxx, maxy) tuple.
+
+    `node_capacity` (int):      the maximum number of entries in a node. Defaults to 16.
+    '''
+
+    def __init__(self, items, node_capacity = 16):
+        self.node_capacity = max(int(node_capacity), 2)
+        entries = [(tuple(float(c) for c in bbox), value) for bbox, value in items]
+        self.size = len(entries)
+        self._root = None
+        leaf = True
+        while entries:
+            nodes = [(_union(group), group, leaf) for group in self._pack(entries)]
+            if len(nodes) == 1:
+                self._root = nodes[0]
+                break
+            entries = nodes
+            leaf = False
+
+    def __len__(self):
+        return self.size
+
+    def _pack(self, entries):
+        '''
+        Private method; groups entries in nodes, tiling them in vertical slices sorted on the center of their bounding box.
+        '''
+
+        capacity = self.node_capacity
+        node_count = int(math.ceil(len(entries) / float(capacity)))
+        slice_size = int(math.ceil(math.sqrt(node_count))) * capacity
+        entries = sorted(entries, key = lambda entry: entry[0][0] + entry[0][2])
+        groups = []
+        for start in range(0, len(entries), slice_size):
+            tile = sorted(entries[start:start + slice_size], key = lambda entry: entry[0][1] + entry[0][3])
+            for node_start in range(0, len(tile), capacity):
+                groups.append(tile[node_start:node_start + capacity])
+        return groups
+
+    def query(self, bbox):
+        '''
+        Returns a list with the values of the items whose bounding box intersects `bbox` (a (minx, miny, maxx, maxy) tuple).
+        '''
+
+        results = []
+        if self._root is None:
+            return results
+        minx, miny, maxx, maxy = bbox
+        root_bbox = self._root[0]
+        if root_bbox[0] > maxx or root_bbox[2] < minx or root_bbox[1] > maxy or root_bbox[3] < miny:
+            return results
+        stack = [self._root]
+        while stack:
+            node_bbox, children, leaf = stack.pop()
+            for child in children:
+                child_bbox = child[0]
+                if child_bbox[0] <= maxx and child_bbox[2] >= minx and child_bbox[1] <= maxy and child_bbox[3] >= miny:
+                    if leaf:
+                        results.append(child[1])
+                    else:
+                        stack.append(child)
+        return results
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+'''
+This module reads (E)WKB geometries: the binary form of a geometry PostGIS and OGR use.
+
+A subject can carry its geometry as EWKB instead of EWKT, which is smaller for geometries with many vertices
+and doesn't need to be parsed as text. The EWKB is given as a hex string (as PostGIS returns a geometry,
+eg. `0101000020407100000AD7A37091D90041C3F5285C59A11B41`), a base64 string (eg. of `ST_AsEWKB`) or bytes.
+
+`parse` reads EWKB, ISO WKB (eg. `POINT Z` as type 1001) and WKB into the same `wkt.geometry` as `wkt.parse` does,
+copying the coordinates into arrays of doubles without converting them one by one.
+
+Example
+-------
+
+    from geoDSS.utils import wkb, wkt
+
+    data = wkb.decode('0101000020407100000AD7A37091D90041C3F5285C59A11B41')
+    g = wkb.parse(data)
+    g.srid                                                              # 28992
+    wkt.dumps(g)                                                        # 'SRID=28992;POINT(138034.18 452694.34)'
+'''
+
+import base64
+import binascii
+import re
+import struct
+import sys
+
+from array import array
+
+from .wkt import geometry
+
+_types = {1: 'POINT', 2: 'LINESTRING', 3: 'POLYGON', 4: 'MULTIPOINT', 5: 'MULTILINESTRING', 6: 'MULTIPOLYGON', 7: 'GEOMETRYCOLLECTION'}
+_Z, _M, _SRID = 0x80000000, 0x40000000, 0x20000000                       # the EWKB flags of the geometry type
+_hex = re.compile(r'^0[01](?:[0-9A-Fa-f]{2}){8,}$')                     # at least a byte order, type and count
+_base64 = re.compile(r'^A[AQ][A-Za-z0-9+/]{10,}={0,2}$')
+_native = '<' if sys.byteorder == 'little' else '>'
+
+
+def _byte(data, offset):
+    '''
+    Private function; returns the byte at `offset` as an int.
+    '''
+
+    value = data[offset]
+    return value if isinstance(value, int) else ord(value)
+
+def is_ewkb(value):
+    '''
+    Returns whether `value` is a geometry as EWKB: bytes, a hex string or a base64 string.
+
+    EWKT never starts like EWKB does (with byte order 0 or 1), so EWKB and EWKT can be told apart by the first characters.
+    '''
+
+    if isinstance(value, (bytearray, memoryview)):
+        return True
+    if not value or not isinstance(value, (type(b''), type(u''))):
+        return False
+    if isinstance(value, type(b'')) and _byte(value, 0) in (0, 1):
+        return True                                                     # binary; in python 2 a str can be binary as well
+    if isinstance(value, type(b'')) and str is not type(b''):
+        return False                                                    # bytes in python 3 are binary or nothing
+    return bool(_hex.match(value) or (len(value) % 4 == 0 and _base64.match(value)))
+
+def decode(value):
+    '''
+    Returns the EWKB bytes of a geometry given as bytes, a hex string or a base64 string. See `is_ewkb`.
+    '''
+
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, type(b'')) and _byte(value, 0) in (0, 1):
+        return value
+    if isinstance(value, type(u'')):
+        value = value.encode('ascii')
+    if value[:1] == b'0':
+        return binascii.unhexlify(value)
+    return base64.b64decode(value)
+
+def encode(data, like):
+    '''
+    Returns the EWKB bytes `data` in the same form (bytes, hex or base64 string) as `like`, another geometry as EWKB.
+    '''
+
+    if isinstance(like, (bytearray, memoryview)) or (isinstance(like, type(b'')) and _byte(like, 0) in (0, 1)):
+        return data
+    if like[:1] in (b'0', u'0'):
+        text = binascii.hexlify(data).upper()
+    else:
+        text = base64.b64encode(data)
+    return text.decode('ascii') if isinstance(like, type(u'')) else text
+
+def srid(data):
+    '''
+    Returns the SRID of EWKB bytes, or `None` if it has none.
+    '''
+
+    order = '<' if _byte(data, 0) == 1 else '>'
+    if struct.unpack_from(order + 'I', data, 1)[0] & _SRID:
+        return struct.unpack_from(order + 'I', data, 5)[0]
+    return None
+
+def to_wkb(data):
+    '''
+    Returns EWKB bytes as WKB bytes without the SRID, which OGR reads. The Z flag is kept, as OGR knows it.
+    '''
+
+    order = '<' if _byte(data, 0) == 1 else '>'
+    type = struct.unpack_from(order + 'I', data, 1)[0]
+    if not type & _SRID:
+        return data
+    return data[:1] + struct.pack(order + 'I', type & ~_SRID) + data[9:]
+
+def from_wkb(data, srid):
+    '''
+    Returns WKB bytes (eg. of OGR) as EWKB bytes with the SRID `srid`.
+    '''
+
+    if srid is None:
+        return data
+    order = '<' if _byte(data, 0) == 1 else '>'
+    type = struct.unpack_from(order + 'I', data, 1)[0]
+    return data[:1] + struct.pack(order + 'II', type | _SRID, srid) + data[5:]
+
+def _coordinates(data, offset, order, count):
+    '''
+    Private function; returns an array with `count` doubles read from `data` at `offset`, and the offset after them.
+    '''
+
+    coordinates = array('d')
+    end = offset + 8 * count
+    if hasattr(coordinates, 'frombytes'):
+        coordinates.frombytes(data[offset:end])
+    else:
+        coordinates.fromstring(data[offset:end])
+    if order != _native:
+        coordinates.byteswap()
+    return coordinates, end
+
+def _read(data, offset, srid):
+    '''
+    Private function; returns the geometry in `data` at `offset`, and the offset after it.
+    '''
+
+    order = '<' if _byte(data, offset) == 1 else '>'
+    type = struct.unpack_from(order + 'I', data, offset + 1)[0]
+    offset = offset + 5
+    has_z, has_m = bool(type & _Z), bool(type & _M)
+    if type & _SRID:
+        srid = struct.unpack_from(order + 'I', data, offset)[0]
+        offset = offset + 4
+    type = type & 0x0FFFFFFF
+    if type > 1000:                                                     # ISO WKB: 1000 for Z, 2000 for M, 3000 for ZM
+        has_z = has_z or type // 1000 in (1, 3)
+        has_m = has_m or type // 1000 in (2, 3)
+        type = type % 1000
+    if not type in _types:
+        raise ValueError('Unsupported WKB type: %s' % type)
+    name = _types[type]
+    dimensions = 2 + has_z + has_m
+    count = lambda offset: struct.unpack_from(order + 'I', data, offset)[0]
+
+    if name == 'POINT':
+        parts, offset = _coordinates(data, offset, order, dimensions)
+        if parts[0] != parts[0] and parts[1] != parts[1]:
+            parts = array('d')                                          # an empty point has NaN coordinates
+    elif name == 'LINESTRING':
+        parts, offset = _coordinates(data, offset + 4, order, count(offset) * dimensions)
+    elif name == 'POLYGON':
+        parts = []
+        rings, offset = count(offset), offset + 4
+        for i in range(rings):
+            ring, offset = _coordinates(data, offset + 4, order, count(offset) * dimensions)
+            parts.append(ring)
+    else:
+        members = []
+        number, offset = count(offset), offset + 4
+        for i in range(number):
+            member, offset = _read(data, offset, srid)
+            members.append(member)
+        if name == 'GEOMETRYCOLLECTION':
+            parts = members
+        else:
+            parts = [member.parts for member in members if member.parts]
+    return geometry(name, srid, dimensions, has_m, parts), offset
+
+def parse(data, srid = None):
+    '''
+    Returns a `wkt.geometry` for EWKB (or WKB) bytes. `srid` is the SRID of WKB without one.
+
+    Raises a ValueError for bytes which aren't (E)WKB.
+    '''
+
+    try:
+        return _read(data, 0, srid)[0]
+    except (struct.error, IndexError) as error:
+        raise ValueError('Not a (E)WKB geometry: %s' % error)
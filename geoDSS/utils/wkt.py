@@ -0,0 +1,576 @@
+# -*- coding: utf-8 -*-
+
+'''
+This module contains helper functions for (E)WKT manipulation, shared by the tests and processors.
+
+`parse` reads any (E)WKT geometry: POINT, LINESTRING, POLYGON (with all its rings), their MULTI variants
+and GEOMETRYCOLLECTION, with or without Z and/ or M values. The coordinates are kept in contiguous arrays
+of doubles (`array.array('d')`), so the bounding box and centroid are computed by slicing and reducing
+these arrays instead of looping over coordinate strings.
+
+Example
+-------
+
+    from geoDSS.utils import wkt
+
+    g = wkt.parse('SRID=28992;POLYGON((0 0,10 0,10 10,0 10,0 0),(2 2,4 2,4 4,2 4,2 2))')
+    g.srid                                                              # 28992
+    g.parts[1]                                                          # array('d', [2.0, 2.0, 4.0, 2.0, ...])
+    g.bbox()                                                            # (0.0, 0.0, 10.0, 10.0)
+    g.centroid()                                                        # (5.083..., 5.083...)
+
+Run this module to compare the speed of the parser with the regular expression based `_WKTParser`:
+
+    python -m geoDSS.utils.wkt
+'''
+
+import math
+import operator
+import re
+
+from array import array
+
+_types = ['POINT', 'LINESTRING', 'POLYGON', 'MULTIPOINT', 'MULTILINESTRING', 'MULTIPOLYGON', 'GEOMETRYCOLLECTION']
+_tag = re.compile(r'\s*(?:SRID\s*=\s*(-?\d+)\s*;)?\s*([A-Za-z]+)(?:\s+(ZM|Z|M)\b)?\s*', re.I)
+_parens = re.compile(r'[()]')
+_first_coordinate = re.compile(r'[\s(]*([^,()]*)')
+
+
+class geometry(object):
+    '''
+    A geometry read by `parse`.
+
+    - `type` (string)           the geometry type in upper case, eg. `MULTIPOLYGON`.
+    - `srid` (int)              the SRID, or `None` for WKT without a SRID.
+    - `dimensions` (int)        the number of values of a coordinate: 2, 3 (XYZ or XYM) or 4 (XYZM).
+    - `has_z`, `has_m` (bool)   whether the coordinates have a Z and an M value.
+    - `parts`                   the coordinates, as arrays of doubles (x1, y1, [z1, m1,] x2, y2, ...):
+
+        - POINT, LINESTRING:                    an array
+        - POLYGON, MULTIPOINT, MULTILINESTRING: a list of arrays (rings, points or linestrings)
+        - MULTIPOLYGON:                         a list with a list of arrays (rings) for each polygon
+        - GEOMETRYCOLLECTION:                   a list of geometries
+    '''
+
+    def __init__(self, type, srid, dimensions, has_m, parts):
+        self.type = type
+        self.srid = srid
+        self.dimensions = dimensions
+        self.has_m = has_m
+        self.has_z = dimensions == 4 or (dimensions == 3 and not has_m)
+        self.parts = parts
+        self._coordinates = None
+
+    def __repr__(self):
+        return '<geometry %s %s>' % (self.type, self.srid)
+
+    def arrays(self):
+        '''
+        Returns a list with all coordinate arrays (points, linestrings or rings) of this geometry.
+        '''
+
+        if self.type in ('POINT', 'LINESTRING'):
+            return [self.parts]
+        if self.type == 'MULTIPOLYGON':
+            return [ring for polygon in self.parts for ring in polygon]
+        if self.type == 'GEOMETRYCOLLECTION':
+            return [part for member in self.parts for part in member.arrays()]
+        return list(self.parts)
+
+    @property
+    def coordinates(self):
+        '''
+        All coordinates of this geometry in a single array of doubles.
+        '''
+
+        if self._coordinates is None and self.type in ('POINT', 'LINESTRING'):
+            self._coordinates = self.parts
+        elif self._coordinates is None:
+            coordinates = array('d')
+            for part in self.arrays():
+                coordinates.extend(part)
+            self._coordinates = coordinates
+        return self._coordinates
+
+    def xs(self):
+        '''
+        Returns an array with the x values of all coordinates.
+        '''
+
+        return self.coordinates[0::self.dimensions]
+
+    def ys(self):
+        '''
+        Returns an array with the y values of all coordinates.
+        '''
+
+        return self.coordinates[1::self.dimensions]
+
+    def bbox(self):
+        '''
+        Returns the bounding box (minx, miny, maxx, maxy) of this geometry, or `None` if it is empty.
+        '''
+
+        if self.type == 'GEOMETRYCOLLECTION':                          # the members may differ in dimensions
+            boxes = [box for box in (member.bbox() for member in self.parts) if box]
+            if not boxes:
+                return None
+            return (min(box[0] for box in boxes), min(box[1] for box in boxes),
+                    max(box[2] for box in boxes), max(box[3] for box in boxes))
+        if self.type == 'POINT':
+            return (self.parts[0], self.parts[1], self.parts[0], self.parts[1]) if self.parts else None
+        xs = self.xs()
+        if not xs:
+            return None
+        ys = self.ys()
+        return (min(xs), min(ys), max(xs), max(ys))
+
+    def _weighted_centroid(self):
+        '''
+        Private method; returns (topological dimension, weight, x, y), where the weight is the area, length
+        or number of points the centroid is computed for. Returns `None` for an empty geometry.
+        '''
+
+        d = self.dimensions
+        if self.type in ('POLYGON', 'MULTIPOLYGON'):
+            polygons = [self.parts] if self.type == 'POLYGON' else self.parts
+            area = cx = cy = 0.0
+            for rings in polygons:
+                for i, ring in enumerate(rings):
+                    a, x, y = _ring_moments(ring[0::d], ring[1::d])
+                    if i > 0:
+                        a = -abs(a)                                     # a hole; the orientation of rings isn't guaranteed
+                    else:
+                        a = abs(a)
+                    area, cx, cy = area + a, cx + a * x, cy + a * y
+            if area > 0:
+                return 2, area, cx / area, cy / area
+            lines = [ring for rings in polygons for ring in rings]      # without area; like a linestring
+        elif self.type in ('LINESTRING', 'MULTILINESTRING'):
+            lines = [self.parts] if self.type == 'LINESTRING' else self.parts
+        elif self.type == 'GEOMETRYCOLLECTION':
+            centroids = [c for c in (member._weighted_centroid() for member in self.parts) if c]
+            if not centroids:
+                return None
+            dimension = max(c[0] for c in centroids)                   # only the members with the highest dimension count
+            centroids = [c for c in centroids if c[0] == dimension]
+            weight = sum(c[1] for c in centroids)
+            if weight == 0:
+                return dimension, 0.0, sum(c[2] for c in centroids) / len(centroids), sum(c[3] for c in centroids) / len(centroids)
+            return (dimension, weight, sum(c[1] * c[2] for c in centroids) / weight, sum(c[1] * c[3] for c in centroids) / weight)
+        else:
+            lines = []
+
+        length = cx = cy = 0.0
+        for line in lines:
+            xs, ys = line[0::d], line[1::d]
+            lengths = list(map(math.hypot, map(operator.sub, xs[1:], xs[:-1]), map(operator.sub, ys[1:], ys[:-1])))
+            length = length + sum(lengths)
+            cx = cx + sum(map(operator.mul, map(operator.add, xs[1:], xs[:-1]), lengths)) / 2
+            cy = cy + sum(map(operator.mul, map(operator.add, ys[1:], ys[:-1]), lengths)) / 2
+        if length > 0:
+            return 1, length, cx / length, cy / length
+
+        xs = self.xs()                                                  # points, or lines without length
+        if not xs:
+            return None
+        ys = self.ys()
+        return 0, float(len(xs)), math.fsum(xs) / len(xs), math.fsum(ys) / len(ys)
+
+    def centroid(self):
+        '''
+        Returns the centroid (x, y) of this geometry, or `None` if it is empty.
+
+        Like PostGIS ST_Centroid, this is the centroid of the area for (multi)polygons, of the length for
+        (multi)linestrings and of the points for (multi)points. For a collection only the members with
+        the highest dimension count.
+        '''
+
+        centroid = self._weighted_centroid()
+        if centroid is None:
+            return None
+        return centroid[2], centroid[3]
+
+
+def _ring_moments(xs, ys):
+    '''
+    Private function; returns the signed area and the centroid (x, y) of a ring, using the shoelace formula.
+    '''
+
+    if len(xs) < 3:
+        return 0.0, 0.0, 0.0
+    cross = list(map(operator.sub, map(operator.mul, xs[:-1], ys[1:]), map(operator.mul, xs[1:], ys[:-1])))
+    area = sum(cross) / 2
+    if area == 0:
+        return 0.0, 0.0, 0.0
+    x = sum(map(operator.mul, map(operator.add, xs[:-1], xs[1:]), cross)) / (6 * area)
+    y = sum(map(operator.mul, map(operator.add, ys[:-1], ys[1:]), cross)) / (6 * area)
+    return area, x, y
+
+
+def _numbers(text):
+    '''
+    Private function; returns the numbers in a comma separated list of coordinates as an array of doubles.
+    '''
+
+    return array('d', map(float, text.replace(',', ' ').split()))
+
+
+def _nested(text, start):
+    '''
+    Private function; reads the parenthesized lists starting at `text[start]` (which should be `(`) and returns
+    (nested lists with an array for each innermost list, the position after the closing parenthesis).
+    '''
+
+    stack = [[]]
+    inner_start = start
+    for match in _parens.finditer(text, start):
+        if match.group() == '(':
+            stack.append([])
+            inner_start = match.end()
+        else:
+            items = stack.pop()
+            if not items:                                               # an innermost list holds the coordinates
+                items = _numbers(text[inner_start:match.start()])
+            stack[-1].append(items)
+            if len(stack) == 1:
+                return stack[0][0], match.end()
+    raise ValueError('Missing closing parenthesis in WKT: %s' % text[start:start + 50])
+
+
+def _members(text, start):
+    '''
+    Private function; returns the member geometries of a GEOMETRYCOLLECTION whose list starts at `text[start]`,
+    and the position after the closing parenthesis.
+    '''
+
+    members = []
+    depth = 0
+    member_start = start + 1
+    for match in re.finditer(r'[(),]', text[start:]):
+        character = match.group()
+        position = start + match.start()
+        if character == '(':
+            depth = depth + 1
+        elif character == ')':
+            depth = depth - 1
+            if depth == 0:
+                if text[member_start:position].strip():
+                    members.append(text[member_start:position])
+                return members, position + 1
+        elif depth == 1:
+            members.append(text[member_start:position])
+            member_start = position + 1
+    raise ValueError('Missing closing parenthesis in WKT: %s' % text[start:start + 50])
+
+
+def parse(ewkt):
+    '''
+    Returns a `geometry` for an EWKT (eg. `SRID=28992;POINT(125000 360000)`) or WKT string.
+
+    Raises a ValueError for text which isn't (E)WKT.
+    '''
+
+    match = _tag.match(ewkt)
+    if not match:
+        raise ValueError('Not a (E)WKT geometry: %s' % ewkt[:50])
+    srid, type, suffix = match.groups()
+    srid = int(srid) if srid is not None else None
+    type = type.upper()
+    if not type in _types:                                              # eg. POINTZ or POINTM
+        for tag in ('ZM', 'Z', 'M'):
+            if type.endswith(tag) and type[:-len(tag)] in _types:
+                type, suffix = type[:-len(tag)], tag
+                break
+        else:
+            raise ValueError('Unsupported WKT type: %s' % type)
+    suffix = (suffix or '').upper()
+    has_m = 'M' in suffix
+    tag_dimension = {'ZM': 4, 'Z': 3, 'M': 3}.get(suffix)
+
+    position = match.end()
+    if ewkt[position:position + 5].upper() == 'EMPTY':
+        parts = [] if type != 'POINT' and type != 'LINESTRING' else array('d')
+        return geometry(type, srid, tag_dimension or 2, has_m, parts)
+    if ewkt[position:position + 1] != '(':
+        raise ValueError('Not a (E)WKT geometry: %s' % ewkt[:50])
+
+    if type == 'GEOMETRYCOLLECTION':
+        members, end = _members(ewkt, position)
+        parts = [parse(member) for member in members]
+        dimensions = tag_dimension or (parts[0].dimensions if parts else 2)
+        if not tag_dimension and parts:
+            has_m = parts[0].has_m
+        for member in parts:
+            member.srid = srid
+        return geometry(type, srid, dimensions, has_m, parts)
+
+    if type in ('POINT', 'LINESTRING') and ewkt.find('(', position + 1, ewkt.find(')', position)) < 0:
+        nested = _numbers(ewkt[position + 1:ewkt.index(')', position)])  # no nested lists; the common case
+    else:
+        nested, end = _nested(ewkt, position)
+    if type == 'POINT':
+        while isinstance(nested, list) and len(nested) == 1:
+            nested = nested[0]                                          # eg. POINT((125000 360000))
+        if isinstance(nested, list) or len(nested) > 4:
+            raise ValueError('A POINT should have a single coordinate: %s' % ewkt[:50])
+    if tag_dimension:
+        dimensions = tag_dimension
+    else:
+        if type == 'POINT' and not isinstance(nested, list):
+            dimensions = len(nested)
+        else:
+            dimensions = len(_first_coordinate.match(ewkt, position).group(1).split())
+        if not dimensions in (3, 4):
+            dimensions = 2                                              # EWKT puts the values without a tag: XYZ or XYZM
+    if type == 'MULTIPOINT':
+        points = array('d')                                             # MULTIPOINT((1 2),(3 4)) or MULTIPOINT(1 2,3 4)
+        for part in (nested if isinstance(nested, list) else [nested]):
+            points.extend(part)
+        parts = [points[i:i + dimensions] for i in range(0, len(points), dimensions)]
+    else:
+        parts = nested
+    return geometry(type, srid, dimensions, has_m, parts)
+
+
+def _number(value):
+    '''
+    Private function; returns a coordinate value as text, without a trailing `.0` like PostGIS.
+    '''
+
+    text = repr(value)
+    return text[:-2] if text.endswith('.0') else text
+
+def _wkt(g):
+    '''
+    Private function; returns the WKT of a geometry read by `parse`, without the SRID.
+    '''
+
+    d = g.dimensions
+    points = lambda coordinates: ','.join(' '.join(map(_number, coordinates[i:i + d])) for i in range(0, len(coordinates), d))
+    rings = lambda arrays: ','.join('(%s)' % points(ring) for ring in arrays)
+    tag = g.type + ('M' if g.has_m and not g.has_z else '')            # EWKT tags XYM only, like PostGIS does
+    if not g.parts:
+        return tag + ' EMPTY'
+    if g.type in ('POINT', 'LINESTRING'):
+        return '%s(%s)' % (tag, points(g.parts))
+    if g.type in ('POLYGON', 'MULTIPOINT', 'MULTILINESTRING'):
+        return '%s(%s)' % (tag, rings(g.parts))
+    if g.type == 'MULTIPOLYGON':
+        return '%s(%s)' % (tag, ','.join('(%s)' % rings(polygon) for polygon in g.parts))
+    return '%s(%s)' % (tag, ','.join(_wkt(member) for member in g.parts))
+
+def dumps(g):
+    '''
+    Returns the EWKT (or WKT when it has no SRID) of a geometry read by `parse` or `wkb.parse`.
+    '''
+
+    if g.srid is None:
+        return _wkt(g)
+    return 'SRID=%s;%s' % (g.srid, _wkt(g))
+
+
+class _WKTParser:
+    """
+    Private class to grab gml posList and geoType from WKT.
+
+    Modified from pysal which is Modified from...
+
+    - URL: http://dev.openlayers.org/releases/OpenLayers-2.7/lib/OpenLayers/Format/WKT.js
+    - Reg Ex Strings copied from OpenLayers.Format.WKT
+
+    Kept for backward compatibility; use `parse` instead.
+    """
+
+    regExes = {'typeStr': re.compile('^\s*([\w\s]+)\s*\(\s*(.*)\s*\)\s*$'),
+               'spaces': re.compile('\s+'),
+               'parenComma': re.compile('\)\s*,\s*\('),
+               'doubleParenComma': re.compile('\)\s*\)\s*,\s*\(\s*\('),  # can't use {2} here
+               'trimParens': re.compile('^\s*\(?(.*?)\)?\s*$')}
+
+    def __init__(self):
+        self.parsers = p = {}
+        p['point'] = self.Point
+        p['linestring'] = self.LineString
+        p['polygon'] = self.Polygon
+
+    def Point(self, geoStr):
+        return [geoStr.strip()]
+
+    def LineString(self, geoStr):
+        return geoStr.strip().split(',')
+
+    def Polygon(self, geoStr, outer_ring_only = True):
+        rings = self.regExes['parenComma'].split(geoStr.strip())
+        for i, ring in enumerate(rings):
+            ring = self.regExes['trimParens'].match(ring).groups()[0]
+            ring = self.LineString(ring)
+            rings[i] = ring
+            if outer_ring_only:
+                return rings[0]
+        return rings
+
+    def fromWKT(self, wkt, returnGeoType = False):
+        matches = self.regExes['typeStr'].match(wkt)
+        if matches:
+            geoType, geoStr = matches.groups()
+            geoType = geoType.lower().strip()
+            try:
+                if returnGeoType:
+                    return geoType, self.parsers[geoType](geoStr)
+                else:
+                    return self.parsers[geoType](geoStr)
+            except KeyError:
+                raise NotImplementedError("Unsupported WKT Type: %s" % geoType)
+        else:
+            return None
+
+    __call__ = fromWKT
+
+
+def _get_bbox(ewkt):
+    '''
+    A private method getting the bounding box [minx, miny, maxx, maxy] of an EWKT string
+    '''
+
+    bbox = parse(ewkt).bbox()
+    if bbox is None:
+        raise ValueError('Can not get the bounding box of an empty geometry: %s' % ewkt)
+    return list(bbox)
+
+def _get_centroid(ewkt):
+    '''
+    A private method getting the centroid [x, y] of an EWKT string
+    '''
+
+    centroid = parse(ewkt).centroid()
+    if centroid is None:
+        raise ValueError('Can not get the centroid of an empty geometry: %s' % ewkt)
+    return list(centroid)
+
+def _get_srs(ewkt, version = '1.3.0'):
+    '''
+    A private method to get a proper crs/ srs parameter for the WMS request
+    '''
+
+    code = ewkt.split(';')[0].split('=')[1].strip()
+    if version == '1.3.0':
+        return 'CRS', 'EPSG:%s' % str(code)
+    else:
+        return 'SRS', 'EPSG:%s' % str(code)
+
+def _get_srsName(ewkt):
+    '''
+    A private method to get a proper srsName for the WFS request from an EWKT string
+    '''
+
+    code = ewkt.split(';')[0].split('=')[1].strip()
+    return "urn:ogc:def:crs:EPSG::%s" % str(code)
+
+def _get_SRID_string(ewkt):
+    '''
+    A private method to get the EWKT projection string from an EWKT string
+    '''
+
+    return ewkt.split(';')[0].strip()
+
+def _get_WKT_geometry(ewkt):
+    '''
+    A private method to get the WKT geometry string from an EWKT string
+    '''
+
+    return ewkt.split(';')[1].strip()
+
+def _EWKT_from_WKT(srid, wkt ):
+    '''
+    Private method to get a valid EWKT geometry string from a WKT string and a EWKT SRID string
+    '''
+
+    return ';'.join([srid,wkt])
+
+def _posList(coordinates, dimensions, has_z):
+    '''
+    Private function; returns a gml posList for an array of coordinates. M values are left out, as GML has none.
+    '''
+
+    if dimensions == 2 or (dimensions == 3 and has_z):
+        return ' '.join(map(repr, coordinates))
+    columns = [coordinates[0::dimensions], coordinates[1::dimensions]]
+    if has_z:
+        columns.append(coordinates[2::dimensions])
+    return ' '.join(' '.join(map(repr, values)) for values in zip(*columns))
+
+def _gml(g, gml_id, srsName = None):
+    '''
+    Private function; returns a gml 3.2 element for a geometry read by `parse`.
+    '''
+
+    srs = ' srsName="%s"' % srsName if srsName else ''
+    if g.has_z:
+        srs = srs + ' srsDimension="3"'
+    pos = lambda coordinates: _posList(coordinates, g.dimensions, g.has_z)
+    polygon = lambda rings, gml_id, srs: ('<gml:Polygon gml:id="%s"%s><gml:exterior><gml:LinearRing><gml:posList>%s</gml:posList></gml:LinearRing></gml:exterior>%s</gml:Polygon>'
+                                          % (gml_id, srs, pos(rings[0]), ''.join('<gml:interior><gml:LinearRing><gml:posList>%s</gml:posList></gml:LinearRing></gml:interior>' % pos(ring) for ring in rings[1:])))
+
+    if g.type == 'POINT':
+        return '<gml:Point gml:id="%s"%s><gml:pos>%s</gml:pos></gml:Point>' % (gml_id, srs, pos(g.parts))
+    if g.type == 'LINESTRING':
+        return '<gml:LineString gml:id="%s"%s><gml:posList>%s</gml:posList></gml:LineString>' % (gml_id, srs, pos(g.parts))
+    if g.type == 'POLYGON':
+        return polygon(g.parts, gml_id, srs)
+    if g.type == 'MULTIPOINT':
+        return '<gml:MultiPoint gml:id="%s"%s>%s</gml:MultiPoint>' % (gml_id, srs, ''.join(
+               '<gml:pointMember><gml:Point gml:id="%s_%s"><gml:pos>%s</gml:pos></gml:Point></gml:pointMember>' % (gml_id, i + 1, pos(part)) for i, part in enumerate(g.parts)))
+    if g.type == 'MULTILINESTRING':
+        return '<gml:MultiCurve gml:id="%s"%s>%s</gml:MultiCurve>' % (gml_id, srs, ''.join(
+               '<gml:curveMember><gml:LineString gml:id="%s_%s"><gml:posList>%s</gml:posList></gml:LineString></gml:curveMember>' % (gml_id, i + 1, pos(part)) for i, part in enumerate(g.parts)))
+    if g.type == 'MULTIPOLYGON':
+        return '<gml:MultiSurface gml:id="%s"%s>%s</gml:MultiSurface>' % (gml_id, srs, ''.join(
+               '<gml:surfaceMember>%s</gml:surfaceMember>' % polygon(rings, '%s_%s' % (gml_id, i + 1), '') for i, rings in enumerate(g.parts)))
+    return '<gml:MultiGeometry gml:id="%s"%s>%s</gml:MultiGeometry>' % (gml_id, srs, ''.join(
+           '<gml:geometryMember>%s</gml:geometryMember>' % _gml(member, '%s_%s' % (gml_id, i + 1)) for i, member in enumerate(g.parts)))
+
+def _getGMLGeom(ewkt):
+    '''
+    Private method. returns a gml geometry for use in WFS spatial filtering.
+
+    Supports all geometry types `parse` does, including the MULTI types and polygons with holes.
+    '''
+
+    return _gml(parse(ewkt), 'P1', _get_srsName(ewkt))
+
+
+def _legacy_bbox(ewkt):
+    '''
+    Private function; the bounding box as computed before `parse` existed, for the benchmark below.
+    '''
+
+    _wktGeomType, _posLists = _WKTParser()(ewkt.split(';')[1], True)
+    bbox = [99999999,99999999,-99999999,-99999999]
+    for pair in _posLists:
+        x,y = pair.strip().split()
+        x = float(x)
+        y = float(y)
+        if x < bbox[0]:
+            bbox[0] = x
+        if x > bbox[2]:
+            bbox[2] = x
+        if y < bbox[1]:
+            bbox[1] = y
+        if y > bbox[3]:
+            bbox[3] = y
+    return bbox
+
+
+if __name__ == '__main__':
+    import timeit
+
+    ring = ','.join('%s %s' % (125000 + 1000 * math.cos(i * math.pi / 5000), 360000 + 1000 * math.sin(i * math.pi / 5000)) for i in range(10000))
+    cases = [('POINT', 'SRID=28992;POINT(125000.123 360000.456)', 20000),
+             ('POLYGON, 10000 vertices', 'SRID=28992;POLYGON((%s,%s))' % (ring, ring.split(',')[0]), 50)]
+    print('%-26s %14s %14s %8s' % ('bbox of', 'legacy (us)', 'parse (us)', 'speedup'))
+    for name, ewkt, number in cases:
+        assert _legacy_bbox(ewkt) == _get_bbox(ewkt)
+        legacy = min(timeit.repeat(lambda: _legacy_bbox(ewkt), number = number, repeat = 3)) / number * 1e6
+        new = min(timeit.repeat(lambda: _get_bbox(ewkt), number = number, repeat = 3)) / number * 1e6
+        print('%-26s %14.1f %14.1f %7.1fx' % (name, legacy, new, legacy / new))